@@ -76,7 +76,7 @@ __gbs_find_on_cmdline ()
 __gbs ()
 {
     subcommands="
-        build createimage remotebuild submit import export changelog chroot clone pull
+        build createimage remotebuild submit import export changelog chroot clone pull repo cache prefetch
     "
     common_opts="--upstream-tag= --upstream-branch= --squash-patches-until=
         --packaging-dir= --no-patch-export"
@@ -92,7 +92,7 @@ __gbs ()
 
     rb_opts="
         --base-obsprj= --target-obsprj= --spec= --commit= --include-all
-        --status --buildlog --profile= --arch= --repository=
+        --status --buildlog --profile= --arch= --repository= --no-status-check
     "
     sr_opts="
         --msg= --target= --commit= --spec= --sign --user-key= --remote= --tag=
@@ -103,15 +103,19 @@ __gbs ()
         --filter=  --no-patch-import
     "
     ex_opts="
-        --source-rpm --include-all --commit= --spec= --outdir=
+        --source-rpm --include-all --commit= --spec= --outdir= --no-status-check
     "
     ch_opts="--message= --since= --packaging-dir="
     chr_opts="--root"
     lbex_opts="--no-configure --exclude-from-file= --exclude= --binary-list= --binary-from-file=\
               --threads=  --package-list= --package-from-file= --incremental --overwrite \
-              --clean-once --debug --deps --rdeps $lb_opts"
+              --clean-once --debug --deps --rdeps --offline --refresh-repos --timings= --plan --export-template --prefetch $lb_opts"
     cl_opts="--upstream-branch= --all --depth="
     pull_opts="--upstream-branch= --force --depth="
+    repo_opts="--profile= --repository= --skip-conf-repos --json= --arch="
+    cache_opts="--buildroot= --profile= --quota= --dry-run"
+    prefetch_opts="--arch= --dist= --profile= --repository= --skip-conf-repos --buildroot=
+              --refresh-repos --commit= --include-all --packaging-dir= --exclude="
 
     subcommand="$(__gbs_find_on_cmdline "$subcommands")"
     if [ -z "$subcommand" ]; then
@@ -155,6 +159,21 @@ __gbs ()
             pull,--*)
                 __gbscomp "$pull_opts"
                 ;;
+            repo,--*)
+                __gbscomp "$repo_opts"
+                ;;
+            repo,*)
+                __gbscomp "bench query"
+                ;;
+            cache,--*)
+                __gbscomp "$cache_opts"
+                ;;
+            cache,*)
+                __gbscomp "list du prune"
+                ;;
+            prefetch,--*)
+                __gbscomp "$prefetch_opts"
+                ;;
             *)
                 COMPREPLY=()
                 ;;
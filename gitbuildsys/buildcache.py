@@ -0,0 +1,226 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+This module accounts disk space used by build roots and gbs temporary
+files, and evicts the least recently used of them.
+"""
+
+import os
+import re
+import glob
+import stat
+import time
+import errno
+import shutil
+
+from gitbuildsys.errors import GbsError
+from gitbuildsys.log import LOGGER as log
+from gitbuildsys.utils import sudo, mount_points, FileLock, format_size
+
+
+# metadata caches in gbs tmpdir, which limit their own sizes
+TMPDIR_KINDS = {'httpcache': 'http', 'buildconf': 'confstore',
+                'specs.db': 'specs', 'repoindex.db': 'repoindex',
+                'digests.db': 'digests', 'mirrors.json': 'mirrors'}
+
+# temp files and dirs in gbs tmpdir, named with pid of their owner
+TEMP_RE = re.compile(r'^(?:gbscache|mirrors)-(\d+)-|\.(\d+)\.tmp$')
+
+# temp files of processes gone are left by interrupted runs, they are
+# only removed after a while in case pid has been reused
+TEMP_MAX_AGE = 24 * 3600
+
+
+class CacheEntry(object):
+    """
+    A directory or file which takes disk space, it's removed by prune if
+    it's prunable. Entries under a build root are in use while a build
+    holds lock of the build root.
+    """
+
+    def __init__(self, path, kind, profile='-', arch='-', lock=None,
+                 prunable=True):
+        self.path = path
+        self.kind = kind
+        self.profile = profile
+        self.arch = arch
+        self.lock = lock
+        self.prunable = prunable
+        self.size, self.last_used = self._measure(path)
+
+    @staticmethod
+    def _measure(path):
+        """
+        Disk usage in bytes and the latest time of files being read or
+        changed. Access time of directories is ignored, as scanning them
+        changes it.
+        """
+        size = 0
+        last_used = 0
+        paths = [path]
+        for root, dirs, files in os.walk(path):
+            paths.extend(os.path.join(root, name) for name in dirs + files)
+        for name in paths:
+            try:
+                info = os.lstat(name)
+            except OSError:
+                continue
+            size += info.st_blocks * 512
+            if stat.S_ISDIR(info.st_mode):
+                last_used = max(last_used, info.st_mtime)
+            else:
+                last_used = max(last_used, info.st_atime, info.st_mtime)
+        return size, last_used
+
+    def in_use(self):
+        """
+        Entry used by a build, or build root being initialized, or with
+        anything mounted under it.
+        """
+        return (self.lock and FileLock(self.lock).held()) or \
+               os.path.exists(os.path.join(self.path, 'not-ready')) or \
+               bool(mount_points(self.path))
+
+    def remove(self):
+        """
+        Remove entry, build roots and bases are owned by root, and are
+        never removed with anything mounted under them.
+        """
+        points = mount_points(self.path)
+        if points:
+            raise GbsError('failed to remove %s, mounted: %s' % \
+                           (self.path, ' '.join(points)))
+        if self.kind not in ('root', 'base'):
+            try:
+                if os.path.isdir(self.path) and \
+                        not os.path.islink(self.path):
+                    shutil.rmtree(self.path)
+                else:
+                    os.unlink(self.path)
+                return
+            except OSError:
+                pass
+        if not sudo(['rm', '-rf', '--one-file-system', self.path]):
+            raise GbsError('failed to remove %s' % self.path)
+
+
+def get_build_lock(build_root):
+    """
+    Lock of build root, builds hold it shared while using the build root,
+    so entries in it are not pruned.
+    """
+    return FileLock(os.path.join(build_root, 'local', 'gbs', 'build.lock'),
+                    shared=True)
+
+def scan_build_root(build_root, lock=None):
+    """Find entries of local repos, caches and build roots in build root."""
+    local = os.path.join(build_root, 'local')
+    lock = lock or get_build_lock(build_root).path
+    entries = []
+    for path in sorted(glob.glob(os.path.join(local, 'repos', '*', '*'))):
+        entries.append(CacheEntry(path, 'repo',
+                                  os.path.basename(os.path.dirname(path)),
+                                  os.path.basename(path), lock=lock))
+    for path in sorted(glob.glob(os.path.join(local, 'sources', '*'))):
+        entries.append(CacheEntry(path, 'sources', os.path.basename(path),
+                                  lock=lock))
+    for path in sorted(glob.glob(os.path.join(local, 'cache', '*'))):
+        entries.append(CacheEntry(path, 'cache', lock=lock))
+    for path in sorted(glob.glob(os.path.join(local, 'scratch.*'))):
+        match = re.match(r'scratch\.(.+)\.\d+$', os.path.basename(path))
+        entries.append(CacheEntry(path, 'root',
+                                  arch=match.group(1) if match else '-',
+                                  lock=lock))
+    for path in sorted(glob.glob(os.path.join(local, 'bases', '*'))):
+        entries.append(CacheEntry(path, 'base',
+                                  arch=os.path.basename(path).split('.')[0],
+                                  lock=lock))
+
+    # build roots of archs built together by one gbs build, which holds
+    # lock of the top build root
+    for path in sorted(glob.glob(os.path.join(build_root, '*', 'local'))):
+        entries.extend(scan_build_root(os.path.dirname(path), lock))
+    return entries
+
+def _alive(pid):
+    """Check if process of pid exists."""
+    try:
+        os.kill(pid, 0)
+    except OSError, err:
+        return err.errno == errno.EPERM
+    return True
+
+def scan_tmpdir(tmpdir):
+    """
+    Find metadata caches, build confs and temp files left by interrupted
+    runs in gbs tmpdir. Only the temp files are prunable, temp files of
+    running processes or recent ones aren't listed.
+    """
+    entries = []
+    now = time.time()
+    for path in sorted(glob.glob(os.path.join(tmpdir, '*'))):
+        name = os.path.basename(path)
+        match = TEMP_RE.search(name)
+        if name in TMPDIR_KINDS:
+            entries.append(CacheEntry(path, TMPDIR_KINDS[name],
+                                      prunable=False))
+        elif match:
+            entry = CacheEntry(path, 'tmp')
+            if not _alive(int(match.group(1) or match.group(2))) and \
+                    now - entry.last_used > TEMP_MAX_AGE:
+                entries.append(entry)
+        elif name.endswith('.conf'):
+            # build confs of profiles used by builds
+            entries.append(CacheEntry(path, 'buildconf', prunable=False))
+        else:
+            entries.append(CacheEntry(path, 'other', prunable=False))
+    return entries
+
+def prune(entries, quota, keep=None, dry_run=False):
+    """
+    Remove least recently used entries until total size is under quota,
+    keep is a function telling entries not to be removed.
+    Returns: list of removed entries.
+    """
+    total = sum(entry.size for entry in entries)
+    removed = []
+    for entry in sorted(entries, key=lambda entry: entry.last_used):
+        if total <= quota:
+            break
+        if not entry.prunable or entry.in_use() or (keep and keep(entry)):
+            continue
+        log.info('removing %s (%s)' % (entry.path, format_size(entry.size)))
+        if not dry_run:
+            entry.remove()
+        total -= entry.size
+        removed.append(entry)
+    if total > quota:
+        log.warning('%s is still used after pruning, more than quota %s' % \
+                    (format_size(total), format_size(quota)))
+    return removed
+
+def parse_size(value):
+    """Parse size with optional K, M, G or T suffix to bytes."""
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$', value,
+                     re.IGNORECASE)
+    if not match:
+        raise ValueError('invalid size: %s' % value)
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** ['', 'K', 'M', 'G', 'T'].index(
+        unit.upper()))
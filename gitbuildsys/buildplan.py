@@ -0,0 +1,161 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+This module computes the dependency graph of packages in a tree from
+their BuildRequires and Provides, to tell how a build of them could
+be parallelized.
+"""
+
+import heapq
+
+
+class BuildPlan(object):
+    """
+    Dependency graph of packages to be built together. Only dependencies
+    provided by packages of the same tree are considered.
+    """
+
+    def __init__(self, specs):
+        """specs: list of SpecInfo objects of packages to be built"""
+        providers = {}
+        for spec in specs:
+            for provide in spec.packages + spec.provides:
+                providers.setdefault(provide, set()).add(spec.name)
+
+        self.names = [spec.name for spec in specs]
+        # BuildRequires to be installed from repos
+        self.external = sorted(set(
+            require for spec in specs for require in spec.buildrequires
+            if require not in providers and not require.startswith('rpmlib(')))
+        self.deps = {}
+        for spec in specs:
+            deps = set()
+            for require in spec.buildrequires:
+                deps.update(providers.get(require, []))
+            deps.discard(spec.name)
+            self.deps[spec.name] = deps
+        self.cycles = []
+        self.levels = self._levels()
+
+    def _levels(self):
+        """
+        Group packages into levels, each package only depends on packages
+        of lower levels. Packages in or depending on dependency cycles are
+        put into the last level, and the ones in cycles are recorded.
+        """
+        levels = []
+        done = set()
+        left = list(self.names)
+        while left:
+            level = [name for name in left if self.deps[name] <= done]
+            if not level:
+                self.cycles = [name for name in left if self._cyclic(name)]
+                levels.append(left)
+                break
+            levels.append(level)
+            done.update(level)
+            left = [name for name in left if name not in done]
+        return levels
+
+    def _cyclic(self, name):
+        """Check whether package depends on itself indirectly."""
+        seen = set()
+        stack = list(self.deps[name])
+        while stack:
+            dep = stack.pop()
+            if dep == name:
+                return True
+            if dep not in seen:
+                seen.add(dep)
+                stack.extend(self.deps[dep])
+        return False
+
+    @property
+    def max_parallelism(self):
+        """Most packages could be built at the same time."""
+        return max([len(level) for level in self.levels] + [0])
+
+    def critical_path(self, durations):
+        """
+        Longest chain of dependencies weighted by durations.
+        Returns: (list of package names, total duration)
+        """
+        finish = {}
+        previous = {}
+        for level in self.levels:
+            for name in level:
+                deps = [dep for dep in self.deps[name] if dep in finish]
+                before = max(deps, key=finish.get) if deps else None
+                previous[name] = before
+                finish[name] = durations[name] + \
+                               (finish[before] if before else 0)
+        if not finish:
+            return [], 0
+        name = max(self.names, key=finish.get)
+        total = finish[name]
+        path = []
+        while name:
+            path.append(name)
+            name = previous[name]
+        return list(reversed(path)), total
+
+    def _remaining(self, durations):
+        """Longest duration from start of each package to end of build."""
+        rdeps = dict((name, []) for name in self.names)
+        for name, deps in self.deps.iteritems():
+            for dep in deps:
+                rdeps[dep].append(name)
+        remaining = {}
+        for level in reversed(self.levels):
+            for name in level:
+                remaining[name] = durations[name] + \
+                    max([remaining.get(rdep, 0) for rdep in rdeps[name]] + [0])
+        return remaining
+
+    def estimate(self, durations, workers):
+        """
+        Simulate building with workers, packages on longer dependency
+        chains are started first. Dependencies between packages in cycles
+        are ignored.
+        Returns: estimated wall time.
+        """
+        remaining = self._remaining(durations)
+        cyclic = set(self.cycles)
+        waiting = dict((name, self.deps[name] - cyclic if name in cyclic
+                        else set(self.deps[name]))
+                       for name in self.names)
+        ready = [(-remaining[name], name) for name, deps
+                 in waiting.iteritems() if not deps]
+        heapq.heapify(ready)
+        for _priority, name in ready:
+            del waiting[name]
+
+        now = 0
+        running = []
+        while ready or running:
+            while ready and len(running) < workers:
+                name = heapq.heappop(ready)[1]
+                heapq.heappush(running, (now + durations[name], name))
+            now, finished = heapq.heappop(running)
+            for name, deps in waiting.items():
+                deps.discard(finished)
+                if not deps:
+                    del waiting[name]
+                    heapq.heappush(ready, (-remaining[name], name))
+        return now
@@ -20,22 +20,41 @@
 """
 
 import os
-import shutil
+import sys
 import pwd
+import pty
+import tty
 import re
+import errno
+import glob
+import time
+import json
+import hashlib
 import urlparse
+import threading
+import subprocess
+import multiprocessing
 
-from gitbuildsys.utils import Temp, RepoParser, read_localconf,\
-                              guess_spec, show_file_from_rev
+from gitbuildsys.utils import Temp, RepoParser, HTTPCache, RepoLock, \
+                              BuildConfStore, MirrorRanking, PhaseTimer, \
+                              FingerprintDB, BuildRootBases, link_or_copy, \
+                              read_localconf, read_meminfo, file_checksum, \
+                              guess_spec, show_file_from_rev, get_object_reader, \
+                              ignore_sigint
 from gitbuildsys.errors import GbsError, Usage
 from gitbuildsys.conf import configmgr
 from gitbuildsys.safe_url import SafeURL
 from gitbuildsys.cmd_export import get_packaging_dir
+from gitbuildsys.speccache import parse_spec
+from gitbuildsys.buildplan import BuildPlan
+from gitbuildsys.repoindex import get_repo_index
+from gitbuildsys.prefetch import buildroot_packages, get_jobs, download, \
+                                 prepare_cache_dirs
+from gitbuildsys.buildcache import scan_build_root, scan_tmpdir, prune, \
+                                   parse_size, get_build_lock
 from gitbuildsys.log import LOGGER as log
 
 from gbp.rpm.git import GitRepositoryError, RpmGitRepository
-from gbp import rpm
-from gbp.errors import GbpError
 
 
 CHANGE_PERSONALITY = {
@@ -58,8 +77,16 @@ SUPPORTEDARCHS = [
             'aarch64',
           ]
 
+# memory in KB a build worker needs if there's no history of packages
+MIN_WORKER_MEMORY = 1024 * 1024
+# seconds between memory usage samples while building
+MEMORY_SAMPLE_INTERVAL = 1
+# seconds a package takes to build if there's no history of packages
+DEFAULT_BUILD_DURATION = 60
+
 USERID = pwd.getpwuid(os.getuid())[0]
 TMPDIR = None
+TIMER = PhaseTimer()
 
 def formalize_build_conf(profile):
     ''' formalize build conf file name from profile'''
@@ -73,10 +100,66 @@ def formalize_build_conf(profile):
     # '-' is not allowed, so replace with '_'
     return profile.replace('-', '_')
 
-def get_binary_name_from_git(args, package_dirs):
-    ''' get binary rpm name from specified git package'''
+def get_specs_of_package(job):
+    '''parse all specs of one package, run in spec parsing workers'''
+    package_dir, packaging_dir, commit, include_all = job
+
+    specs = []
+    main_spec, rest_specs = guess_spec(package_dir, packaging_dir,
+                                       None, commit)
+    rest_specs.append(main_spec)
+    for spec in rest_specs:
+        if include_all:
+            spec_to_parse = os.path.join(package_dir, spec)
+        else:
+            content = show_file_from_rev(package_dir, spec, commit)
+            if content is None:
+                raise GbsError('failed to checkout %s from commit: %s' %
+                                (spec, commit))
+            tmp_spec = Temp(content=content)
+            spec_to_parse = tmp_spec.path
+
+        specs.append(parse_spec(spec_to_parse))
+
+    return specs
+
+def get_binary_names_of_package(job):
+    '''get binary rpm names of one package, run in spec parsing workers'''
+    return [spec.name for spec in get_specs_of_package(job)]
+
+def map_packages(func, jobs):
+    '''
+    Call func with job of each package, in worker processes if there are
+    several packages.
+    Returns: list of results in the same order as jobs.
+    '''
+    if len(jobs) < 2:
+        return [func(job) for job in jobs]
+
+    # spec parsing is CPU bound, so use processes rather than threads
+    workers = min(multiprocessing.cpu_count(), len(jobs))
+    log.info('parsing spec files of %d packages using %d processes ...' % \
+             (len(jobs), workers))
+    pool = multiprocessing.Pool(workers, ignore_sigint)
+    results = []
+    step = max(len(jobs) / 10, 1)
+    try:
+        # imap keeps results in the same order as jobs
+        for done, result in enumerate(pool.imap(func, jobs,
+                chunksize=max(len(jobs) / (workers * 4), 1)), 1):
+            results.append(result)
+            if done % step == 0 or done == len(jobs):
+                log.info('parsed spec files of %d/%d packages' % \
+                         (done, len(jobs)))
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return results
 
-    binary_list = []
+def get_package_jobs(args, package_dirs):
+    '''spec parsing jobs of package dirs for the commit to be built'''
     packaging_dir = get_packaging_dir(args)
     if args.commit:
         commit = args.commit
@@ -85,43 +168,262 @@ def get_binary_name_from_git(args, package_dirs):
     else:
         commit = 'HEAD'
 
-    for package_dir in package_dirs:
-        main_spec, rest_specs = guess_spec(package_dir, packaging_dir,
-                                                 None, commit)
-        rest_specs.append(main_spec)
-        for spec in rest_specs:
-            if args.include_all:
-                spec_to_parse = os.path.join(package_dir, spec)
-            else:
-                content = show_file_from_rev(package_dir, spec, commit)
-                if content is None:
-                    raise GbsError('failed to checkout %s from commit: %s' %
-                                    (spec, commit))
-                tmp_spec = Temp(content=content)
-                spec_to_parse = tmp_spec.path
+    return [(package_dir, packaging_dir, commit, args.include_all)
+            for package_dir in package_dirs]
 
-            try:
-                spec = rpm.SpecFile(spec_to_parse)
-            except GbpError, err:
-                raise GbsError('%s' % err)
-            binary_list.append(spec.name)
+def get_binary_name_from_git(args, package_dirs):
+    ''' get binary rpm name from specified git package'''
+    return sum(map_packages(get_binary_names_of_package,
+                            get_package_jobs(args, package_dirs)), [])
 
-    return binary_list
+def find_package_dirs(workdir):
+    '''git package dirs under workdir, the same as depanneur finds'''
+    workdir = os.path.abspath(workdir)
+    if os.path.exists(os.path.join(workdir, '.git')):
+        return [workdir]
+    package_dirs = []
+    for root, dirs, _files in os.walk(workdir):
+        if '.git' in dirs:
+            package_dirs.append(root)
+            dirs[:] = []
+        else:
+            dirs[:] = sorted(dirn for dirn in dirs if not dirn.startswith('.'))
+    return package_dirs
 
-def prepare_repos_and_build_conf(args, arch, profile):
-    '''generate repos and build conf options for depanneur'''
+def get_package_inputs(job):
+    '''
+    git tree and main spec of one package, run in spec parsing workers.
+    Returns: (package dir, tree id, SpecInfo), tree id and SpecInfo are
+    None if they are unknown.
+    '''
+    package_dir, packaging_dir, commit = job
+    try:
+        tree = get_object_reader(package_dir).info('%s^{tree}' % commit)
+        if not tree:
+            raise GbsError('no tree of %s found' % commit)
+        main_spec = guess_spec(package_dir, packaging_dir, None, commit)[0]
+        content = show_file_from_rev(package_dir, main_spec, commit)
+        if content is None:
+            raise GbsError('failed to checkout %s' % main_spec)
+        tmp_spec = Temp(content=content)
+        info = parse_spec(tmp_spec.path)
+    except (GbsError, OSError), err:
+        log.debug('failed to fingerprint %s: %s' % (package_dir, err))
+        return package_dir, None, None
+    return package_dir, tree[0], info
 
-    cmd_opts = []
-    cache = Temp(prefix=os.path.join(TMPDIR, 'gbscache'),
-                       directory=True)
+def find_built_rpms(build_root, arch, info, nvr):
+    '''
+    binaries of spec built as nvr by depanneur in local repos, relative to
+    build root. Only the version-release built is matched, repos keep
+    rpms of other releases built before.
+    '''
+    version, release = nvr.rsplit('-', 2)[1:]
+    repos = os.path.join(build_root, 'local', 'repos', '*', arch)
+    rpm_re = re.compile(r'(?:%s)-%s-%s\.[^.]+\.rpm$' % (
+        '|'.join(re.escape(name) for name in info.packages),
+        re.escape(version), re.escape(release)))
+    rpms = [rpm for rpm in glob.glob(os.path.join(repos, 'RPMS', '*-%s-%s.*'
+                                                  % (version, release)))
+            if rpm_re.match(os.path.basename(rpm))]
+    rpms += glob.glob(os.path.join(repos, 'SRPMS', '%s-%s-%s.src.rpm' % \
+                                   (info.name, version, release)))
+    return sorted(os.path.relpath(rpm, build_root) for rpm in rpms)
+
+def get_scratch_dir(build_root, arch, worker):
+    '''build root of depanneur worker'''
+    return os.path.join(build_root, 'local', 'scratch.%s.%d' % (arch, worker))
+
+def get_build_root_bases(build_root):
+    '''bases of clean build roots kept under build root'''
+    return BuildRootBases(os.path.join(build_root, 'local', 'bases'))
+
+def restore_build_roots(build_root, arch, key, workers):
+    '''
+    make clean build roots of workers from base of inputs key.
+    Returns: False if there's no base or it can't be restored.
+    '''
+    bases = get_build_root_bases(build_root)
+    base = bases.get(arch, key)
+    if not base or not workers:
+        return False
+    log.info('making clean build roots of %s from %s' % (arch, base))
+    for worker in range(workers):
+        if not bases.restore(arch, key, get_scratch_dir(build_root, arch,
+                                                        worker)):
+            log.warning('failed to restore build root from %s, build root '
+                        'will be installed again' % base)
+            return False
+    return True
+
+def get_template_archive(template_dir, arch, key):
+    '''path of build root template archive of arch and inputs key'''
+    return os.path.join(template_dir, '%s-%s.tar.gz' % (arch, key))
+
+def import_template(template_dir, build_root, arch, key):
+    '''import base of build roots from template archive if there's one'''
+    bases = get_build_root_bases(build_root)
+    archive = get_template_archive(template_dir, arch, key)
+    if bases.get(arch, key) or not os.path.exists(archive):
+        return
+    log.info('importing build root template %s' % archive)
+    if not bases.extract(arch, key, archive):
+        log.warning('failed to import build root template %s' % archive)
+
+def export_template(template_dir, build_root, arch, key):
+    '''export base of build roots as template archive'''
+    bases = get_build_root_bases(build_root)
+    if not bases.get(arch, key) and not bases.save(arch, key,
+            get_scratch_dir(build_root, arch, 0)):
+        log.warning('no initialized build root of %s to be exported' % arch)
+        return
+    archive = get_template_archive(template_dir, arch, key)
+    if not os.path.exists(template_dir):
+        os.makedirs(template_dir)
+    if bases.archive(arch, key, archive):
+        log.info('build root template has been exported to %s' % archive)
+    else:
+        log.warning('failed to export build root template to %s' % archive)
+
+def can_skip_unchanged(args):
+    '''
+    check if packages built from the same inputs can be skipped. inputs
+    are unknown without repos, builds from working tree (uncommitted
+    changes, incremental) have no git tree, and specs could come from
+    another branch
+    '''
+    return not (args.noinit or args.overwrite or args.include_all or
+                args.incremental or
+                configmgr.get('packaging_branch', 'orphan-devel'))
+
+def fingerprint_packages(args, workdir, arch_inputs):
+    '''
+    Fingerprint build inputs of packages under workdir for each arch,
+    they are git tree of the package, build conf, repo revisions and
+    options changing the result of build.
+    Returns: dict of arch to list of (package dir, fingerprint, SpecInfo),
+    fingerprint is None for packages which can't be fingerprinted.
+    '''
+    commit = args.commit or 'HEAD'
+    jobs = [(package_dir, get_packaging_dir(args), commit)
+            for package_dir in find_package_dirs(workdir)]
+    packages = map_packages(get_package_inputs, jobs)
+
+    options = [get_packaging_dir(args), args.spec, args.baselibs,
+               args.extra_packs, args.debug] + sorted(args.define or [])
+    fingerprints = {}
+    for arch, inputs in arch_inputs.iteritems():
+        common = hashlib.sha1('\0'.join(str(item) for item in
+                                        [arch] + options + inputs))
+        fingerprints[arch] = []
+        for package_dir, tree, info in packages:
+            if tree is None:
+                fingerprints[arch].append((package_dir, None, None))
+                continue
+            sha = common.copy()
+            sha.update(tree)
+            fingerprints[arch].append((package_dir, sha.hexdigest(), info))
+    return fingerprints
+
+def get_gbs_state_dir(build_root):
+    '''directory under build root where gbs keeps its own build states'''
+    return os.path.join(build_root, 'local', 'gbs')
+
+def get_metadata_temp():
+    '''temp dir of metadata fetched by a run, named with pid of the run'''
+    return Temp(prefix=os.path.join(TMPDIR, 'gbscache-%d-' % os.getpid()),
+                directory=True)
+
+def transfers_by_repo(repos, stats):
+    '''sum up transfers made by RepoParser for each repo'''
+    result = {}
+    for stat in stats:
+        origins = [repo for repo in repos if stat['url'].startswith(repo)]
+        origin = str(max(origins, key=len)) if origins else 'other'
+        entry = result.setdefault(origin, {'requests': 0, 'bytes': 0,
+                                           'transfer_time': 0.0})
+        entry['requests'] += 1
+        entry['bytes'] += stat['size']
+        entry['transfer_time'] += stat['total']
+    return result
+
+def resolve_repos(args, archs, repos, lock, mirrors=None):
+    '''get repo urls of archs and build conf from repos, use locked results
+    if they are still valid. Repos are parsed once for all archs.
+    Returns: (dict of arch to repo urls, build conf or None)'''
+    resolved = {}
+    buildconf = None
+    if not args.refresh_repos:
+        # --offline trusts the lock whatever its age is
+        ttl = 0 if args.offline else configmgr.get_int('repo_lock_ttl')
+        with TIMER.phase('repo lock'):
+            for arch in archs:
+                locked = lock.load(arch, ttl)
+                if locked:
+                    resolved[arch], buildconf = locked
+        if len(resolved) == len(archs):
+            log.info('using repositories resolved before, specify '
+                     '--refresh-repos to resolve them again')
+            return resolved, buildconf
+    missing = [arch for arch in archs if arch not in resolved]
+    if args.offline:
+        raise GbsError('no resolved repositories of arch %s found in %s, '
+                       'please build without --offline first' % \
+                       (','.join(missing), lock.path))
+
+    cache = get_metadata_temp()
     cachedir = cache.path
     if not os.path.exists(cachedir):
         os.makedirs(cachedir)
-    log.info('generate repositories ...')
 
+    # metadata cache survives between builds, unchanged files are
+    # revalidated by conditional requests instead of being downloaded
+    httpcache = HTTPCache(os.path.join(TMPDIR, 'httpcache'),
+                          configmgr.get_int('http_cache_ttl'),
+                          configmgr.get_int('http_cache_size') * 1024 * 1024)
+    confstore = BuildConfStore(os.path.join(TMPDIR, 'buildconf'))
+    stats = []
+    with TIMER.phase('RepoParser') as extra:
+        repoparser = RepoParser(repos, cachedir, httpcache, confstore,
+                                mirrors, stats)
+        extra['repos'] = transfers_by_repo(repos, stats)
+    for arch in missing:
+        resolved[arch] = repoparser.get_repos_by_arch(arch)
+        if resolved[arch]:
+            lock.save(arch, resolved[arch],
+                      repoparser.get_revisions(resolved[arch]),
+                      repoparser.buildconf)
+    return resolved, lock.conf_path if repoparser.buildconf else None
+
+def repo_revision(url, revisions):
+    '''revision of repo content, to tell whether it has been changed'''
+    if str(url) in revisions:
+        return revisions[str(url)]
+    if url.is_local():
+        repomd = os.path.join(url, 'repodata', 'repomd.xml')
+        if os.path.exists(repomd):
+            return file_checksum(repomd)
+        if os.path.exists(url):
+            return '%d' % os.path.getmtime(url)
+    return ''
+
+def get_repos(args, profile, build_root):
+    '''
+    get repos from profile and command line, configured repos are replaced
+    by their best mirrors
+    Returns: (list of repo urls, MirrorRanking, RepoLock of these repos)
+    '''
+    mirrors = MirrorRanking(os.path.join(TMPDIR, 'mirrors.json'),
+                            configmgr.get_int('mirror_probe_ttl'))
     if args.skip_conf_repos:
         repos = []
     else:
+        for repo in profile.repos:
+            if repo.mirrors:
+                mirrors.add([repo.url] + repo.mirrors)
+        if not args.offline:
+            with TIMER.phase('mirror probe'):
+                mirrors.probe()
         repos = [i.url for i in profile.repos]
 
     if args.repositories:
@@ -142,12 +444,30 @@ def prepare_repos_and_build_conf(args, arch, profile):
     if not repos:
         raise GbsError('No package repository specified.')
 
-    repoparser = RepoParser(repos, cachedir)
-    repourls = repoparser.get_repos_by_arch(arch)
-    if not repourls:
-        raise GbsError('no available repositories found for arch %s under the '
-                       'following repos:\n%s' % (arch, '\n'.join(repos)))
-    cmd_opts += [('--repository=%s' % url.full) for url in repourls]
+    # repos are locked as configured, whichever mirror is the best
+    sanitized_profile_name = re.sub("[^a-zA-Z0-9:._-]", "_", profile.name)
+    lock = RepoLock(os.path.join(get_gbs_state_dir(build_root),
+                                 '%s.repolock' % sanitized_profile_name),
+                    repos, mirrors)
+    return [mirrors.best(url) for url in repos], mirrors, lock
+
+def resolve_build_repos(args, archs, profile, build_root):
+    '''
+    resolve repos of each arch and get build conf from command line, profile
+    or repos
+    Returns: (dict of arch to repo urls, RepoLock, build conf file name)
+    '''
+
+    log.info('generate repositories ...')
+
+    repos, mirrors, lock = get_repos(args, profile, build_root)
+    resolved, fetched_buildconf = resolve_repos(args, archs, repos, lock,
+                                                mirrors)
+    for arch in archs:
+        if not resolved[arch]:
+            raise GbsError('no available repositories found for arch %s '
+                           'under the following repos:\n%s' % \
+                           (arch, '\n'.join(repos)))
 
     profile = get_profile(args)
     profile_name = formalize_build_conf(profile.name.replace('profile.', '', 1))
@@ -158,17 +478,21 @@ def prepare_repos_and_build_conf(args, arch, profile):
     elif profile.buildconf:
         buildconf = profile.buildconf
     else:
-        if repoparser.buildconf is None:
+        if fetched_buildconf is None:
             raise GbsError('failed to get build conf from repos, please '
                            'use snapshot repo or specify build config using '
                            '-D option')
         else:
-            buildconf = repoparser.buildconf
+            buildconf = fetched_buildconf
             log.info('build conf has been downloaded at:\n      %s' \
                        % distconf)
     try:
-        shutil.copy(buildconf, distconf)
-    except IOError, err:
+        with TIMER.phase('build conf copy'):
+            # confs given by user are copied, so their only copy isn't
+            # replaced or changed through a link
+            link_or_copy(buildconf, distconf,
+                         link=buildconf == fetched_buildconf)
+    except (IOError, OSError), err:
         raise GbsError("Failed to copy build conf: %s" % (str(err)))
 
     if not os.path.exists(distconf):
@@ -181,11 +505,30 @@ def prepare_repos_and_build_conf(args, arch, profile):
     if not distconf.endswith('.conf') or '-' in os.path.basename(distconf):
         raise GbsError("build config file must end with .conf, and can't "
                        "contain '-'")
+    return resolved, lock, distconf
+
+def prepare_repos_and_build_conf(archs, resolved, lock, distconf):
+    '''
+    generate repos and build conf options for depanneur of each arch
+    Returns: (dict of arch to options, dict of arch to build inputs)
+    '''
     dist = os.path.basename(distconf)[:-len('.conf')]
-    cmd_opts += ['--dist=%s' % dist]
-    cmd_opts += ['--configdir=%s' % os.path.dirname(distconf)]
+    confsum = file_checksum(distconf)
+    cmd_opts = {}
+    inputs = {}
+    for arch in archs:
+        cmd_opts[arch] = [('--repository=%s' % url.full)
+                          for url in resolved[arch]]
+        # the same repo content served by another mirror is the same input
+        revisions = lock.revisions(arch)
+        inputs[arch] = ['%s %s' % (lock.canonical(url),
+                                   repo_revision(url, revisions))
+                        for url in resolved[arch]]
+        cmd_opts[arch] += ['--dist=%s' % dist]
+        cmd_opts[arch] += ['--configdir=%s' % os.path.dirname(distconf)]
+        inputs[arch].append(confsum)
 
-    return cmd_opts
+    return cmd_opts, inputs
 
 def prepare_depanneur_opts(args):
     '''generate extra options for depanneur'''
@@ -242,6 +585,436 @@ def prepare_depanneur_opts(args):
 
     return cmd_opts
 
+class BuildMonitor(object):
+    """
+    Follow depanneur output line by line and record when each package
+    starts and finishes building. Memory samples taken while packages
+    are building are shared evenly by them to estimate their peak
+    memory usage.
+    """
+
+    ANSI_RE = re.compile(r'\x1b\[[0-9;]*m')
+    START_RE = re.compile(r'\*\*\* (?:\[\d+/\d+\] )?building (\S+) (\S+) \S+ '
+                          r'\(worker: (\d+)\)')
+    FINISH_RE = re.compile(r'finished (?:incremental )?building (\S+)')
+    FAIL_RE = re.compile(r'failed to build (\S+)')
+
+    def __init__(self):
+        self.packages = {}
+        self.order = []
+        self.lock = threading.Lock()
+
+    def _find(self, name):
+        """Find package by name or name-version-release."""
+        if name in self.packages:
+            return self.packages[name]
+        return self.packages.get(name.rsplit('-', 2)[0])
+
+    def feed(self, line):
+        """Parse one line of output."""
+        with self.lock:
+            self._feed(self.ANSI_RE.sub('', line))
+
+    def _feed(self, line):
+        """Parse one line of output without color codes."""
+        match = self.START_RE.search(line)
+        if match:
+            nvr, arch, worker = match.groups()
+            name = nvr.rsplit('-', 2)[0]
+            if name not in self.packages:
+                self.order.append(name)
+            self.packages[name] = {'name': name, 'nvr': nvr, 'arch': arch,
+                                   'worker': int(worker),
+                                   'start': time.time(), 'end': None,
+                                   'status': 'building', 'peak_memory': 0}
+            return
+
+        for regex, status in ((self.FINISH_RE, 'succeeded'),
+                              (self.FAIL_RE, 'failed')):
+            match = regex.search(line)
+            if match:
+                pkg = self._find(match.group(1))
+                if pkg and pkg['status'] == 'building':
+                    pkg['end'] = time.time()
+                    pkg['status'] = status
+                return
+
+    def building(self):
+        """Number of packages being built."""
+        with self.lock:
+            return len([pkg for pkg in self.packages.values()
+                        if pkg['status'] == 'building'])
+
+    def sample(self, share):
+        """Account memory in KB to each building package."""
+        with self.lock:
+            for pkg in self.packages.values():
+                if pkg['status'] == 'building':
+                    pkg['peak_memory'] = max(pkg['peak_memory'], share)
+
+    def finish(self, retcode):
+        """
+        Close packages still building when depanneur exits.
+        Returns: list of package records in starting order.
+        """
+        now = time.time()
+        for pkg in self.packages.values():
+            if pkg['status'] == 'building':
+                pkg['end'] = now
+                pkg['status'] = 'failed' if retcode else 'unknown'
+        for pkg in self.packages.values():
+            pkg['duration'] = pkg['end'] - pkg['start']
+        return [self.packages[name] for name in self.order]
+
+def format_build_summary(packages):
+    """Per package timing and status table, slowest first."""
+    lines = ['%-40s %-8s %-10s %10s' % ('PACKAGE', 'ARCH', 'STATUS',
+                                        'TIME(s)')]
+    for pkg in sorted(packages, key=lambda pkg: -pkg['duration']):
+        lines.append('%-40s %-8s %-10s %10.1f' % (pkg['name'], pkg['arch'],
+                                                  pkg['status'],
+                                                  pkg['duration']))
+    return '\n'.join(lines)
+
+def used_memory():
+    '''memory used by system in KB, None if it's unknown'''
+    meminfo = read_meminfo()
+    if 'MemAvailable' not in meminfo:
+        return None
+    return meminfo['MemTotal'] - meminfo['MemAvailable']
+
+def load_history(state_dir, kind, arch):
+    '''
+    values of packages built before in the build root, kind is memory for
+    peak memory in KB or duration for build time in seconds
+    '''
+    try:
+        with open(os.path.join(state_dir, '%s.%s.json' % (kind, arch))) \
+                as fobj:
+            return json.load(fobj)
+    except (IOError, ValueError):
+        return {}
+
+def save_history(state_dir, kind, arch, values):
+    '''merge values of packages into history'''
+    history = load_history(state_dir, kind, arch)
+    history.update(values)
+    with open(os.path.join(state_dir, '%s.%s.json' % (kind, arch)), 'w') \
+            as fobj:
+        json.dump(history, fobj, indent=2, sort_keys=True)
+
+def get_auto_threads(histories):
+    '''
+    number of build workers of each arch fitting both CPUs and available
+    memory, which are shared evenly by archs built at the same time.
+    histories are peak memory of packages built before for each arch.
+    '''
+    # each arch gets at least a CPU, even if there are more archs
+    cpus = max(1, multiprocessing.cpu_count() / len(histories))
+    available = read_meminfo().get('MemAvailable')
+    if not available:
+        log.info('using %d threads for %d CPUs' % (cpus, cpus))
+        return cpus
+    available /= len(histories)
+
+    # the most memory hungry package seen so far decides, as any of
+    # them could be built by all workers at the same time
+    per_worker = max(sum([history.values() for history in histories], []) +
+                     [MIN_WORKER_MEMORY])
+    threads = max(1, min(cpus, available / per_worker))
+    log.info('using %d threads for %d CPUs and %dMB available memory, '
+             '%dMB per worker' % (threads, cpus, available / 1024,
+                                  per_worker / 1024))
+    return threads
+
+def open_output():
+    '''
+    open a pty for output of depanneur if gbs is run on a terminal, so it
+    and the tools it runs keep line buffering as on a terminal, output of
+    a pipe is block buffered. Redirected output of gbs gets a pipe, so no
+    colors or other terminal only output end up in logs
+    Returns: (fd for child, file to read), or (None, None) without pty
+    '''
+    if not sys.stdout.isatty():
+        return None, None
+    try:
+        master, slave = pty.openpty()
+    except OSError, err:
+        log.debug('failed to open pty, output is piped: %s' % err)
+        return None, None
+    try:
+        # neither newline translation nor signals from this terminal
+        tty.setraw(slave)
+    except tty.error, err:
+        log.debug('failed to set pty to raw mode: %s' % err)
+    return slave, os.fdopen(master, 'rb', 0)
+
+def follow_output(output, monitor, prefix, lock):
+    '''copy output of depanneur to stdout and track package builds'''
+    try:
+        # readline() instead of iterating the file, which reads ahead
+        for line in iter(output.readline, ''):
+            with lock:
+                sys.stdout.write(prefix + line)
+                sys.stdout.flush()
+            monitor.feed(line)
+    except IOError, err:
+        # reading pty gives EIO once all writers are gone
+        if err.errno != errno.EIO:
+            raise
+    finally:
+        output.close()
+
+def sample_memory(monitors, baseline, stop):
+    '''share memory used by system evenly to packages being built'''
+    while not stop.wait(MEMORY_SAMPLE_INTERVAL):
+        used = used_memory()
+        building = sum(monitor.building() for monitor in monitors)
+        if used is None or not building:
+            continue
+        share = max(used - baseline, 0) / building
+        for monitor in monitors:
+            monitor.sample(share)
+
+def save_build_timings(state_dir, name, report):
+    '''save build timings report into gbs state dir'''
+    fname = os.path.join(state_dir, 'timings.%s.json' % name)
+    try:
+        if not os.path.exists(state_dir):
+            os.makedirs(state_dir)
+        with open(fname, 'w') as fobj:
+            json.dump(report, fobj, indent=2)
+        log.info('build timings have been saved to %s' % fname)
+    except (IOError, OSError), err:
+        log.warning('failed to save build timings: %s' % err)
+
+def run_depanneur(jobs):
+    """
+    Run depanneur of each (arch, cmd, build_root) job at the same time,
+    stream their output and track package builds.
+    Returns: dict of arch to (exit code, package records).
+    """
+    baseline = used_memory() or 0
+    output_lock = threading.Lock()
+    procs, monitors, readers = [], [], []
+    for arch, cmd, build_root in jobs:
+        log.debug("running command: %s" % ' '.join(cmd))
+        env = dict(os.environ, TIZEN_BUILD_ROOT=os.path.abspath(build_root))
+        slave, output = open_output()
+        try:
+            proc = subprocess.Popen(cmd, stderr=subprocess.STDOUT, env=env,
+                                    stdout=subprocess.PIPE if slave is None
+                                    else slave)
+        except OSError, err:
+            if output is not None:
+                output.close()
+            for started in procs:
+                started.terminate()
+            raise GbsError('failed to run %s: %s' % (cmd[0], err))
+        finally:
+            if slave is not None:
+                # only depanneur writes, so reading ends when it exits
+                os.close(slave)
+        if output is None:
+            output = proc.stdout
+        # prefix output lines with arch if they are interleaved
+        prefix = '[%s] ' % arch if len(jobs) > 1 else ''
+        monitor = BuildMonitor()
+        reader = threading.Thread(target=follow_output,
+                                  args=(output, monitor, prefix, output_lock))
+        reader.daemon = True
+        reader.start()
+        procs.append(proc)
+        monitors.append(monitor)
+        readers.append(reader)
+
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample_memory,
+                               args=(monitors, baseline, stop))
+    sampler.daemon = True
+    sampler.start()
+
+    try:
+        for reader in readers:
+            # join with timeout, or KeyboardInterrupt is not delivered
+            while reader.is_alive():
+                reader.join(1)
+    finally:
+        retcodes = [started.wait() for started in procs]
+        stop.set()
+        sampler.join()
+
+    results = {}
+    for (arch, cmd, build_root), monitor, retcode in zip(jobs, monitors,
+                                                         retcodes):
+        packages = monitor.finish(retcode)
+        results[arch] = (retcode, packages)
+        if packages:
+            state_dir = get_gbs_state_dir(build_root)
+            save_build_timings(state_dir, arch, {'command': cmd,
+                                                 'retcode': retcode,
+                                                 'packages': packages})
+            try:
+                save_history(state_dir, 'memory', arch,
+                             dict((pkg['name'], pkg['peak_memory'])
+                                  for pkg in packages if pkg['peak_memory']))
+                save_history(state_dir, 'duration', arch,
+                             dict((pkg['name'], pkg['duration'])
+                                  for pkg in packages
+                                  if pkg['status'] == 'succeeded'))
+            except (IOError, OSError), err:
+                log.warning('failed to save build history: %s' % err)
+    return results
+
+def get_specs(args, workdir):
+    '''SpecInfo of packages under workdir, which are not excluded'''
+    excluded = set((args.exclude or '').split(','))
+    return [spec for specs in map_packages(get_specs_of_package,
+                get_package_jobs(args, find_package_dirs(workdir)))
+            for spec in specs if spec.name not in excluded]
+
+def get_prefetch_jobs(args, workdir, archs, resolved, lock, distconf,
+                      arch_roots):
+    '''
+    find packages of build conf installed into every build root, and direct
+    BuildRequires of packages to be built, which are not in the package
+    cache of each arch yet
+    Returns: list of download jobs
+    '''
+    names = buildroot_packages(distconf)
+    names += [name for name in BuildPlan(get_specs(args, workdir)).external
+              if name not in names]
+    index = get_repo_index()
+    cache = get_metadata_temp()
+    parser = RepoParser([], cache.path)
+    jobs = []
+    for arch in archs:
+        with TIMER.phase('repo index'):
+            parser.update_index(resolved[arch], index, lock.revisions(arch))
+        arch_jobs, cached = get_jobs(resolved[arch], names, os.path.join(
+            arch_roots[arch], 'local', 'cache'), index)
+        log.info('%d packages of %s are cached, %d to be prefetched' % \
+                 (cached, arch, len(arch_jobs)))
+        jobs.extend(arch_jobs)
+    return jobs
+
+def prefetch_packages(jobs):
+    '''download packages of jobs, failures are left to depanneur'''
+    start = time.time()
+    try:
+        failed = download(jobs)
+    except (IOError, OSError, GbsError), err:
+        log.warning('failed to prefetch packages: %s' % err)
+        return
+    log.info('%d packages have been prefetched in %.1fs' % \
+             (len(jobs) - len(failed), time.time() - start))
+
+def check_build_requires(args, plan, archs, profile, build_root):
+    '''
+    Look up BuildRequires not provided by packages to be built in the repo
+    index of each arch, report the ones no repo provides.
+    '''
+    repos, mirrors, lock = get_repos(args, profile, build_root)
+    resolved, _buildconf = resolve_repos(args, archs, repos, lock, mirrors)
+    index = get_repo_index()
+    for arch in archs:
+        if not args.offline:
+            cache = get_metadata_temp()
+            with TIMER.phase('repo index'):
+                RepoParser([], cache.path).update_index(
+                    resolved[arch], index, lock.revisions(arch))
+        if not [url for url in resolved[arch] if index.revision(url)]:
+            log.warning('no repository of %s is indexed, BuildRequires '
+                        'are not checked' % arch)
+            continue
+        missing = index.missing(plan.external, resolved[arch])
+        print 'BuildRequires from repos of %s: %d, not found: %d' % \
+              (arch, len(plan.external), len(missing))
+        if missing:
+            log.warning('the following BuildRequires are not provided by '
+                        'packages or repos of %s:\n   %s' % \
+                        (arch, '\n   '.join(missing)))
+
+def show_build_plan(args, workdir, arch_roots, profile, build_root):
+    '''
+    Print dependency levels of packages to be built, and estimate build
+    time of each arch from durations of packages built before. BuildRequires
+    are checked against repos unless --noinit is given.
+    '''
+    specs = get_specs(args, workdir)
+    if not specs:
+        raise GbsError('no package found under %s' % workdir)
+    plan = BuildPlan(specs)
+
+    print 'build plan of %d packages:' % len(plan.names)
+    for num, level in enumerate(plan.levels, 1):
+        print '  level %d: %s' % (num, ' '.join(sorted(level)))
+    if plan.cycles:
+        log.warning('the following packages have cyclic dependencies:\n'
+                    '   %s' % '\n   '.join(sorted(plan.cycles)))
+    print 'dependency levels: %d' % len(plan.levels)
+    print 'maximum useful parallelism: %d' % plan.max_parallelism
+
+    workers = [2 ** i for i in range(8) if 2 ** i < plan.max_parallelism]
+    workers = sorted(set(workers + [plan.max_parallelism,
+                                    max(args.threads, 1)]))
+    for arch in sorted(arch_roots):
+        history = load_history(get_gbs_state_dir(arch_roots[arch]),
+                               'duration', arch)
+        known = sorted(history[name] for name in plan.names
+                       if name in history)
+        # packages never built before are as slow as the median one
+        default = known[len(known) / 2] if known else DEFAULT_BUILD_DURATION
+        durations = dict((name, history.get(name, default))
+                         for name in plan.names)
+        path, length = plan.critical_path(durations)
+        print 'critical path of %s (%.1fs): %s' % (arch, length,
+                                                   ' -> '.join(path))
+        print 'estimated build time of %s (%d/%d packages built before):' % \
+              (arch, len(known), len(plan.names))
+        print '  %-8s %10s' % ('THREADS', 'TIME(s)')
+        for num in workers:
+            print '  %-8d %10.1f' % (num, plan.estimate(durations, num))
+
+    if plan.external and not args.noinit:
+        check_build_requires(args, plan, sorted(arch_roots), profile,
+                             build_root)
+
+def prune_cache(build_root, since):
+    '''evict caches least recently used down to cache_quota, except the
+    ones used since the build started'''
+    quota = configmgr.get('cache_quota')
+    if not quota:
+        log.warning('cache_auto_prune is set without cache_quota')
+        return
+    try:
+        quota = parse_size(quota)
+    except ValueError, err:
+        raise GbsError('bad cache_quota: %s' % err)
+    entries = scan_build_root(build_root) + scan_tmpdir(TMPDIR)
+    prune(entries, quota, keep=lambda entry: entry.last_used >= since)
+
+def get_build_root(args, profile):
+    """
+    Get the build root to be used
+    """
+    if args.buildroot:
+        build_root = args.buildroot
+    elif 'TIZEN_BUILD_ROOT' in os.environ:
+        build_root = os.environ['TIZEN_BUILD_ROOT']
+    elif profile.buildroot:
+        build_root = profile.buildroot
+    else:
+        build_root = configmgr.get('buildroot', 'general')
+    build_root = os.path.expanduser(build_root)
+    # transform variables from shell to python convention ${xxx} -> %(xxx)s
+    build_root = re.sub(r'\$\{([^}]+)\}', r'%(\1)s', build_root)
+    sanitized_profile_name = re.sub("[^a-zA-Z0-9:._-]", "_", profile.name)
+    tmpdir = os.path.join(configmgr.get('tmpdir', 'general'),
+                          '%s-gbs' % USERID)
+    return build_root % {'tmpdir': tmpdir,
+                         'profile': sanitized_profile_name}
+
 def get_profile(args):
     """
     Get the build profile to be used
@@ -255,18 +1028,71 @@ def get_profile(args):
     return profile
 
 
+def get_build_archs(args):
+    """
+    Get archs to be built from comma separated -A, default is system arch
+    """
+    if args.arch:
+        buildarchs = [arch.strip() for arch in args.arch.split(',')
+                      if arch.strip()]
+    else:
+        buildarchs = [os.uname()[4]]
+        log.info('No arch specified, using system arch: %s' % buildarchs[0])
+
+    for buildarch in buildarchs:
+        if not buildarch in SUPPORTEDARCHS:
+            raise GbsError('arch %s not supported, supported archs are: %s ' % \
+                           (buildarch, ','.join(SUPPORTEDARCHS)))
+    if len(set(buildarchs)) != len(buildarchs):
+        raise Usage('arch can\'t be specified more than once: %s' % args.arch)
+    return buildarchs
+
+def get_arch_roots(build_root, archs):
+    """
+    Get build root of each arch, archs built together get their own build
+    roots under build root
+    """
+    if len(archs) > 1:
+        return dict((arch, os.path.join(build_root, arch)) for arch in archs)
+    return {archs[0]: build_root}
+
+def init_run():
+    """Set up gbs tmpdir and phase timer of a new run"""
+    global TMPDIR, TIMER
+    TMPDIR = os.path.join(configmgr.get('tmpdir', 'general'), '%s-gbs' % USERID)
+    TIMER = PhaseTimer()
+    TIMER.phases.extend(configmgr.timer.phases)
+
 def main(args):
     """gbs build entry point."""
 
-    global TMPDIR
-    TMPDIR = os.path.join(configmgr.get('tmpdir', 'general'), '%s-gbs' % USERID)
+    init_run()
+    try:
+        build(args)
+    finally:
+        if args.timings:
+            TIMER.save(args.timings)
+            log.info('phase timings have been saved to %s' % args.timings)
 
+def build(args):
+    """Do the real work of gbs build."""
+
+    start = time.time()
     if args.commit and args.include_all:
         raise Usage('--commit can\'t be specified together with '\
                     '--include-all')
     if args.noinit and (args.clean or args.clean_once):
         raise Usage('--noinit can\'t be specified together with '\
                     '--clean or --clean-once')
+    if args.offline and args.refresh_repos:
+        raise Usage('--offline can\'t be specified together with '\
+                    '--refresh-repos')
+    if args.prefetch and (args.noinit or args.offline):
+        raise Usage('--prefetch can\'t be specified together with '\
+                    '--noinit or --offline')
+    if args.export_template and args.noinit:
+        raise Usage('--export-template can\'t be specified together with '
+                    '--noinit')
     workdir = args.gitdir
 
     try:
@@ -277,34 +1103,20 @@ def main(args):
             raise GbsError("git project can't be found for --spec, "
                            "give it in argument or cd into it")
 
-    read_localconf(workdir)
+    with TIMER.phase('read_localconf'):
+        read_localconf(workdir)
+    # template_dir can be set in gbs.conf of the project
+    template_dir = os.path.expanduser(configmgr.get('template_dir'))
+    if args.export_template and not template_dir:
+        raise Usage('--export-template needs template_dir in [general] '
+                    'section of gbs.conf')
 
     hostarch = os.uname()[4]
-    if args.arch:
-        buildarch = args.arch
-    else:
-        buildarch = hostarch
-        log.info('No arch specified, using system arch: %s' % hostarch)
-
-    if not buildarch in SUPPORTEDARCHS:
-        raise GbsError('arch %s not supported, supported archs are: %s ' % \
-                       (buildarch, ','.join(SUPPORTEDARCHS)))
+    buildarchs = get_build_archs(args)
 
-    profile = get_profile(args)
-    if args.buildroot:
-        build_root = args.buildroot
-    elif 'TIZEN_BUILD_ROOT' in os.environ:
-        build_root = os.environ['TIZEN_BUILD_ROOT']
-    elif profile.buildroot:
-        build_root = profile.buildroot
-    else:
-        build_root = configmgr.get('buildroot', 'general')
-    build_root = os.path.expanduser(build_root)
-    # transform variables from shell to python convention ${xxx} -> %(xxx)s
-    build_root = re.sub(r'\$\{([^}]+)\}', r'%(\1)s', build_root)
-    sanitized_profile_name = re.sub("[^a-zA-Z0-9:._-]", "_", profile.name)
-    build_root = build_root % {'tmpdir': TMPDIR,
-                               'profile': sanitized_profile_name}
+    with TIMER.phase('get_profile'):
+        profile = get_profile(args)
+    build_root = get_build_root(args, profile)
     if profile.exclude_packages:
         log.info('the following packages have been excluded build from gbs '
                  'config:\n   %s' % '\n   '.join(profile.exclude_packages))
@@ -313,25 +1125,52 @@ def main(args):
         else:
             args.exclude = ','.join(profile.exclude_packages)
     os.environ['TIZEN_BUILD_ROOT'] = os.path.abspath(build_root)
+    # entries of build root aren't pruned by others while it's held
+    build_lock = get_build_lock(build_root)
+    try:
+        build_lock.acquire()
+    except (IOError, OSError), err:
+        log.warning('failed to lock build root: %s' % err)
+
+    # archs built together share CPUs and memory given by --threads
+    arch_roots = get_arch_roots(build_root, buildarchs)
+    if args.threads == 'auto':
+        args.threads = get_auto_threads([load_history(
+            get_gbs_state_dir(arch_roots[arch]), 'memory', arch)
+            for arch in buildarchs])
+    elif len(buildarchs) > 1:
+        args.threads = max(1, args.threads / len(buildarchs))
+
+    if args.plan:
+        with TIMER.phase('plan'):
+            show_build_plan(args, workdir, arch_roots, profile, build_root)
+        return
 
     # get virtual env from system env first
     if 'VIRTUAL_ENV' in os.environ:
-        cmd = ['%s/usr/bin/depanneur' % os.environ['VIRTUAL_ENV']]
+        depanneur = '%s/usr/bin/depanneur' % os.environ['VIRTUAL_ENV']
     else:
-        cmd = ['depanneur']
-
-    cmd += ['--arch=%s' % buildarch]
-
-    if args.clean:
-        cmd += ['--clean']
+        depanneur = 'depanneur'
 
-    # check & prepare repos and build conf
+    # check & prepare repos and build conf, resolved once for all archs
     if not args.noinit:
-        cmd += prepare_repos_and_build_conf(args, buildarch, profile)
+        resolved, lock, distconf = resolve_build_repos(args, buildarchs,
+                                                       profile, build_root)
+        repo_opts, inputs = prepare_repos_and_build_conf(buildarchs, resolved,
+                                                         lock, distconf)
     else:
-        cmd += ['--noinit']
+        repo_opts = dict((arch, ['--noinit']) for arch in buildarchs)
 
-    cmd += ['--path=%s' % workdir]
+    # packages built from the same inputs before are excluded
+    fingerprints = {}
+    if can_skip_unchanged(args):
+        with TIMER.phase('fingerprint'):
+            fingerprints = fingerprint_packages(args, workdir, inputs)
+    fingerprint_dbs = dict((arch, FingerprintDB(os.path.join(
+        get_gbs_state_dir(arch_roots[arch]), 'fingerprints.%s.json' % arch)))
+        for arch in fingerprints)
+
+    cmd = ['--path=%s' % workdir]
 
     if args.ccache:
         cmd += ['--ccache']
@@ -339,11 +1178,9 @@ def main(args):
     if args.extra_packs:
         cmd += ['--extra-packs=%s' % args.extra_packs]
 
-    if hostarch != buildarch and buildarch in CHANGE_PERSONALITY:
-        cmd = [CHANGE_PERSONALITY[buildarch]] + cmd
-
     # Extra depanneur special command options
-    cmd += prepare_depanneur_opts(args)
+    with TIMER.phase('prepare_depanneur_opts'):
+        cmd += prepare_depanneur_opts(args)
 
     # Extra options for gbs export
     if args.include_all:
@@ -361,7 +1198,7 @@ def main(args):
         cmd += ['--no-patch-export']
 
     if args.define:
-        cmd += [('--define="%s"' % i) for i in args.define]
+        cmd += [('--define=%s' % i) for i in args.define]
     if args.spec:
         cmd += ['--spec=%s' % args.spec]
 
@@ -370,9 +1207,136 @@ def main(args):
     if orphan_packaging:
         cmd += ['--spec-commit=%s' % orphan_packaging]
 
-    log.debug("running command: %s" % ' '.join(cmd))
-    retcode = os.system(' '.join(cmd))
-    if retcode != 0:
-        raise GbsError('some packages failed to be built')
+    # clean or missing build roots are copied from a base installed from
+    # the same build conf and repo revisions before, if bases are enabled
+    # or imported from templates. depanneur cleans build root for each
+    # package with --clean, so it only helps with --clean-once or a
+    # single package.
+    bases = {}
+    save_bases = configmgr.get_bool('build_root_bases')
+    workers = min(args.threads, len(find_package_dirs(workdir)))
+    clean = args.clean_once or args.clean and workers == 1
+    if not args.noinit:
+        for buildarch in buildarchs:
+            bases[buildarch] = hashlib.sha1('\0'.join(
+                [buildarch] + inputs[buildarch])).hexdigest()
+    restored = set()
+    initialized = set()
+
+    jobs = []
+    results = {}
+    for buildarch in buildarchs:
+        arch_cmd = [depanneur, '--arch=%s' % buildarch]
+        if args.clean:
+            arch_cmd += ['--clean']
+        arch_cmd += repo_opts[buildarch] + cmd
+        if hostarch != buildarch and buildarch in CHANGE_PERSONALITY:
+            arch_cmd = [CHANGE_PERSONALITY[buildarch]] + arch_cmd
+
+        unchanged = [info.name for package_dir, fingerprint, info
+                     in fingerprints.get(buildarch, [])
+                     if fingerprint and fingerprint_dbs[buildarch].unchanged(
+                            package_dir, fingerprint, arch_roots[buildarch])]
+        if unchanged:
+            log.info('the following packages of %s are skipped, as they '
+                     'have been built from the same inputs, specify '
+                     '--overwrite to build them anyway:\n   %s' % \
+                     (buildarch, '\n   '.join(unchanged)))
+            if len(unchanged) == len(fingerprints[buildarch]):
+                log.info('all packages of %s are up to date' % buildarch)
+                results[buildarch] = (0, [])
+                continue
+            arch_cmd += ['--exclude=%s' % name for name in unchanged]
+        if buildarch in bases and (save_bases or template_dir) and \
+                (clean or not os.path.exists(
+                    get_scratch_dir(arch_roots[buildarch], buildarch, 0))):
+            initialized.add(buildarch)
+            if template_dir:
+                import_template(template_dir, arch_roots[buildarch],
+                                buildarch, bases[buildarch])
+            if restore_build_roots(arch_roots[buildarch], buildarch,
+                                   bases[buildarch], workers):
+                arch_cmd = [opt for opt in arch_cmd
+                            if opt not in ('--clean', '--clean-once')]
+                restored.add(buildarch)
+        jobs.append((buildarch, arch_cmd, arch_roots[buildarch]))
+
+    # packages are downloaded while depanneur exports packages, build roots
+    # restored from bases don't need them. It's best effort: packages not
+    # downloaded yet when a build root is initialized are downloaded by the
+    # build script itself, and only verified ones are renamed into the
+    # cache, so the build script never sees partial files
+    prefetcher = None
+    prefetch_archs = [job[0] for job in jobs if job[0] not in restored]
+    if args.prefetch and prefetch_archs:
+        with TIMER.phase('prefetch'):
+            downloads = get_prefetch_jobs(args, workdir, prefetch_archs,
+                                          resolved, lock, distconf,
+                                          arch_roots)
+            try:
+                # sudo may prompt for password, do it before depanneur
+                prepare_cache_dirs(downloads)
+            except GbsError, err:
+                log.warning('packages are not prefetched: %s' % err)
+                downloads = []
+        if downloads:
+            prefetcher = threading.Thread(target=prefetch_packages,
+                                          args=(downloads,))
+            prefetcher.daemon = True
+            prefetcher.start()
+
+    if jobs:
+        with TIMER.phase('depanneur', archs=[job[0] for job in jobs]):
+            results.update(run_depanneur(jobs))
+    if prefetcher:
+        prefetcher.join()
+
+    for buildarch, fpdb in fingerprint_dbs.iteritems():
+        records = dict((pkg['name'], pkg) for pkg in results[buildarch][1])
+        for package_dir, fingerprint, info in fingerprints[buildarch]:
+            record = records.get(info.name)
+            if not fingerprint or not record:
+                continue
+            if record['status'] == 'succeeded':
+                fpdb.update(package_dir, fingerprint, find_built_rpms(
+                            arch_roots[buildarch], buildarch, info,
+                            record['nvr']))
+            else:
+                fpdb.remove(package_dir)
+        try:
+            fpdb.save()
+        except (IOError, OSError), err:
+            log.warning('failed to save fingerprints: %s' % err)
+
+    for buildarch, _arch_cmd, arch_root in jobs:
+        if save_bases and buildarch in initialized and \
+                buildarch not in restored and \
+                get_build_root_bases(arch_root).save(buildarch,
+                    bases[buildarch], get_scratch_dir(arch_root, buildarch, 0)):
+            log.info('build root of %s has been saved as base of clean build '
+                     'roots' % buildarch)
+        if args.export_template:
+            export_template(template_dir, arch_root, buildarch,
+                            bases[buildarch])
+
+    packages = sum([results[arch][1] for arch in buildarchs], [])
+    if packages:
+        print format_build_summary(packages)
+    if len(buildarchs) > 1:
+        report = {}
+        for arch, arch_cmd, _ in jobs:
+            report[arch] = {'command': arch_cmd, 'retcode': results[arch][0],
+                            'packages': results[arch][1]}
+        save_build_timings(get_gbs_state_dir(build_root), 'all', report)
+
+    build_lock.release()
+    if configmgr.get_bool('cache_auto_prune'):
+        with TIMER.phase('cache prune'):
+            prune_cache(build_root, start)
+
+    failed = [arch for arch in buildarchs if results[arch][0] != 0]
+    if failed:
+        raise GbsError('some packages failed to be built for arch: %s' % \
+                       ','.join(failed))
     else:
         log.info('Done')
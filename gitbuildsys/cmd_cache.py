@@ -0,0 +1,103 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Implementation of subcmd: cache
+"""
+
+import os
+import time
+
+from gitbuildsys.buildcache import scan_build_root, scan_tmpdir, prune, \
+                                   parse_size
+from gitbuildsys.cmd_build import get_profile, get_build_root, USERID
+from gitbuildsys.conf import configmgr
+from gitbuildsys.errors import GbsError
+from gitbuildsys.log import LOGGER as log
+from gitbuildsys.utils import format_size
+
+
+def get_quota(value):
+    """Parse quota, None if it's not set."""
+    if not value:
+        return None
+    try:
+        return parse_size(value)
+    except ValueError, err:
+        raise GbsError('bad cache quota: %s' % err)
+
+def scan(args):
+    """Find entries in build root and gbs tmpdir."""
+    build_root = get_build_root(args, get_profile(args))
+    tmpdir = os.path.join(configmgr.get('tmpdir', 'general'),
+                          '%s-gbs' % USERID)
+    log.info('scanning %s and %s ...' % (build_root, tmpdir))
+    return scan_build_root(build_root) + scan_tmpdir(tmpdir)
+
+def format_entries(entries):
+    """Format entries as a table, most recently used first."""
+    lines = ['%-8s %-20s %-8s %10s %-16s %s' % ('KIND', 'PROFILE', 'ARCH',
+             'SIZE', 'LAST USED', 'PATH')]
+    for entry in sorted(entries, key=lambda entry: -entry.last_used):
+        lines.append('%-8s %-20s %-8s %10s %-16s %s' % (entry.kind,
+                     entry.profile, entry.arch, format_size(entry.size),
+                     time.strftime('%Y-%m-%d %H:%M',
+                                   time.localtime(entry.last_used)),
+                     entry.path))
+    return '\n'.join(lines)
+
+def format_usage(entries, quota):
+    """Format disk usage summed up by profile and arch, and by kind."""
+    by_target = {}
+    by_kind = {}
+    for entry in entries:
+        key = (entry.profile, entry.arch)
+        by_target[key] = by_target.get(key, 0) + entry.size
+        by_kind[entry.kind] = by_kind.get(entry.kind, 0) + entry.size
+
+    lines = ['%-20s %-8s %10s' % ('PROFILE', 'ARCH', 'SIZE')]
+    for (profile, arch), size in sorted(by_target.items()):
+        lines.append('%-20s %-8s %10s' % (profile, arch, format_size(size)))
+    lines.append('')
+    lines.append('%-29s %10s' % ('KIND', 'SIZE'))
+    for kind, size in sorted(by_kind.items()):
+        lines.append('%-29s %10s' % (kind, format_size(size)))
+    lines.append('')
+    lines.append('%-29s %10s' % ('total',
+                 format_size(sum(entry.size for entry in entries))))
+    if quota is not None:
+        lines.append('%-29s %10s' % ('quota', format_size(quota)))
+    return '\n'.join(lines)
+
+def main(args):
+    """gbs cache entry point."""
+
+    quota = get_quota(args.quota or configmgr.get('cache_quota'))
+    entries = scan(args)
+
+    if args.action == 'list':
+        print format_entries(entries)
+    elif args.action == 'du':
+        print format_usage(entries, quota)
+    elif args.action == 'prune':
+        if quota is None:
+            raise GbsError('no cache quota specified, please specify it '
+                           'using --quota or cache_quota in gbs.conf')
+        removed = prune(entries, quota, dry_run=args.dry_run)
+        log.info('%s %d entries, %s' % ('would remove' if args.dry_run
+                 else 'removed', len(removed),
+                 format_size(sum(entry.size for entry in removed))))
@@ -30,11 +30,10 @@ from gitbuildsys import utils
 from gitbuildsys.conf import configmgr
 from gitbuildsys.errors import GbsError, Usage
 from gitbuildsys.log import LOGGER as log
+from gitbuildsys.speccache import parse_spec
 
 from gbp.scripts.buildpackage_rpm import main as gbp_build
 from gbp.rpm.git import GitRepositoryError, RpmGitRepository
-import gbp.rpm as rpm
-from gbp.errors import GbpError
 
 
 def mkdir_p(path):
@@ -205,7 +204,8 @@ def export_sources(repo, commit, export_dir, spec, args, create_tarball=True):
     gbp_args = create_gbp_export_args(repo, commit, export_dir, tmp.path,
                                       spec, args, create_tarball=create_tarball)
     try:
-        ret = gbp_build(gbp_args)
+        # gbp works on git repository in current directory
+        ret = utils.call_in_dir(repo.path, gbp_build, gbp_args)
         if ret == 2 and not is_native_pkg(repo, args):
             # Try falling back to old logic of one monolithic tarball
             log.error("Generating upstream tarball and/or generating patches "
@@ -236,7 +236,8 @@ def main(args):
         raise GbsError(str(err))
 
     utils.read_localconf(repo.path)
-    utils.git_status_checker(repo, args)
+    if not args.no_status_check:
+        utils.git_status_checker(repo, args)
     workdir = repo.path
 
 
@@ -270,15 +271,18 @@ def main(args):
                        directory=True)
     export_dir = tempd.path
 
-    tracked_branches = track_export_branches(repo, args)
+    # exports of a repo are serialized, as depanneur of each arch built at
+    # the same time exports it, and they would share the tracked branches
+    with utils.FileLock(os.path.join(utils.git_dir(workdir),
+                                     'gbs-export.lock')):
+        tracked_branches = track_export_branches(repo, args)
 
-    with utils.Workdir(workdir):
         export_sources(repo, commit, export_dir, main_spec, args)
 
         if rest_specs:
             # backup updated spec file
             specbakd = utils.Temp(prefix=os.path.join(tmpdir, '.gbs_export_'),
-                               directory=True)
+                                  directory=True)
             shutil.copy(os.path.join(export_dir,
                         os.path.basename(main_spec)), specbakd.path)
             for spec in rest_specs:
@@ -290,15 +294,12 @@ def main(args):
             for spec in glob.glob(os.path.join(specbakd.path, "*.spec")):
                 shutil.copy(spec, export_dir)
 
-    # Remove tracked export branches
-    if tracked_branches:
-        untrack_export_branches(repo, tracked_branches)
+        # Remove tracked export branches
+        if tracked_branches:
+            untrack_export_branches(repo, tracked_branches)
 
     specfile = os.path.basename(main_spec)
-    try:
-        spec = rpm.SpecFile(os.path.join(export_dir, specfile))
-    except GbpError, err:
-        raise GbsError('%s' % err)
+    spec = parse_spec(os.path.join(export_dir, specfile))
 
     if not spec.name or not spec.version:
         raise GbsError('can\'t get correct name or version from spec file.')
@@ -0,0 +1,66 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Implementation of subcmd: prefetch
+"""
+
+import time
+
+from gitbuildsys.cmd_build import init_run, get_profile, get_build_root, \
+                                  get_build_archs, get_arch_roots, \
+                                  resolve_build_repos, get_prefetch_jobs
+from gitbuildsys.errors import GbsError, Usage
+from gitbuildsys.log import LOGGER as log
+from gitbuildsys.prefetch import download
+from gitbuildsys.utils import read_localconf
+
+from gbp.rpm.git import GitRepositoryError, RpmGitRepository
+
+
+def main(args):
+    """gbs prefetch entry point."""
+
+    if args.commit and args.include_all:
+        raise Usage('--commit can\'t be specified together with '\
+                    '--include-all')
+
+    init_run()
+    workdir = args.gitdir
+    try:
+        workdir = RpmGitRepository(workdir).path
+    except GitRepositoryError:
+        pass
+    read_localconf(workdir)
+
+    archs = get_build_archs(args)
+    profile = get_profile(args)
+    build_root = get_build_root(args, profile)
+    if profile.exclude_packages:
+        args.exclude = ','.join(filter(None, [args.exclude] +
+                                       profile.exclude_packages))
+
+    resolved, lock, distconf = resolve_build_repos(args, archs, profile,
+                                                   build_root)
+    jobs = get_prefetch_jobs(args, workdir, archs, resolved, lock, distconf,
+                             get_arch_roots(build_root, archs))
+    start = time.time()
+    failed = download(jobs)
+    log.info('%d packages have been downloaded in %.1fs' % \
+             (len(jobs) - len(failed), time.time() - start))
+    if failed:
+        raise GbsError('failed to download %d packages' % len(failed))
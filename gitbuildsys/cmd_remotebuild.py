@@ -30,11 +30,10 @@ from gitbuildsys.oscapi import OSC, OSCError
 from gitbuildsys.cmd_export import export_sources, get_packaging_dir
 from gitbuildsys.cmd_build import get_profile
 from gitbuildsys.log import LOGGER as log
+from gitbuildsys.speccache import parse_spec
 from gitbuildsys.log import DEBUG
 
-import gbp.rpm
 from gbp.rpm.git import GitRepositoryError, RpmGitRepository
-from gbp.errors import GbpError
 
 OSCRC_TEMPLATE = """[general]
 apiurl = %(apiurl)s
@@ -83,7 +82,7 @@ def main(args):
 
     utils.read_localconf(workdir)
 
-    if not (args.buildlog or args.status):
+    if not (args.buildlog or args.status or args.no_status_check):
         utils.git_status_checker(repo, args)
 
     packaging_dir = get_packaging_dir(args)
@@ -112,10 +111,7 @@ def main(args):
         spec_to_parse = tmp_spec.path
 
     # get 'name' and 'version' from spec file
-    try:
-        spec = gbp.rpm.SpecFile(spec_to_parse)
-    except GbpError, err:
-        raise GbsError('%s' % err)
+    spec = parse_spec(spec_to_parse)
 
     if not spec.name:
         raise GbsError("can't get correct name.")
@@ -199,8 +195,7 @@ def main(args):
     except OSCError, err:
         raise GbsError(str(err))
 
-    with utils.Workdir(workdir):
-        export_sources(repo, commit, exportdir, relative_spec, args)
+    export_sources(repo, commit, exportdir, relative_spec, args)
 
     try:
         commit_msg = repo.get_commit_info(args.commit or 'HEAD')['subject']
@@ -0,0 +1,207 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Implementation of subcmd: repo
+"""
+
+import os
+import sys
+import time
+import json
+
+from gitbuildsys.cmd_build import get_profile, USERID
+from gitbuildsys.conf import configmgr
+from gitbuildsys.errors import GbsError, UrlError
+from gitbuildsys.log import LOGGER as log
+from gitbuildsys.safe_url import SafeURL
+from gitbuildsys.utils import Temp, RepoParser, HTTPCache
+from gitbuildsys.repoindex import get_repo_index
+
+
+def phase_timings(stat):
+    """
+    Split cumulative curl timings of a transfer into time spent in each
+    phase. Phases a transfer skips, like TLS of plain http or connecting
+    on a reused connection, take 0.
+    """
+    dns = stat['namelookup']
+    connected = stat['connect'] or dns
+    ready = stat['appconnect'] or connected
+    return {'dns': dns,
+            'connect': max(connected - dns, 0),
+            'tls': max(ready - connected, 0),
+            'ttfb': max(stat['starttransfer'] - ready, 0) \
+                    if stat['starttransfer'] else 0}
+
+# files RepoParser looks for to tell the layout of a repo
+LAYOUT_PROBES = ('repodata/repomd.xml', '/build.xml')
+
+def is_probe(stat):
+    """Check if transfer is a 404 expected when probing repo layout."""
+    return stat['code'] == 404 and stat['url'].endswith(LAYOUT_PROBES)
+
+def average(stats, key):
+    """Average of key over stats, None if there's nothing to average."""
+    values = [stat[key] for stat in stats if stat[key]]
+    if not values:
+        return None
+    return sum(values) / len(values)
+
+def bench_repo(repo, tmpdir):
+    """
+    Resolve repo without any cache and collect timings of the transfers.
+    Returns: dict of summary and all transfers.
+    """
+    stats = []
+    cache = Temp(prefix='bench', dirn=tmpdir, directory=True)
+    error = None
+    start = time.time()
+    try:
+        RepoParser([repo], cache.path, stats=stats)
+    except (GbsError, UrlError), err:
+        error = str(err)
+    elapsed = time.time() - start
+
+    for stat in stats:
+        stat['phases'] = phase_timings(stat)
+    phases = [stat['phases'] for stat in stats]
+    size = sum(stat['size'] for stat in stats)
+    transfer = sum(stat['total'] for stat in stats)
+    return {'repo': str(repo),
+            'time': elapsed,
+            'requests': len(stats),
+            'missing': len([stat for stat in stats if is_probe(stat)]),
+            'failed': len([stat for stat in stats if not is_probe(stat) and
+                           (stat['code'] >= 400 or not stat['code'])]),
+            'bytes': size,
+            'dns': average(phases, 'dns'),
+            'connect': average(phases, 'connect'),
+            'tls': average(phases, 'tls'),
+            'ttfb': average(phases, 'ttfb'),
+            'speed': size / transfer if transfer else None,
+            'error': error,
+            'transfers': stats}
+
+def format_report(results):
+    """Format bench results as a table."""
+    def msec(value):
+        '''seconds to milliseconds, '-' for missing value'''
+        return '-' if value is None else '%.0f' % (value * 1000)
+
+    lines = ['%-50s %5s %7s %6s %8s %8s %8s %8s %10s %8s' % ('REPO',
+             'REQS', 'MISSING', 'FAILED', 'DNS(ms)', 'CONN(ms)', 'TLS(ms)',
+             'TTFB(ms)', 'RATE(KB/s)', 'TIME(s)')]
+    for res in results:
+        rate = '-' if res['speed'] is None else '%.1f' % (res['speed'] / 1024)
+        lines.append('%-50s %5d %7d %6d %8s %8s %8s %8s %10s %8.2f' % (
+                     res['repo'], res['requests'], res['missing'],
+                     res['failed'], msec(res['dns']), msec(res['connect']),
+                     msec(res['tls']), msec(res['ttfb']), rate, res['time']))
+    return '\n'.join(lines)
+
+def bench(args):
+    """Measure fetching performance of repos."""
+    repos = []
+    if not args.skip_conf_repos:
+        for repo in get_profile(args).repos:
+            repos.extend([repo.url] + repo.mirrors)
+    for repo in args.repositories or []:
+        try:
+            repos.append(SafeURL(repo))
+        except ValueError, err:
+            log.warning('Invalid repo %s: %s' % (repo, str(err)))
+
+    repos = [repo for repo in repos if not repo.is_local()]
+    if not repos:
+        raise GbsError('No remote package repository specified.')
+
+    tmpdir = Temp(prefix='gbs-repo-bench',
+                  dirn=configmgr.get('tmpdir', 'general'), directory=True)
+    results = []
+    for repo in repos:
+        log.info('benchmarking %s ...' % repo)
+        results.append(bench_repo(repo, tmpdir.path))
+        if results[-1]['error']:
+            log.warning('%s: %s' % (repo, results[-1]['error']))
+
+    print format_report(results)
+
+    if args.json:
+        report = {'time': time.time(), 'repos': results}
+        if args.json == '-':
+            json.dump(report, sys.stdout, indent=2, sort_keys=True)
+            print
+        else:
+            try:
+                with open(args.json, 'w') as fobj:
+                    json.dump(report, fobj, indent=2, sort_keys=True)
+            except IOError, err:
+                raise GbsError('failed to write %s: %s' % (args.json, err))
+            log.info('report saved to %s' % args.json)
+
+def query(args):
+    """Look up packages providing capabilities in the repo index."""
+    if not args.capabilities:
+        raise GbsError('no capability to query, e.g. gbs repo query '
+                       '"libz.so.1()(64bit)"')
+    repos = []
+    if not args.skip_conf_repos:
+        repos = [repo.url for repo in get_profile(args).repos]
+    for repo in args.repositories or []:
+        try:
+            repos.append(SafeURL(repo))
+        except ValueError, err:
+            log.warning('Invalid repo %s: %s' % (repo, str(err)))
+    if not repos:
+        raise GbsError('No package repository specified.')
+
+    tmpdir = os.path.join(configmgr.get('tmpdir', 'general'),
+                          '%s-gbs' % USERID)
+    cache = Temp(prefix='gbs-repo-query',
+                 dirn=configmgr.get('tmpdir', 'general'), directory=True)
+    httpcache = HTTPCache(os.path.join(tmpdir, 'httpcache'),
+                          configmgr.get_int('http_cache_ttl'),
+                          configmgr.get_int('http_cache_size') * 1024 * 1024)
+    parser = RepoParser(repos, cache.path, httpcache)
+    arch = args.arch or os.uname()[4]
+    repourls = parser.get_repos_by_arch(arch)
+    if not repourls:
+        raise GbsError('no available repositories found for arch %s' % arch)
+    index = get_repo_index()
+    parser.update_index(repourls, index)
+
+    missing = []
+    print '%-30s %-30s %-20s %-8s %s' % ('CAPABILITY', 'PACKAGE', 'VERSION',
+                                         'ARCH', 'REPO')
+    for capability in args.capabilities:
+        packages = index.whatprovides(capability, repourls)
+        if not packages:
+            missing.append(capability)
+        for pkg in packages:
+            print '%-30s %-30s %-20s %-8s %s' % (capability, pkg.name,
+                                                 pkg.evr, pkg.arch, pkg.repo)
+    if missing:
+        raise GbsError('no package provides: %s' % ', '.join(missing))
+
+def main(args):
+    """gbs repo entry point."""
+
+    if args.action == 'bench':
+        bench(args)
+    elif args.action == 'query':
+        query(args)
@@ -30,7 +30,7 @@ from ConfigParser import SafeConfigParser, NoSectionError, \
 
 from gitbuildsys import errors
 from gitbuildsys.safe_url import SafeURL
-from gitbuildsys.utils import Temp
+from gitbuildsys.utils import Temp, PhaseTimer
 from gitbuildsys.log import LOGGER as log
 
 def decode_passwdx(passwdx):
@@ -183,6 +183,14 @@ class ConfigMgr(object):
                 'buildroot':    '~/GBS-ROOT/',
                 'packaging_dir': 'packaging',
                 'work_dir': '.',
+                'http_cache_ttl': '0',
+                'http_cache_size': '64',
+                'repo_lock_ttl': '3600',
+                'mirror_probe_ttl': '86400',
+                'template_dir': '',
+                'build_root_bases': 'no',
+                'cache_quota': '',
+                'cache_auto_prune': 'no',
             },
             'orphan-devel': {
                 'packaging_branch': '',
@@ -241,6 +249,7 @@ url = http://download.tizen.org/releases/daily/trunk/ivi/latest/
     def __init__(self, fpath=None):
         self._cfgfiles = []
         self._cfgparsers = []
+        self.timer = PhaseTimer()
         if fpath:
             if not os.path.exists(fpath):
                 raise errors.ConfigError('Configuration file %s does not '\
@@ -268,22 +277,23 @@ url = http://download.tizen.org/releases/daily/trunk/ivi/latest/
     def load_confs(self):
         'reset all config values by files passed in'
 
-        self._cfgparsers = []
-        for fpath in self._cfgfiles:
-            cfgparser = BrainConfigParser()
-            try:
-                cfgparser.read_one(fpath)
-                if cfgparser.has_section('general') and \
-                   cfgparser.has_option('general', 'work_dir') and \
-                   cfgparser.get('general', 'work_dir') == '.':
-                    cfgparser.set('general', 'work_dir',
-                                  os.path.abspath(os.path.dirname(fpath)))
-            except Error, err:
-                raise errors.ConfigError('config file error:%s' % err)
-            self._cfgparsers.append(cfgparser)
-        self._cfgparsers.append(self._create_default_parser())
-
-        self._check_passwd()
+        with self.timer.phase('config load', files=list(self._cfgfiles)):
+            self._cfgparsers = []
+            for fpath in self._cfgfiles:
+                cfgparser = BrainConfigParser()
+                try:
+                    cfgparser.read_one(fpath)
+                    if cfgparser.has_section('general') and \
+                       cfgparser.has_option('general', 'work_dir') and \
+                       cfgparser.get('general', 'work_dir') == '.':
+                        cfgparser.set('general', 'work_dir',
+                                      os.path.abspath(os.path.dirname(fpath)))
+                except Error, err:
+                    raise errors.ConfigError('config file error:%s' % err)
+                self._cfgparsers.append(cfgparser)
+            self._cfgparsers.append(self._create_default_parser())
+
+            self._check_passwd()
 
     def add_conf(self, fpath):
         """ Add new config to configmgr, and new added config file has
@@ -418,6 +428,25 @@ url = http://download.tizen.org/releases/daily/trunk/ivi/latest/
         else:
             return self._get(opt, section)
 
+    def get_int(self, opt, section='general'):
+        'get item value as integer'
+        val = self.get(opt, section)
+        try:
+            return int(val)
+        except ValueError:
+            raise errors.ConfigError('%s in [%s] must be an integer: %s' % \
+                                     (opt, section, val))
+
+    def get_bool(self, opt, section='general'):
+        'get item value as boolean'
+        val = self.get(opt, section)
+        if val.lower() in ('yes', 'true', 'on', '1'):
+            return True
+        if val.lower() in ('no', 'false', 'off', '0', ''):
+            return False
+        raise errors.ConfigError('%s in [%s] must be yes or no: %s' % \
+                                 (opt, section, val))
+
     def get_arg_conf(self, args, opt, section='general'):
         """get value from command line arguments if found there, otherwise fall
            back to config
@@ -444,7 +473,8 @@ URL = namedtuple('URL', 'url user password')
 class SectionConf(object):
     """Config items related to obs and repo sections."""
 
-    def __init__(self, parent, name, url, base=None, target=None):
+    def __init__(self, parent, name, url, base=None, target=None,
+                 mirrors=None):
         self.parent = parent
         self.name = name
         self.base = base
@@ -454,6 +484,8 @@ class SectionConf(object):
         password = url.password or parent.common_password
         try:
             self.url = SafeURL(url.url, user, password)
+            self.mirrors = [SafeURL(mirror, user, password)
+                            for mirror in mirrors or []]
         except ValueError, err:
             raise errors.ConfigError('%s for %s' % (str(err), url.url))
 
@@ -471,6 +503,9 @@ class SectionConf(object):
             parser.set(self.name, 'passwdx',
                        encode_passwd(self.url.passwd))
 
+        if self.mirrors:
+            parser.set(self.name, 'mirrors', ', '.join(self.mirrors))
+
         if self.base:
             parser.set(self.name, 'base_prj', self.base)
 
@@ -606,6 +641,12 @@ class BizConfigManager(ConfigMgr):
         password = self.get_optional_item(section_id, 'passwd')
         return URL(url, user, password)
 
+    def _get_mirrors(self, section_id):
+        '''get list of mirror urls from a section'''
+        mirrors = self.get_optional_item(section_id, 'mirrors', '')
+        return [os.path.expanduser(self._interpolate(mirror))
+                for mirror in re.split(r'[\s,]+', mirrors) if mirror]
+
     def build_profile_by_name(self, name):
         '''return profile object by a given section'''
         if not name.startswith('profile.'):
@@ -641,7 +682,8 @@ class BizConfigManager(ConfigMgr):
                     continue
 
                 repoconf = SectionConf(profile, repo,
-                                       self._get_url_options(repo))
+                                       self._get_url_options(repo),
+                                       mirrors=self._get_mirrors(repo))
                 profile.add_repo(repoconf)
 
         profile.buildroot = self.get_optional_item(name, 'buildroot')
@@ -0,0 +1,158 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+This module provides a persistent cache of md5 digests of files, so files
+which have not been changed since they were hashed are not read again.
+"""
+
+import os
+import pwd
+import time
+import thread
+import sqlite3
+
+from gitbuildsys.conf import configmgr
+from gitbuildsys.errors import GbsError
+from gitbuildsys.log import LOGGER as log
+from gitbuildsys.utils import file_checksum
+
+# entries not used for this many seconds are removed
+MAX_AGE = 30 * 24 * 3600
+
+# files modified this close to the time they are hashed aren't cached, a
+# change right after hashing could keep the same mtime on filesystems of
+# whole second timestamps
+RACY_WINDOW = 1
+
+
+class DigestCache(object):
+    """
+    Digests of files stored in sqlite. Entries are keyed by path, size,
+    modification time in nanoseconds and inode of files, so a file which
+    is changed or replaced is hashed again. Files under volatile dirs,
+    which are removed after each run, are only cached in memory.
+    """
+
+    def __init__(self, path, volatile=()):
+        self.path = path
+        self.volatile = [os.path.join(os.path.abspath(dirn), '')
+                         for dirn in volatile]
+        self._memory = {}
+        self._conn = None
+        self._owner = None
+
+    def _connect(self):
+        """
+        Connection of current process and thread, it can't be shared with
+        children or other threads.
+        """
+        owner = (os.getpid(), thread.get_ident())
+        if self._conn is None or self._owner != owner:
+            dirn = os.path.dirname(self.path)
+            if not os.path.exists(dirn):
+                os.makedirs(dirn)
+            self._conn = sqlite3.connect(self.path, timeout=30)
+            with self._conn:
+                self._conn.execute('CREATE TABLE IF NOT EXISTS digests '
+                                   '(path TEXT, size INTEGER, '
+                                   'mtime INTEGER, inode INTEGER, '
+                                   'md5 TEXT, time REAL, '
+                                   'PRIMARY KEY (path, size, mtime, inode))')
+                self._conn.execute('DELETE FROM digests WHERE time < ?',
+                                   (time.time() - MAX_AGE,))
+            self._owner = owner
+        return self._conn
+
+    @staticmethod
+    def _key(fname):
+        """(path, size, mtime_ns, inode) of file."""
+        try:
+            stat = os.stat(fname)
+        except OSError, err:
+            raise GbsError('failed to stat %s: %s' % (fname, err))
+        return (os.path.abspath(fname), stat.st_size,
+                int(round(stat.st_mtime * 1e9)), stat.st_ino)
+
+    def _is_volatile(self, path):
+        """Whether path is under a volatile dir."""
+        return any(path.startswith(dirn) for dirn in self.volatile)
+
+    def md5(self, fname):
+        """Returns: md5 hexdigest of file, hashed only if it's changed."""
+        key = self._key(fname)
+        if key in self._memory:
+            return self._memory[key]
+
+        persistent = not self._is_volatile(key[0])
+        row = None
+        if persistent:
+            try:
+                row = self._connect().execute('SELECT md5 FROM digests WHERE '
+                                              'path = ? AND size = ? AND '
+                                              'mtime = ? AND inode = ?',
+                                              key).fetchone()
+            except sqlite3.Error, err:
+                log.debug('digest cache %s is not available: %s' % \
+                          (self.path, err))
+        if row:
+            digest = str(row[0])
+        else:
+            start = time.time()
+            try:
+                digest = file_checksum(fname, 'md5')
+            except IOError, err:
+                raise GbsError('failed to read %s: %s' % (fname, err))
+            if key[2] >= (start - RACY_WINDOW) * 1e9 or \
+                    self._key(fname) != key:
+                log.debug('%s is being changed, not cached' % fname)
+                return digest
+
+        self._memory[key] = digest
+        if not persistent:
+            return digest
+        try:
+            with self._connect() as conn:
+                if not row:
+                    # older entries of the same path are stale
+                    conn.execute('DELETE FROM digests WHERE path = ?',
+                                 (key[0],))
+                conn.execute('INSERT OR REPLACE INTO digests VALUES '
+                             '(?, ?, ?, ?, ?, ?)',
+                             key + (digest, time.time()))
+        except sqlite3.Error, err:
+            log.debug('failed to update digest cache %s: %s' % \
+                      (self.path, err))
+        return digest
+
+
+DIGEST_CACHE = None
+
+def file_md5(fname):
+    """
+    md5 hexdigest of file using the digest cache in gbs tmpdir. Files
+    exported into temp dirs under tmpdir are only cached for this run.
+    """
+    global DIGEST_CACHE
+    if DIGEST_CACHE is None:
+        user = pwd.getpwuid(os.getuid())[0]
+        tmpdir = configmgr.get('tmpdir', 'general')
+        DIGEST_CACHE = DigestCache(os.path.join(tmpdir, '%s-gbs' % user,
+                                                'digests.db'),
+                                   volatile=[tmpdir])
+    return DIGEST_CACHE.md5(fname)
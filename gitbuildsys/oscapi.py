@@ -24,23 +24,38 @@ Only APIs which are required by cmd_remotebuild present here.
 
 import os
 import re
+import httplib
 import urllib2
 import M2Crypto
 from M2Crypto.SSL.Checker import SSLVerificationError
 import ssl
+import time
+import threading
 
 from collections import defaultdict
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
 from urllib import quote_plus, pathname2url
 
 from xml.etree import cElementTree as ET
 
-from gitbuildsys.utils import hexdigest
+from gitbuildsys.digestcache import file_md5
 from gitbuildsys.errors import ObsError
-from gitbuildsys.log import waiting
 from gitbuildsys.log import LOGGER as logger
+from gitbuildsys.utils import format_size
 
 from osc import conf, core
 
+# files uploaded to OBS at the same time
+MAX_UPLOADS = 4
+# attempts to upload each file, seconds before the first retry, which
+# is doubled for each next one
+UPLOAD_ATTEMPTS = 5
+UPLOAD_RETRY_DELAY = 1
+# seconds to wait for all uploads, waiting without timeout can't be
+# interrupted by ^C
+UPLOAD_TIMEOUT = 24 * 3600
+
 class OSCError(Exception):
     """Local exception class."""
     pass
@@ -258,7 +273,7 @@ class OSC(object):
             if lname in rdict:
                 lsize = os.path.getsize(lpath)
                 rsize, rmd5 = rdict[lname]
-                if rsize == lsize and rmd5 == core.dgst(lpath):
+                if rsize == lsize and rmd5 == file_md5(lpath):
                     not_changed.append(lpath)
                 else:
                     changed.append(lpath)
@@ -270,9 +285,89 @@ class OSC(object):
 
         return rdict.keys(), not_changed, changed, new
 
-    @waiting
+    def _upload_file(self, prj, pkg, fpath):
+        """
+        Upload file to package, retry with exponential backoff on
+        network and server errors.
+        Returns: seconds spent
+        """
+        put_url = core.makeurl(self.apiurl,
+                               ['source', prj, pkg,
+                                pathname2url(os.path.basename(fpath))],
+                               query="rev=repository")
+        start = time.time()
+        delay = UPLOAD_RETRY_DELAY
+        for attempt in range(1, UPLOAD_ATTEMPTS + 1):
+            try:
+                core.http_PUT(put_url, file=fpath)
+                return time.time() - start
+            # http_PUT is called directly, so errors of the connection
+            # which aren't wrapped by urllib2 are caught here as well.
+            # URLError and socket.error are IOError
+            except (IOError, httplib.HTTPException,
+                    M2Crypto.m2urllib2.URLError, M2Crypto.SSL.SSLError,
+                    ssl.SSLError), err:
+                # client errors like no permission won't be fixed by retry
+                if attempt == UPLOAD_ATTEMPTS or \
+                        400 <= getattr(err, 'code', 0) < 500:
+                    raise OSCError('failed to upload %s: %s' % \
+                                   (os.path.basename(fpath), err))
+                logger.warning('failed to upload %s: %s, retry in %ds' % \
+                               (os.path.basename(fpath), err, delay))
+                time.sleep(delay)
+                delay *= 2
+
+    def _upload_files(self, prj, pkg, paths, uploads=MAX_UPLOADS):
+        """
+        Upload files to package in parallel, reporting progress. osc
+        builds its url opener lazily and isn't safe to do it from several
+        threads, it must have been used by this thread before.
+        """
+        if not paths:
+            return
+        total = sum(os.path.getsize(fpath) for fpath in paths)
+        progress = {'files': 0, 'bytes': 0}
+        lock = threading.Lock()
+        start = time.time()
+
+        def upload(fpath):
+            '''upload one file, run in upload threads'''
+            elapsed = self._upload_file(prj, pkg, fpath)
+            size = os.path.getsize(fpath)
+            with lock:
+                progress['files'] += 1
+                progress['bytes'] += size
+                logger.info('uploaded %s (%s in %.1fs), %d/%d files, '
+                            '%s/%s' % (os.path.basename(fpath),
+                                       format_size(size), elapsed,
+                                       progress['files'], len(paths),
+                                       format_size(progress['bytes']),
+                                       format_size(total)))
+
+        pool = ThreadPool(min(uploads, len(paths)))
+        try:
+            # largest files first, so they don't finish last alone
+            pool.map_async(upload, sorted(paths, key=os.path.getsize,
+                                          reverse=True),
+                           chunksize=1).get(UPLOAD_TIMEOUT)
+            pool.close()
+        except TimeoutError:
+            raise OSCError('uploading files timed out in %ds' % \
+                           UPLOAD_TIMEOUT)
+        finally:
+            pool.terminate()
+            pool.join()
+        elapsed = max(time.time() - start, 0.001)
+        logger.info('uploaded %d files, %s in %.1fs (%s/s)' % \
+                    (len(paths), format_size(total), elapsed,
+                     format_size(total / elapsed)))
+
     def commit_files(self, prj, pkg, files, message):
-        """Commits files to OBS."""
+        """
+        Commits files to OBS. The file list is posted first, files to be
+        committed are uploaded in parallel, then the file list is posted
+        again to commit them.
+        """
 
         query = {'cmd'    : 'commitfilelist',
                  'user'   : conf.get_apiurl_usr(self.apiurl),
@@ -282,20 +377,16 @@ class OSC(object):
 
         xml = "<directory>"
         for fpath, _ in files:
-            with open(fpath) as fhandle:
-                xml += '<entry name="%s" md5="%s"/>' % \
-                       (os.path.basename(fpath), hexdigest(fhandle))
+            xml += '<entry name="%s" md5="%s"/>' % \
+                   (os.path.basename(fpath), file_md5(fpath))
         xml += "</directory>"
 
         try:
+            # the first request also sets up the url opener of osc before
+            # it's shared by upload threads
             self.core_http(core.http_POST, url, data=xml)
-            for fpath, commit_flag in files:
-                if commit_flag:
-                    put_url = core.makeurl(
-                        self.apiurl, ['source', prj, pkg,
-                                      pathname2url(os.path.basename(fpath))],
-                        query="rev=repository")
-                    self.core_http(core.http_PUT, put_url, filep=fpath)
+            self._upload_files(prj, pkg, [fpath for fpath, commit_flag
+                                          in files if commit_flag])
             self.core_http(core.http_POST, url, data=xml)
         except OSCError, err:
             raise ObsError("can't commit files to %s/%s: %s" % (prj, pkg, err))
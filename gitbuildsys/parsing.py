@@ -94,3 +94,12 @@ def basename_type(path):
     if os.path.basename(path) != path:
         raise ArgumentTypeError('should be a file name rather than a path')
     return path
+
+def threads_type(value):
+    '''validate function for number of threads, which can be "auto"'''
+    if value == 'auto':
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise ArgumentTypeError('should be a number or "auto"')
@@ -0,0 +1,170 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+This module downloads packages needed to set up build roots into the
+package cache of the build script ahead of building, so they are not
+downloaded one by one while build roots are initialized.
+"""
+
+import os
+import errno
+import hashlib
+
+from gitbuildsys.errors import GbsError
+from gitbuildsys.log import LOGGER as log
+from gitbuildsys.utils import MultiURLGrabber, file_checksum, sudo
+
+# build conf keys of packages installed into every build root
+BUILDROOT_KEYS = ('preinstall', 'required', 'support')
+
+MAX_CONNECTIONS = 8
+
+
+def buildroot_packages(buildconf):
+    """
+    Names of packages listed in Preinstall, Required and Support. %if
+    conditionals aren't evaluated, so packages of all branches are listed,
+    downloading a few unused packages is cheaper than expanding macros.
+    """
+    names = []
+    excluded = set()
+    try:
+        with open(buildconf) as fobj:
+            for line in fobj:
+                key, sep, value = line.partition(':')
+                if not sep or key.strip().lower() not in BUILDROOT_KEYS:
+                    continue
+                for name in value.split():
+                    if name.startswith('!'):
+                        excluded.add(name[1:])
+                    elif '%' not in name and name not in names:
+                        names.append(name)
+    except IOError, err:
+        raise GbsError('failed to read build conf %s: %s' % (buildconf, err))
+    return [name for name in names if name not in excluded]
+
+def get_cache_dir(cachedir, repo):
+    """Directory of repo in the package cache, same as the build script."""
+    return os.path.join(cachedir, hashlib.md5(repo.full).hexdigest())
+
+def resolve(names, repos, index):
+    """
+    Find the package providing each name in index, from the first repo
+    providing it. Packages named the same as the name are preferred.
+    Returns: (list of (repo, Package), list of names not found)
+    """
+    urls = dict((str(repo), repo) for repo in repos)
+    found = {}
+    missing = []
+    for name in names:
+        packages = [pkg for pkg in index.whatprovides(name, repos)
+                    if pkg.arch not in ('src', 'nosrc')]
+        if not packages:
+            missing.append(name)
+            continue
+        exact = [pkg for pkg in packages if pkg.name == name]
+        pkg = (exact or packages)[0]
+        found[(pkg.repo, pkg.location)] = (urls[pkg.repo], pkg)
+    return found.values(), missing
+
+def verify(fname, pkg):
+    """Check size and checksum of downloaded package."""
+    if pkg.size and os.path.getsize(fname) != pkg.size:
+        return False
+    if pkg.checksum:
+        algorithm, digest = pkg.checksum.split(':', 1)
+        if algorithm == 'sha':
+            algorithm = 'sha1'
+        try:
+            return file_checksum(fname, algorithm) == digest
+        except ValueError:
+            log.debug('unknown checksum type %s of %s' % (algorithm, fname))
+    return True
+
+def get_jobs(repos, names, cachedir, index):
+    """
+    Find packages providing names in repos, which are not in cachedir yet.
+    Returns: (list of (repo, Package, cache file name), number of cached)
+    """
+    packages, missing = resolve(names, repos, index)
+    if missing:
+        log.warning('no package provides the following in repos:\n   %s' % \
+                    '\n   '.join(missing))
+
+    jobs = []
+    for repo, pkg in packages:
+        dest = os.path.join(get_cache_dir(cachedir, repo),
+                            os.path.basename(pkg.location))
+        if os.path.exists(dest):
+            continue
+        part = dest + '.part'
+        if pkg.size and os.path.exists(part) and \
+                os.path.getsize(part) >= pkg.size:
+            # finished but not verified, or not resumable at all
+            if os.path.getsize(part) == pkg.size and verify(part, pkg):
+                os.rename(part, dest)
+                continue
+            os.unlink(part)
+        jobs.append((repo, pkg, dest))
+    return jobs, len(packages) - len(jobs)
+
+def prepare_cache_dirs(jobs):
+    """
+    Make cache dirs of jobs writable by current user. Package cache of
+    build roots is created by the build script as root, so dirs which
+    can't be written are created or taken over by sudo.
+    """
+    dirs = sorted(set(os.path.dirname(dest) for _repo, _pkg, dest in jobs))
+    for dirn in dirs:
+        try:
+            if not os.path.exists(dirn):
+                os.makedirs(dirn)
+            if os.access(dirn, os.W_OK):
+                continue
+        except OSError, err:
+            if err.errno not in (errno.EACCES, errno.EPERM):
+                raise GbsError('failed to create %s: %s' % (dirn, err))
+        if not sudo(['install', '-d', '-o', str(os.getuid()),
+                     '-g', str(os.getgid()), dirn]):
+            raise GbsError('failed to make %s writable' % dirn)
+
+def download(jobs, connections=MAX_CONNECTIONS):
+    """
+    Download packages of jobs in parallel. Partial downloads are kept as
+    .part files and resumed next time, finished ones are verified and
+    renamed into place.
+    Returns: list of packages failed to be downloaded
+    """
+    prepare_cache_dirs(jobs)
+    grabber = MultiURLGrabber(max_connections=connections, resume=True)
+    results = grabber.grab([(repo.pathjoin(pkg.location), dest + '.part',
+                             repo.user, repo.passwd, False)
+                            for repo, pkg, dest in jobs])
+    failed = []
+    for (_repo, pkg, dest), result in zip(jobs, results):
+        if isinstance(result, Exception):
+            log.warning('failed to download %s: %s' % (pkg.location, result))
+            failed.append(pkg)
+        elif not verify(result, pkg):
+            log.warning('%s is corrupted, removed' % pkg.location)
+            os.unlink(result)
+            failed.append(pkg)
+        else:
+            os.rename(result, dest)
+    return failed
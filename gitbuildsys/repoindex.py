@@ -0,0 +1,249 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+This module keeps packages and provides listed in primary metadata of
+repos in sqlite, so packages providing a capability can be looked up
+without downloading and parsing primary.xml of repos again.
+"""
+
+import os
+import pwd
+import gzip
+import time
+import sqlite3
+import xml.etree.ElementTree as ET
+
+from gitbuildsys.conf import configmgr
+from gitbuildsys.errors import GbsError
+from gitbuildsys.log import LOGGER as log
+
+
+COMMON_NS = '{http://linux.duke.edu/metadata/common}'
+RPM_NS = '{http://linux.duke.edu/metadata/rpm}'
+
+# rows are written to sqlite in batches of this size
+BATCH_SIZE = 5000
+
+
+class Package(object):
+    """A package found in the index."""
+
+    def __init__(self, repo, name, arch, epoch, version, release, location,
+                 size=None, checksum=None):
+        self.repo = repo
+        self.name = name
+        self.arch = arch
+        self.epoch = epoch
+        self.version = version
+        self.release = release
+        self.location = location
+        self.size = size
+        # "<type>:<hexdigest>" of package file
+        self.checksum = checksum
+
+    @property
+    def evr(self):
+        """[epoch:]version-release"""
+        evr = '%s-%s' % (self.version, self.release)
+        if self.epoch and self.epoch != '0':
+            evr = '%s:%s' % (self.epoch, evr)
+        return evr
+
+
+def parse_primary(fname):
+    """
+    Iterate packages of primary.xml or primary.xml.gz.
+    Yields: (package attributes tuple, list of provides and files)
+    """
+    opener = gzip.open if fname.endswith('.gz') else open
+    fobj = opener(fname, 'rb')
+    try:
+        for _event, elem in ET.iterparse(fobj):
+            if elem.tag != COMMON_NS + 'package':
+                continue
+            version = elem.find(COMMON_NS + 'version')
+            location = elem.find(COMMON_NS + 'location')
+            size = elem.find(COMMON_NS + 'size')
+            checksum = elem.find(COMMON_NS + 'checksum')
+            attrs = (elem.findtext(COMMON_NS + 'name'),
+                     elem.findtext(COMMON_NS + 'arch'),
+                     version.get('epoch') if version is not None else None,
+                     version.get('ver') if version is not None else None,
+                     version.get('rel') if version is not None else None,
+                     location.get('href') if location is not None else None,
+                     int(size.get('package', 0)) if size is not None
+                     else None,
+                     '%s:%s' % (checksum.get('type', 'sha256'),
+                                checksum.text.strip())
+                     if checksum is not None and checksum.text else None)
+            provides = set(entry.get('name') for entry in elem.findall(
+                '%sformat/%sprovides/%sentry' % (COMMON_NS, RPM_NS, RPM_NS)))
+            # primary lists files commonly required, like /bin/sh
+            provides.update(item.text for item in elem.findall(
+                '%sformat/%sfile' % (COMMON_NS, COMMON_NS)) if item.text)
+            provides.add(attrs[0])
+            elem.clear()
+            yield attrs, provides
+    except (IOError, ET.ParseError), err:
+        raise GbsError('failed to parse %s: %s' % (fname, err))
+    finally:
+        fobj.close()
+
+
+class RepoIndex(object):
+    """
+    Packages and provides of repos stored in sqlite. Each repo is indexed
+    with its repomd revision, repos are only indexed again if their
+    revision has been changed.
+    """
+
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._pid = None
+
+    def _connect(self):
+        """Connection of current process, it can't be shared with children."""
+        if self._conn is None or self._pid != os.getpid():
+            dirn = os.path.dirname(self.path)
+            if not os.path.exists(dirn):
+                os.makedirs(dirn)
+            conn = sqlite3.connect(self.path, timeout=30)
+            if conn.execute('PRAGMA user_version').fetchone()[0] != \
+                    self.SCHEMA_VERSION:
+                with conn:
+                    for table in ('repos', 'packages', 'provides'):
+                        conn.execute('DROP TABLE IF EXISTS %s' % table)
+                    conn.execute('CREATE TABLE repos (url TEXT PRIMARY KEY, '
+                                 'revision TEXT, time REAL, '
+                                 'packages INTEGER)')
+                    conn.execute('CREATE TABLE packages (id INTEGER PRIMARY '
+                                 'KEY, repo TEXT, name TEXT, arch TEXT, '
+                                 'epoch TEXT, version TEXT, release TEXT, '
+                                 'location TEXT, size INTEGER, '
+                                 'checksum TEXT)')
+                    conn.execute('CREATE TABLE provides (package INTEGER, '
+                                 'name TEXT)')
+                    conn.execute('CREATE INDEX packages_repo ON '
+                                 'packages (repo)')
+                    conn.execute('CREATE INDEX provides_name ON '
+                                 'provides (name)')
+                    conn.execute('CREATE INDEX provides_package ON '
+                                 'provides (package)')
+                    conn.execute('PRAGMA user_version = %d' % \
+                                 self.SCHEMA_VERSION)
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def revision(self, url):
+        """Revision of repo indexed, None if it's not indexed."""
+        row = self._connect().execute('SELECT revision FROM repos WHERE '
+                                      'url = ?', (str(url),)).fetchone()
+        return row[0] if row else None
+
+    def repos(self):
+        """List of (url, revision, time, number of packages) indexed."""
+        return self._connect().execute('SELECT url, revision, time, packages '
+                                       'FROM repos ORDER BY url').fetchall()
+
+    def update(self, url, revision, primary):
+        """Index packages of repo from its primary metadata file."""
+        url = str(url)
+        start = time.time()
+        count = 0
+        try:
+            with self._connect() as conn:
+                self._remove(conn, url)
+                provides = []
+                for attrs, names in parse_primary(primary):
+                    cursor = conn.execute('INSERT INTO packages (repo, name, '
+                                          'arch, epoch, version, release, '
+                                          'location, size, checksum) VALUES '
+                                          '(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                          (url,) + attrs)
+                    provides.extend((cursor.lastrowid, name)
+                                    for name in names)
+                    if len(provides) >= BATCH_SIZE:
+                        conn.executemany('INSERT INTO provides VALUES (?, ?)',
+                                         provides)
+                        provides = []
+                    count += 1
+                conn.executemany('INSERT INTO provides VALUES (?, ?)',
+                                 provides)
+                conn.execute('INSERT INTO repos VALUES (?, ?, ?, ?)',
+                             (url, revision, time.time(), count))
+        except sqlite3.Error, err:
+            raise GbsError('failed to update repo index %s: %s' % \
+                           (self.path, err))
+        log.debug('indexed %d packages of %s in %.2fs' % \
+                  (count, url, time.time() - start))
+
+    @staticmethod
+    def _remove(conn, url):
+        """Remove rows of repo."""
+        conn.execute('DELETE FROM provides WHERE package IN (SELECT id '
+                     'FROM packages WHERE repo = ?)', (url,))
+        conn.execute('DELETE FROM packages WHERE repo = ?', (url,))
+        conn.execute('DELETE FROM repos WHERE url = ?', (url,))
+
+    def remove(self, url):
+        """Remove repo from index."""
+        with self._connect() as conn:
+            self._remove(conn, str(url))
+
+    def whatprovides(self, capability, repos=None):
+        """
+        Find packages providing capability, which could be a glob pattern.
+        Packages of repos listed first come first if repos are given.
+        Returns: list of Package objects.
+        """
+        match = 'GLOB' if set('*?[') & set(capability) else '='
+        rows = self._connect().execute(
+            'SELECT DISTINCT packages.repo, packages.name, arch, epoch, '
+            'version, release, location, size, checksum FROM provides '
+            'JOIN packages ON provides.package = packages.id '
+            'WHERE provides.name %s ? '
+            'ORDER BY packages.name, arch' % match, (capability,)).fetchall()
+        packages = [Package(*row) for row in rows]
+        if repos is not None:
+            order = [str(repo) for repo in repos]
+            packages = sorted([pkg for pkg in packages if pkg.repo in order],
+                              key=lambda pkg: order.index(pkg.repo))
+        return packages
+
+    def missing(self, capabilities, repos):
+        """Capabilities not provided by any package of repos."""
+        return [cap for cap in capabilities
+                if not self.whatprovides(cap, repos)]
+
+
+REPO_INDEX = None
+
+def get_repo_index():
+    """Repo index in gbs tmpdir."""
+    global REPO_INDEX
+    if REPO_INDEX is None:
+        user = pwd.getpwuid(os.getuid())[0]
+        REPO_INDEX = RepoIndex(os.path.join(
+            configmgr.get('tmpdir', 'general'), '%s-gbs' % user,
+            'repoindex.db'))
+    return REPO_INDEX
@@ -0,0 +1,290 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+This module provides a persistent cache of parsed spec files, so specs
+which have not been changed are not parsed by rpm again.
+"""
+
+import os
+import re
+import pwd
+import json
+import hashlib
+import sqlite3
+
+from gitbuildsys.conf import configmgr
+from gitbuildsys.errors import GbsError
+from gitbuildsys.log import LOGGER as log
+
+import gbp.rpm
+from gbp.errors import GbpError
+
+
+# system macro files read by rpm, besides ~/.rpmmacros
+MACRO_PATHS = ('/usr/lib/rpm/macros', '/usr/lib/rpm/macros.d',
+               '/usr/lib/rpm/platform', '/etc/rpm')
+
+INCLUDE_RE = re.compile(r'^\s*%include\s+(\S+)', re.M)
+SOURCE_RE = re.compile(r'^Source(\d*)\s*:\s*(\S+)', re.M | re.I)
+TAG_RE = re.compile(r'^(Name|Version|Release)\s*:\s*(\S+)', re.M | re.I)
+
+
+def rpm_spec(fname):
+    """
+    Parse spec file by rpm, with its dir as source dir like gbp does.
+    Returns: rpm spec object, None if rpm python module isn't available.
+    """
+    try:
+        import rpm
+    except ImportError:
+        return None
+    rpm.addMacro('_sourcedir', os.path.dirname(os.path.abspath(fname)))
+    try:
+        return rpm.spec(fname)
+    except (ValueError, rpm.error), err:
+        raise GbsError('failed to parse spec file %s: %s' % (fname, err))
+    finally:
+        rpm.delMacro('_sourcedir')
+
+
+class SpecInfo(object):
+    """Values of a parsed spec file gbs cares about."""
+
+    FIELDS = ('name', 'epoch', 'upstreamversion', 'release', 'packages',
+              'buildrequires', 'provides')
+
+    def __init__(self, **kwargs):
+        def to_str(value):
+            '''json gives unicode strings'''
+            if isinstance(value, unicode):
+                return value.encode('utf-8')
+            if isinstance(value, list):
+                return [to_str(item) for item in value]
+            return value
+
+        for field in self.FIELDS:
+            setattr(self, field, to_str(kwargs.get(field)))
+        for field in ('packages', 'buildrequires', 'provides'):
+            if getattr(self, field) is None:
+                setattr(self, field, [])
+
+    @classmethod
+    def from_file(cls, fname):
+        """
+        Parse spec file once by rpm. Without rpm python module, only tags
+        gbp.rpm.SpecFile gives are known.
+        """
+        spec = rpm_spec(fname)
+        if spec is None:
+            try:
+                spec = gbp.rpm.SpecFile(fname)
+            except GbpError, err:
+                raise GbsError('%s' % err)
+            return cls(name=spec.name, epoch=spec.epoch,
+                       upstreamversion=spec.upstreamversion,
+                       release=spec.release, packages=[spec.name])
+
+        header = spec.sourceHeader
+        epoch = header['epoch']
+        return cls(name=str(header['name']),
+                   epoch=None if epoch is None else str(epoch),
+                   upstreamversion=str(header['version']),
+                   release=str(header['release']),
+                   packages=[str(pkg.header['name'])
+                             for pkg in spec.packages],
+                   # requires of source package are BuildRequires
+                   buildrequires=sorted(set(str(req) for req in
+                                            header['requirename'])),
+                   provides=sorted(set(str(prov)
+                                       for pkg in spec.packages
+                                       for prov in pkg.header['providename'])))
+
+    @property
+    def version(self):
+        """Same as gbp.rpm.SpecFile.version"""
+        version = {}
+        for key in ('epoch', 'upstreamversion', 'release'):
+            if getattr(self, key):
+                version[key] = getattr(self, key)
+        return version
+
+    def dumps(self):
+        """Serialize to json."""
+        return json.dumps(dict((field, getattr(self, field))
+                               for field in self.FIELDS))
+
+
+class SpecCache(object):
+    """
+    Parsed spec files stored in sqlite. Entries are keyed by the git
+    blob id of spec content and files it includes, so checked out and
+    working copy specs share entries, and by a fingerprint of rpm version
+    and macro files, which could change the result of parsing.
+    """
+
+    SCHEMA_VERSION = 3
+
+    def __init__(self, path):
+        self.path = path
+        self.fingerprint = self._fingerprint()
+        self._conn = None
+        self._pid = None
+
+    def _fingerprint(self):
+        """Hash of things other than spec content affecting parsing."""
+        sha = hashlib.sha1('%d' % self.SCHEMA_VERSION)
+        try:
+            import rpm
+            sha.update(rpm.__version__)
+        except (ImportError, AttributeError):
+            pass
+        try:
+            with open(os.path.expanduser('~/.rpmmacros')) as fobj:
+                sha.update(fobj.read())
+        except IOError:
+            pass
+        # system macros are owned by packages, stat tells their changes
+        for top in MACRO_PATHS:
+            for dirpath, dirnames, filenames in os.walk(top):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    sha.update('%s %d %d\0' % (path, stat.st_size,
+                                               stat.st_mtime))
+            if os.path.isfile(top):
+                stat = os.stat(top)
+                sha.update('%s %d %d\0' % (top, stat.st_size, stat.st_mtime))
+        return sha.hexdigest()
+
+    def _connect(self):
+        """Connection of current process, it can't be shared with children."""
+        if self._conn is None or self._pid != os.getpid():
+            dirn = os.path.dirname(self.path)
+            if not os.path.exists(dirn):
+                os.makedirs(dirn)
+            self._conn = sqlite3.connect(self.path, timeout=30)
+            self._conn.execute('CREATE TABLE IF NOT EXISTS specs '
+                               '(key TEXT PRIMARY KEY, info TEXT)')
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def blob_id(content):
+        """Same as `git hash-object`"""
+        return hashlib.sha1('blob %d\0%s' % (len(content), content)).hexdigest()
+
+    def includes(self, fname, content, seen=None):
+        """
+        Blob ids of files %include'd by spec content, recursively. Paths
+        are relative to spec dir, %{SOURCEn} refers to a source there.
+        Returns: list of ids, None if an included file can't be found.
+        """
+        def expand(text):
+            '''expand macros of name, version and release tags'''
+            return re.sub(r'%{?(name|version|release)}?',
+                          lambda match: tags.get(match.group(1), '%'), text)
+
+        specdir = os.path.dirname(os.path.abspath(fname))
+        tags = dict((tag.lower(), value)
+                    for tag, value in TAG_RE.findall(content))
+        sources = dict((num or '0', os.path.basename(expand(url)))
+                       for num, url in SOURCE_RE.findall(content))
+        seen = seen or set()
+        ids = []
+        for path in INCLUDE_RE.findall(content):
+            path = re.sub(r'%{?SOURCE(\d+)}?',
+                          lambda match: sources.get(match.group(1), '%'),
+                          expand(path))
+            path = re.sub(r'%{?_(source|spec)dir}?', specdir, path)
+            if '%' in path:
+                log.debug('unknown file %s included by %s' % (path, fname))
+                return None
+            path = os.path.join(specdir, path)
+            if path in seen:
+                continue
+            seen.add(path)
+            try:
+                with open(path) as fobj:
+                    included = fobj.read()
+            except IOError:
+                log.debug('missing file %s included by %s' % (path, fname))
+                return None
+            nested = self.includes(path, included, seen)
+            if nested is None:
+                return None
+            ids += [self.blob_id(included)] + nested
+        return ids
+
+    def parse(self, fname):
+        """
+        Parse spec file, reuse the result of same content if there's one.
+        Specs including files that can't be found are always parsed.
+        Returns: SpecInfo object.
+        """
+        try:
+            with open(fname) as fobj:
+                content = fobj.read()
+        except IOError, err:
+            raise GbsError('failed to read spec file %s: %s' % (fname, err))
+        included = self.includes(fname, content)
+        key = None
+        if included is not None:
+            blob = self.blob_id(content)
+            if included:
+                blob = hashlib.sha1(' '.join([blob] + included)).hexdigest()
+            key = '%s-%s' % (blob, self.fingerprint)
+
+        row = None
+        try:
+            if key:
+                row = self._connect().execute('SELECT info FROM specs WHERE '
+                                              'key = ?', (key,)).fetchone()
+        except sqlite3.Error, err:
+            log.debug('spec cache %s is not available: %s' % (self.path, err))
+        if row:
+            log.debug('parsed %s is served from cache' % fname)
+            return SpecInfo(**json.loads(row[0]))
+
+        info = SpecInfo.from_file(fname)
+        if not key:
+            return info
+
+        try:
+            with self._connect() as conn:
+                conn.execute('INSERT OR REPLACE INTO specs VALUES (?, ?)',
+                             (key, info.dumps()))
+        except sqlite3.Error, err:
+            log.debug('failed to update spec cache %s: %s' % (self.path, err))
+        return info
+
+
+SPEC_CACHE = None
+
+def parse_spec(fname):
+    """Parse spec file using the spec cache in gbs tmpdir."""
+    global SPEC_CACHE
+    if SPEC_CACHE is None:
+        user = pwd.getpwuid(os.getuid())[0]
+        SPEC_CACHE = SpecCache(os.path.join(configmgr.get('tmpdir', 'general'),
+                                            '%s-gbs' % user, 'specs.db'))
+    return SPEC_CACHE.parse(fname)
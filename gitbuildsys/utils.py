@@ -20,6 +20,11 @@
 
 import os
 import re
+import sys
+import time
+import errno
+import fcntl
+import json
 import gzip
 import glob
 import tempfile
@@ -30,59 +35,111 @@ import fnmatch
 import signal
 import subprocess
 import argparse
+import urlparse
+import threading
+import cPickle as pickle
+import contextlib
 import xml.etree.ElementTree as ET
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 from gitbuildsys.errors import UrlError, GbsError
+from gitbuildsys.safe_url import SafeURL
 from gitbuildsys.log import LOGGER as log
 
 from gbp.rpm.git import RpmGitRepository, GitRepositoryError
 from gbp.errors import GbpError
 
 
-class Workdir(object):
+def ignore_sigint():
+    """Let parent process handle ^C and terminate workers."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def call_in_dir(path, func, *args):
     """
-    Context manager, which makes it easy to enter some directory
-    do something and return back.
-    Usage example:
-        with utils.Workdir(workdir):
-            # do something here
-        # here you're again in the same dir as before
+    Call func with args in a new python process working in path, for code
+    which only works in current directory. Current directory of this
+    process isn't changed, and nothing is forked from it, so it's safe to
+    be called from threads. func must be a module level function. The
+    child is killed by ^C like any other command, exceptions raised by
+    func, including SystemExit, are raised again here.
+    Returns: what func returns.
     """
-    def __init__(self, path):
-        self._newdir = path
-        self._cwd = os.getcwd()
-
-    def __enter__(self):
-        os.chdir(self._newdir)
+    path = os.path.abspath(path)
+    fd, fname = tempfile.mkstemp(prefix='.gbs_call_')
+    os.close(fd)
+    # same modules as this process, including ones of relative paths
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        os.path.abspath(dirn) for dirn in sys.path))
+    try:
+        try:
+            proc = subprocess.Popen([sys.executable, '-c',
+                                     'from gitbuildsys.utils import '
+                                     '_call_pickled; _call_pickled()'],
+                                    stdin=subprocess.PIPE, cwd=path, env=env)
+        except OSError, err:
+            raise GbsError('failed to run in %s: %s' % (path, err))
+        try:
+            proc.communicate(pickle.dumps((func, args, fname),
+                                          pickle.HIGHEST_PROTOCOL))
+        except BaseException:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            raise
+        with open(fname, 'rb') as fobj:
+            data = fobj.read()
+    finally:
+        os.unlink(fname)
 
-    def __exit__(self, _type, _value, _tb):
-        os.chdir(self._cwd)
+    try:
+        succeeded, result = pickle.loads(data)
+    except (pickle.UnpicklingError, EOFError):
+        # killed before writing the result
+        raise GbsError('process working in %s exited with status %d' % \
+                       (path, proc.returncode))
+    if not succeeded:
+        raise result
+    return result
+
+def _call_pickled():
+    """
+    Child of call_in_dir(), which reads func, args and the file to write
+    the result to from stdin.
+    """
+    func, args, fname = pickle.load(sys.stdin)
+    try:
+        result = (True, func(*args))
+    except BaseException, err:
+        result = (False, err)
+    try:
+        data = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        # some exceptions can be pickled but not unpickled
+        pickle.loads(data)
+    except Exception:
+        data = pickle.dumps((False, GbsError(str(result[1]))),
+                            pickle.HIGHEST_PROTOCOL)
+    with open(fname, 'wb') as fobj:
+        fobj.write(data)
 
 def guess_spec(git_path, packaging_dir, given_spec, commit_id='WC.UNTRACKED'):
     """Guess spec file from project name if not given."""
     git_path = os.path.abspath(git_path)
 
     if commit_id == 'WC.UNTRACKED':
-        if os.path.islink(packaging_dir):
-            packaging_dir = os.readlink(packaging_dir)
+        if os.path.islink(os.path.join(git_path, packaging_dir)):
+            packaging_dir = os.readlink(os.path.join(git_path,
+                                                     packaging_dir))
         check = lambda fname, dir_only=False: os.path.exists(os.path.join(
                        git_path, fname))
         glob_ = lambda pattern: [name.replace(git_path+'/', '')
             for name in reversed(glob.glob(os.path.join(git_path, pattern)))]
         msg = 'No such spec file %s'
     else:
-        git_object = commit_id + ':' + packaging_dir
-        cmd = ['git', 'show', git_object]
-        try:
-            with Workdir(git_path):
-                outp = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        except (subprocess.CalledProcessError, OSError):
-            raise GbsError("failed to run %s in %s" % (' '.join(cmd), git_path))
-        output = outp.communicate()[0]
-        if not output.startswith('tree %s' % git_object):
+        result = get_object_reader(git_path).read(rev_path(commit_id,
+                                                           packaging_dir))
+        if not result or result[0] != 'tree':
             # packaging_dir is a symlink
-            packaging_dir = output
+            packaging_dir = result[1] if result else ''
         check = lambda fname, dir_only=False : file_exists_in_rev(git_path,
                        fname, commit_id, dir_only=dir_only)
         glob_ = lambda pattern: glob_in_rev(git_path, pattern, commit_id)
@@ -107,6 +164,39 @@ def guess_spec(git_path, packaging_dir, given_spec, commit_id='WC.UNTRACKED'):
     return [spec, specs]
 
 
+class PhaseTimer(object):
+    """Record wall clock and CPU time spent in named phases."""
+
+    def __init__(self):
+        self.phases = []
+
+    @contextlib.contextmanager
+    def phase(self, name, **extra):
+        """
+        Time the body of with statement as phase name. CPU time of
+        children is only accounted once they have been waited for.
+        """
+        start, times = time.time(), os.times()
+        try:
+            yield extra
+        finally:
+            now = os.times()
+            record = {'name': name,
+                      'wall': time.time() - start,
+                      'cpu': now[0] + now[1] - times[0] - times[1],
+                      'children_cpu': now[2] + now[3] - times[2] - times[3]}
+            record.update(extra)
+            self.phases.append(record)
+
+    def save(self, fname):
+        """Save phases to json file."""
+        try:
+            with open(fname, 'w') as fobj:
+                json.dump({'phases': self.phases}, fobj, indent=2)
+        except IOError, err:
+            raise GbsError('failed to save timings to %s: %s' % (fname, err))
+
+
 class Temp(object):
     """
     Create temporary file or directory.
@@ -180,13 +270,244 @@ class TempCopy(object):
             os.unlink(self.name)
 
 
+class FileLock(object):
+    """
+    Exclusive or shared flock(2) of a file, released on release() or when
+    the process holding it exits.
+    """
+
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        self._fobj = None
+
+    def acquire(self, blocking=True):
+        """Lock file, return False if it's held by others and not blocking."""
+        dirn = os.path.dirname(self.path)
+        if dirn and not os.path.exists(dirn):
+            os.makedirs(dirn)
+        fobj = open(self.path, 'a')
+        try:
+            fcntl.flock(fobj, (fcntl.LOCK_SH if self.shared else
+                               fcntl.LOCK_EX) |
+                              (0 if blocking else fcntl.LOCK_NB))
+        except IOError, err:
+            fobj.close()
+            if not blocking and err.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        self._fobj = fobj
+        return True
+
+    def release(self):
+        """Unlock file."""
+        if self._fobj:
+            self._fobj.close()
+            self._fobj = None
+
+    def held(self):
+        """
+        Check if lock is held, by other processes or other locks of this
+        process.
+        """
+        try:
+            fobj = open(self.path)
+        except IOError:
+            return False
+        try:
+            fcntl.flock(fobj, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError, err:
+            if err.errno in (errno.EAGAIN, errno.EACCES):
+                return True
+            raise
+        finally:
+            fobj.close()
+        return False
+
+    def __enter__(self):
+        if not self.acquire(blocking=False):
+            log.info('waiting for lock %s ...' % self.path)
+            self.acquire()
+        return self
+
+    def __exit__(self, *_args):
+        self.release()
+
+
 class PageNotFound(Exception):
     """Custom exception to handle HTTP 404 error."""
 
+def url_error(url, errcode, errmsg, http_code):
+    """
+    Translate curl error of url into exception.
+    Returns: exception instance to be raised by caller.
+    """
+    if errcode == pycurl.E_OPERATION_TIMEOUTED or http_code == 503:
+        proxies = ['Detected proxies set in system environment:']
+        env = os.environ
+        for key in ['HTTPS_PROXY', 'HTTP_PROXY', 'FTP_PROXY',
+                    'https_proxy', 'http_proxy', 'ftp_proxy',
+                    'NO_PROXY', 'no_proxy']:
+            proxies.append('%s=%s' % (key, env.get(key, '')))
+        return UrlError("connect timeout to %s, maybe it's caused by "
+                        "proxy settings, please check. %s" % (url,
+                        '\n  '.join(proxies)))
+    elif errcode == pycurl.E_ABORTED_BY_CALLBACK:
+        return KeyboardInterrupt(errcode, errmsg)
+    elif http_code in (401, 403):
+        return UrlError('authenticate failed on: %s' % url)
+    elif http_code == 404:
+        return PageNotFound(errcode, errmsg)
+    return UrlError('URL error on %s: (%s: "%s")' % (url, errcode, errmsg))
+
+class HTTPCache(object):
+    """
+    Persistent cache of fetched metadata files keyed by url.
+    Entries are revalidated with ETag/Last-Modified, trusted without
+    any request within ttl seconds, and evicted in LRU order once the
+    cache grows beyond max_size bytes.
+    """
+
+    def __init__(self, cachedir, ttl=0, max_size=0):
+        self.cachedir = cachedir
+        self.ttl = ttl
+        self.max_size = max_size
+        if not os.path.exists(cachedir):
+            os.makedirs(cachedir)
+
+    def _paths(self, url):
+        """Return data and meta file paths of url."""
+        key = hashlib.sha1(url).hexdigest()
+        path = os.path.join(self.cachedir, key)
+        return path, path + '.json'
+
+    def _lookup(self, url):
+        """Return meta of cached url, None if it's not cached."""
+        data, meta = self._paths(url)
+        if not os.path.exists(data):
+            return None
+        try:
+            with open(meta) as fobj:
+                return json.load(fobj)
+        except (IOError, ValueError):
+            return None
+
+    @staticmethod
+    def _write(path, content=None, src=None):
+        """Atomically replace path by content or copy of src."""
+        # unique for threads writing the same entry, pid tells it's stale
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + '.',
+                                   suffix='.%d.tmp' % os.getpid(),
+                                   dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'w') as fobj:
+                if src:
+                    with open(src) as sfobj:
+                        shutil.copyfileobj(sfobj, fobj)
+                else:
+                    fobj.write(content)
+            os.chmod(tmp, 0644)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def fresh_copy(self, url, filename, no_cache=False):
+        """
+        Copy cached url to filename if it's younger than ttl.
+        Returns: True if filename has been served from cache.
+        """
+        meta = self._lookup(url)
+        if no_cache or not meta or not self.ttl or \
+                time.time() - meta['checked'] > self.ttl:
+            return False
+
+        data = self._paths(url)[0]
+        shutil.copyfile(data, filename)
+        os.utime(data, None)
+        log.debug('%s is served from cache' % url)
+        return True
+
+    def validators(self, url):
+        """Conditional request headers for url."""
+        meta = self._lookup(url)
+        if not meta:
+            return []
+        headers = []
+        if meta.get('etag'):
+            headers.append('If-None-Match: %s' % meta['etag'])
+        if meta.get('last_modified'):
+            headers.append('If-Modified-Since: %s' % meta['last_modified'])
+        return headers
+
+    def update(self, url, filename, http_code, headers):
+        """Update cache by response of url saved to filename."""
+        data, meta = self._paths(url)
+        entry = {'url': url,
+                 'etag': headers.get('etag'),
+                 'last_modified': headers.get('last-modified')}
+        if http_code == 304:
+            cached = self._lookup(url)
+            if not cached:
+                raise UrlError('cached copy of %s has been removed, please '
+                               'try again' % url)
+            # 304 response is not required to repeat validators
+            for key in ('etag', 'last_modified'):
+                entry[key] = entry[key] or cached.get(key)
+            shutil.copyfile(data, filename)
+            os.utime(data, None)
+            log.debug('%s is not modified, using cached copy' % url)
+        elif http_code == 200 and (entry['etag'] or entry['last_modified'] or
+                                   self.ttl):
+            self._write(data, src=filename)
+        else:
+            return
+
+        entry['checked'] = time.time()
+        self._write(meta, json.dumps(entry))
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until cache fits max_size."""
+        if not self.max_size:
+            return
+
+        entries = []
+        total = 0
+        for name in os.listdir(self.cachedir):
+            path = os.path.join(self.cachedir, name)
+            if name.endswith('.json') or name.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        for _mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            for fname in (path, path + '.json'):
+                if os.path.exists(fname):
+                    os.unlink(fname)
+            total -= size
+
+
 class URLGrabber(object):
     '''grab an url and save to local file'''
 
-    def __init__(self, connect_timeout=30):
+    TIMINGS = {'namelookup': pycurl.NAMELOOKUP_TIME,
+               'connect': pycurl.CONNECT_TIME,
+               'appconnect': pycurl.APPCONNECT_TIME,
+               'starttransfer': pycurl.STARTTRANSFER_TIME,
+               'total': pycurl.TOTAL_TIME,
+               'size': pycurl.SIZE_DOWNLOAD,
+               'speed': pycurl.SPEED_DOWNLOAD}
+
+    def __init__(self, connect_timeout=30, cache=None, mirrors=None,
+                 stats=None):
         '''create Curl object and set one-time options'''
         curl = pycurl.Curl()
         curl.setopt(pycurl.FAILONERROR, True)
@@ -195,7 +516,24 @@ class URLGrabber(object):
         curl.setopt(pycurl.SSL_VERIFYHOST, False)
         curl.setopt(pycurl.CONNECTTIMEOUT, connect_timeout)
         #curl.setopt(pycurl.VERBOSE, 1)
+        self.headers = {}
+        curl.setopt(pycurl.HEADERFUNCTION, self._header_parser(self.headers))
         self.curl = curl
+        self.cache = cache
+        self.mirrors = mirrors
+        self.stats = stats
+
+    @staticmethod
+    def _header_parser(headers):
+        '''return curl header callback which saves headers to dict'''
+        def parse(line):
+            '''headers of last response win if redirected'''
+            if line.startswith('HTTP/'):
+                headers.clear()
+            elif ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+        return parse
 
     def change_url(self, url, outfile, user, passwd, no_cache=False):
         '''change options for individual url'''
@@ -214,7 +552,14 @@ class URLGrabber(object):
             httpheader.append('Pragma: no-cache')
             httpheader.append('Cache-Control: no-cache')
             log.debug("disable HTTP caching")
-        curl.setopt(pycurl.HTTPHEADER, httpheader)
+        if self.cache:
+            httpheader.extend(self.cache.validators(url))
+        if httpheader:
+            curl.setopt(pycurl.HTTPHEADER, httpheader)
+        else:
+            # empty list doesn't reset headers of previous url
+            curl.unsetopt(pycurl.HTTPHEADER)
+        self.headers.clear()
 
     def perform(self):
         '''do the real Curl perform work'''
@@ -242,26 +587,7 @@ class URLGrabber(object):
 
             errcode, errmsg = err.args
             http_code = curl.getinfo(pycurl.HTTP_CODE)
-
-            if errcode == pycurl.E_OPERATION_TIMEOUTED or http_code == 503:
-                proxies = ['Detected proxies set in system environment:']
-                env = os.environ
-                for key in ['HTTPS_PROXY', 'HTTP_PROXY', 'FTP_PROXY',
-                            'https_proxy', 'http_proxy', 'ftp_proxy',
-                            'NO_PROXY', 'no_proxy']:
-                    proxies.append('%s=%s' % (key, env.get(key, '')))
-                raise UrlError("connect timeout to %s, maybe it's caused by "
-                               "proxy settings, please check. %s" % (curl.url,
-                               '\n  '.join(proxies)))
-            elif errcode == pycurl.E_ABORTED_BY_CALLBACK:
-                raise KeyboardInterrupt(err)
-            elif http_code in (401, 403):
-                raise UrlError('authenticate failed on: %s' % curl.url)
-            elif http_code == 404:
-                raise PageNotFound(err)
-            else:
-                raise UrlError('URL error on %s: (%s: "%s")' %
-                               (curl.url, errcode, errmsg))
+            raise url_error(curl.url, errcode, errmsg, http_code)
         finally:
             signal.signal(signal.SIGINT, original_handler)
 
@@ -271,24 +597,463 @@ class URLGrabber(object):
         self.curl = None
 
     def grab(self, url, filename, user=None, passwd=None, no_cache=False):
-        """Grab url to file."""
+        """Grab url to file, fail over to other mirrors of url on errors."""
 
         log.debug("fetching %s => %s" % (url, filename))
 
-        with open(filename, 'w') as outfile:
-            self.change_url(url, outfile, user, passwd, no_cache)
-            self.perform()
+        if self.cache and self.cache.fresh_copy(url, filename, no_cache):
+            return
+
+        while True:
+            try:
+                with open(filename, 'w') as outfile:
+                    self.change_url(url, outfile, user, passwd, no_cache)
+                    try:
+                        self.perform()
+                    finally:
+                        self.record()
+                break
+            except UrlError, err:
+                mirror = self.mirrors and self.mirrors.failover(url)
+                if not mirror:
+                    raise
+                log.warning('%s, retrying with %s' % (err, mirror))
+                url, user, passwd = mirror, mirror.user, mirror.passwd
+        self.finish(filename)
+
+    def timings(self):
+        """Timings in seconds, size and speed of last transfer."""
+        return dict((key, self.curl.getinfo(info))
+                    for key, info in self.TIMINGS.items())
+
+    def record(self):
+        """Append url, status and timings of last transfer to stats."""
+        if self.stats is None:
+            return
+        stat = self.timings()
+        stat.update({'url': str(self.curl.url),
+                     'code': self.curl.getinfo(pycurl.HTTP_CODE),
+                     'redirects': self.curl.getinfo(pycurl.REDIRECT_COUNT)})
+        self.stats.append(stat)
+
+    def finish(self, filename):
+        """Update cache by the response of last transfer."""
+        if self.cache:
+            self.cache.update(self.curl.url, filename,
+                              self.curl.getinfo(pycurl.HTTP_CODE),
+                              self.headers)
+
+
+class MultiURLGrabber(object):
+    '''grab a batch of urls concurrently using one curl multi handle'''
+
+    def __init__(self, connect_timeout=30, max_connections=8,
+                 max_host_connections=4, cache=None, mirrors=None,
+                 stats=None, resume=False):
+        self.connect_timeout = connect_timeout
+        self.cache = cache
+        self.mirrors = mirrors
+        self.stats = stats
+        # append to existing files instead of fetching urls from start
+        self.resume = resume
+        self.max_connections = max_connections
+        self.max_host_connections = max_host_connections
+
+    def grab(self, jobs):
+        """
+        Grab urls to files concurrently.
+        jobs: list of (url, filename, user, passwd, no_cache) tuples.
+        Returns: list of results in the same order as jobs, every result
+        is the file name if fetch succeeds, else the exception instance
+        which URLGrabber.grab() would raise for that url. Timings of
+        transfers are kept in self.timings in the same order.
+        """
+        results = [None] * len(jobs)
+        self.timings = [None] * len(jobs)
+        if not jobs:
+            return results
+
+        pending = list(enumerate(jobs))
+        free = [URLGrabber(self.connect_timeout, self.cache,
+                           stats=self.stats)
+                for _ in range(min(len(jobs), self.max_connections))]
+        active = {}
+        host_conns = defaultdict(int)
+        multi = pycurl.CurlMulti()
+
+        def start_transfers():
+            '''move pending jobs to the multi handle, honouring limits'''
+            for item in pending[:]:
+                if not free:
+                    break
+                url = item[1][0]
+                host = urlparse.urlsplit(url).netloc
+                if host_conns[host] >= self.max_host_connections:
+                    continue
+                pending.remove(item)
+                index, job = item
+                url, filename, user, passwd, no_cache = job
+                log.debug("fetching %s => %s" % (url, filename))
+                if self.cache and self.cache.fresh_copy(url, filename,
+                                                        no_cache):
+                    results[index] = filename
+                    continue
+
+                grabber = free.pop()
+                offset = 0
+                if self.resume and os.path.exists(filename):
+                    offset = os.path.getsize(filename)
+                    log.debug('resuming %s from %d' % (url, offset))
+                outfile = open(filename, 'ab' if offset else 'w')
+                grabber.change_url(url, outfile, user, passwd, no_cache)
+                if self.resume:
+                    grabber.curl.setopt(pycurl.RESUME_FROM_LARGE, offset)
+                multi.add_handle(grabber.curl)
+                active[grabber.curl] = (index, grabber, outfile, host, job)
+                host_conns[host] += 1
+
+        def finish_transfer(curl, error=None):
+            '''collect result of one finished transfer'''
+            multi.remove_handle(curl)
+            index, grabber, outfile, host, job = active.pop(curl)
+            outfile.close()
+            host_conns[host] -= 1
+            free.append(grabber)
+            self.timings[index] = grabber.timings()
+            grabber.record()
+
+            if error is None:
+                try:
+                    grabber.finish(outfile.name)
+                    results[index] = outfile.name
+                except UrlError, err:
+                    results[index] = err
+                return
+
+            log.debug('fetching error:%s' % str(error))
+            errcode, errmsg = error
+            if self.resume and errcode == pycurl.E_RANGE_ERROR:
+                log.debug('%s can\'t be resumed, fetching it from start' % \
+                          curl.url)
+                os.unlink(outfile.name)
+                pending.append((index, job))
+                return
+            err = url_error(curl.url, errcode, errmsg,
+                            curl.getinfo(pycurl.HTTP_CODE))
+            mirror = isinstance(err, UrlError) and self.mirrors and \
+                     self.mirrors.failover(curl.url)
+            if mirror:
+                log.warning('%s, retrying with %s' % (err, mirror))
+                pending.append((index, (mirror, outfile.name, mirror.user,
+                                        mirror.passwd, job[4])))
+            else:
+                results[index] = err
+
+        try:
+            while pending or active:
+                start_transfers()
+                while True:
+                    ret, _num_handles = multi.perform()
+                    if ret != pycurl.E_CALL_MULTI_PERFORM:
+                        break
+                while True:
+                    num_queued, ok_list, err_list = multi.info_read()
+                    for curl in ok_list:
+                        finish_transfer(curl)
+                    for curl, errcode, errmsg in err_list:
+                        finish_transfer(curl, (errcode, errmsg))
+                    if not num_queued:
+                        break
+                if active:
+                    multi.select(1.0)
+        finally:
+            for curl, (_index, _grabber, outfile, _host, _job) in \
+                    active.items():
+                multi.remove_handle(curl)
+                outfile.close()
+            multi.close()
+
+        return results
+
+
+class MirrorRanking(object):
+    """
+    Rank mirrors of repos by the latency of fetching their metadata.
+    Probe results are kept in a json file and only refreshed once they
+    are older than ttl seconds. Mirrors failing during a run are marked
+    unhealthy until they are probed again.
+    """
+
+    PROBES = ('repodata/repomd.xml', 'builddata/build.xml')
+
+    def __init__(self, path, ttl=0):
+        self.path = path
+        self.ttl = ttl
+        self.groups = []
+        try:
+            with open(path) as fobj:
+                self.stats = json.load(fobj)
+        except (IOError, ValueError):
+            self.stats = {}
+
+    def add(self, mirrors):
+        """Add mirrors serving the same repo, primary url first."""
+        self.groups.append(list(mirrors))
+
+    def _save(self):
+        """Atomically write probe results to disk."""
+        dirn = os.path.dirname(self.path)
+        if not os.path.exists(dirn):
+            os.makedirs(dirn)
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'w') as fobj:
+            json.dump(self.stats, fobj, indent=2, sort_keys=True)
+        os.rename(tmp, self.path)
+
+    def _stale(self, mirror):
+        """Check if mirror need to be probed."""
+        stat = self.stats.get(str(mirror))
+        return not stat or not self.ttl or \
+               time.time() - stat['time'] > self.ttl
+
+    def probe(self):
+        """Probe mirrors with outdated results concurrently."""
+        mirrors = [mirror for group in self.groups for mirror in group
+                   if self._stale(mirror)]
+        if not mirrors:
+            return
+
+        log.info('probing %d repo mirrors ...' % len(mirrors))
+        tmpdir = Temp(prefix='mirrors-%d-' % os.getpid(),
+                      dirn=os.path.dirname(self.path),
+                      directory=True)
+        grabber = MultiURLGrabber(connect_timeout=10)
+        timings = {}
+        # a mirror is healthy if any well known metadata file is there
+        for probe in self.PROBES:
+            left = [mirror for mirror in mirrors if mirror not in timings]
+            jobs = [(mirror.pathjoin(probe),
+                     os.path.join(tmpdir.path, '%d' % index),
+                     mirror.user, mirror.passwd, True)
+                    for index, mirror in enumerate(left)]
+            for mirror, result, timing in zip(left, grabber.grab(jobs),
+                                              grabber.timings):
+                if isinstance(result, str):
+                    timings[mirror] = timing
+
+        now = time.time()
+        for mirror in mirrors:
+            timing = timings.get(mirror)
+            if timing:
+                log.debug('mirror %s: %.3fs, %d bytes/s' % \
+                          (mirror, timing['total'], timing['speed']))
+                self.stats[str(mirror)] = {'time': now, 'healthy': True,
+                                           'latency': timing['starttransfer'],
+                                           'total': timing['total'],
+                                           'speed': timing['speed']}
+            else:
+                log.warning('mirror %s is not available' % mirror)
+                self.stats[str(mirror)] = {'time': now, 'healthy': False}
+        self._save()
+
+    def _healthy(self, mirror):
+        """Mirrors never probed are assumed to be healthy."""
+        return self.stats.get(str(mirror), {}).get('healthy', True)
+
+    def rank(self, group):
+        """Sort mirrors of group, fastest healthy ones first."""
+        def key(mirror):
+            '''unhealthy last, mirrors without timings keep config order'''
+            stat = self.stats.get(str(mirror), {})
+            return not self._healthy(mirror), stat.get('total', float('inf'))
+        return sorted(group, key=key)
+
+    def _find(self, url):
+        """Find group and mirror which url belongs to."""
+        for group in self.groups:
+            for mirror in group:
+                if url.startswith(mirror.rstrip('/') + '/') or \
+                        url.rstrip('/') == mirror.rstrip('/'):
+                    return group, mirror
+        return None, None
+
+    @staticmethod
+    def _rewrite(url, mirror, target):
+        """Replace mirror prefix of url with target mirror."""
+        return SafeURL(target.rstrip('/') + url[len(mirror.rstrip('/')):],
+                       target.user, target.passwd)
+
+    def best(self, url):
+        """Rewrite url to be served by the best mirror of its repo."""
+        group, mirror = self._find(url)
+        if not group:
+            return url
+        best = self.rank(group)[0]
+        if best == mirror:
+            return url
+        return self._rewrite(url, mirror, best)
+
+    def primary(self, url):
+        """
+        Rewrite url to be served by the primary mirror of its repo, so
+        the repo is identified the same whichever mirror serves it.
+        """
+        group, mirror = self._find(url)
+        if not group or mirror == group[0]:
+            return url
+        return self._rewrite(url, mirror, group[0])
+
+    def failover(self, url):
+        """
+        Mark mirror serving url as unhealthy.
+        Returns: url rewritten to the best healthy mirror left, or None.
+        """
+        group, mirror = self._find(url)
+        if not group:
+            return None
+
+        stat = self.stats.setdefault(str(mirror), {'time': 0})
+        stat['healthy'] = False
+        self._save()
+        for other in self.rank(group):
+            if other != mirror and self._healthy(other):
+                return self._rewrite(url, mirror, other)
+        return None
+
+
+class RepoMD(object):
+    """Parsed repodata/repomd.xml of a standard repo."""
+
+    def __init__(self, fname):
+        self.revision = None
+        self.data = {}
+
+        try:
+            root = ET.parse(fname).getroot()
+        except ET.ParseError:
+            log.warning('Not well formed xml: %s' % fname)
+            return
+
+        # get namespace of repomd element
+        xmlns = re.sub('repomd$', '', root.tag)
+        revision = root.find('%srevision' % xmlns)
+        if revision is not None and revision.text:
+            self.revision = revision.text.strip()
+
+        for elem in root.findall('%sdata' % xmlns):
+            item = {}
+            location = elem.find('%slocation' % xmlns)
+            if location is not None and 'href' in location.attrib:
+                item['href'] = location.attrib['href']
+            checksum = elem.find('%schecksum' % xmlns)
+            if checksum is not None and checksum.text:
+                item['checksum'] = (checksum.get('type', 'sha256'),
+                                    checksum.text.strip())
+            self.data.setdefault(elem.attrib['type'], item)
+
+    def location(self, data_type):
+        """Return location href of data_type, None if not found."""
+        return self.data.get(data_type, {}).get('href')
+
+
+def link_or_copy(src, dst, link=True):
+    """
+    Atomically replace dst by a hardlink of src, or by a copy if link is
+    False or linking isn't possible. dst is left alone if it's src itself.
+    """
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return
+    tmp = '%s.%d.tmp' % (dst, os.getpid())
+    if os.path.lexists(tmp):
+        os.unlink(tmp)
+    try:
+        if not link:
+            raise OSError('linking is not wanted')
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.rename(tmp, dst)
+
+
+class BuildConfStore(object):
+    """
+    Content addressed store of build confs fetched from repos. Objects
+    are named by checksum of the file in repo, so a conf referred by
+    repomd.xml is only downloaded once whichever profile uses it.
+    Objects are read only, as they are hardlinked to build confs in use.
+    """
+
+    # checksum type names used by repomd.xml
+    ALGORITHMS = {'sha': 'sha1', 'sha1': 'sha1', 'sha256': 'sha256',
+                  'sha512': 'sha512', 'md5': 'md5'}
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def lookup(self, checksum):
+        """Return object path of (type, value) checksum, None if missing."""
+        algorithm = self.ALGORITHMS.get(checksum[0])
+        if not algorithm:
+            return None
+        obj = os.path.join(self.path, '%s-%s.conf' % (algorithm, checksum[1]))
+        return obj if os.path.exists(obj) else None
+
+    def add(self, fname, checksum=None):
+        """
+        Decompress fetched fname into store and verify its checksum.
+        Returns: path of object in store.
+        """
+        ctype, expected = checksum or ('sha256', None)
+        algorithm = self.ALGORITHMS.get(ctype)
+        if not algorithm:
+            log.warning('unknown checksum type %s of %s' % (ctype, fname))
+            algorithm, expected = 'sha256', None
+
+        actual = file_checksum(fname, algorithm)
+        if expected and actual != expected:
+            raise GbsError('checksum of build conf %s does not match '
+                           'repomd.xml: %s != %s' % (fname, actual, expected))
+
+        obj = os.path.join(self.path, '%s-%s.conf' % (algorithm, actual))
+        if not os.path.exists(obj):
+            if fname.endswith('.gz'):
+                src = gzip.open(fname, 'rb')
+            else:
+                src = open(fname, 'rb')
+            tmp = '%s.%d.tmp' % (obj, os.getpid())
+            try:
+                with open(tmp, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+            finally:
+                src.close()
+            # objects are hardlinked to build confs used by builds, keep
+            # them from being changed in place through these links
+            os.chmod(tmp, 0444)
+            os.rename(tmp, obj)
+        return obj
 
 
 class RepoParser(object):
     """Repository parser for generate real repourl and build config."""
 
-    def __init__(self, repos, cachedir):
+    def __init__(self, repos, cachedir, httpcache=None, confstore=None,
+                 mirrors=None, stats=None):
         self.cachedir = cachedir
+        self.confstore = confstore or BuildConfStore(cachedir)
+        self.mirrors = mirrors
         self.repourls = defaultdict(list)
         self.buildconf = None
         self.standardrepos = []
-        self.urlgrabber = URLGrabber()
+        self.urlgrabber = URLGrabber(cache=httpcache, mirrors=mirrors,
+                                     stats=stats)
+        self.multigrabber = MultiURLGrabber(cache=httpcache, mirrors=mirrors,
+                                            stats=stats)
+        # per run memos, every url is fetched and parsed only once
+        self._fetched = {}
+        self._repomds = {}
+        self._metas = {}
 
         self.localrepos, remotes = self.split_out_local_repo(repos)
         self.parse(remotes)
@@ -345,40 +1110,87 @@ class RepoParser(object):
         """Parse build.xml and pickup standard repos it contains."""
         archs = meta.get('archs', [])
         repos = meta.get('repos', [])
+        repourls = []
 
         for arch in archs:
             for repo in repos:
                 repourl = baseurl.pathjoin('repos/%s/%s/packages' % (repo,
                                                                      arch))
-                if self.is_standard_repo(repourl):
-                    self.repourls[arch].append(repourl)
+                repourls.append((arch, repourl))
+
+        self.prefetch([url.pathjoin('repodata/repomd.xml')
+                       for _arch, url in repourls], no_cache=True)
+        for arch, repourl in repourls:
+            if self.is_standard_repo(repourl):
+                self.repourls[arch].append(repourl)
+
+    def _local_name(self, url):
+        """Local file name in cache dir, unique for each url."""
+        return os.path.join(self.cachedir, '%s-%s' % (
+            hashlib.md5(url).hexdigest()[:8], os.path.basename(url)))
+
+    def prefetch(self, urls, no_cache=False):
+        """
+        Fetch urls concurrently. Results are memorized, so following
+        fetch() calls of these urls can stay sequential.
+        """
+        unique = []
+        for url in urls:
+            if url not in self._fetched and url not in unique:
+                unique.append(url)
+        jobs = [(url, self._local_name(url), url.user, url.passwd, no_cache)
+                for url in unique]
+        for url, result in zip(unique, self.multigrabber.grab(jobs)):
+            if isinstance(result, PageNotFound):
+                result = None
+            self._fetched[url] = result
 
     def fetch(self, url, no_cache=False):
         """
-        Fetch url.
+        Fetch url, every url is fetched only once per RepoParser.
         Returns: file name if fetch succeds, else None.
         """
-        fname = os.path.join(self.cachedir, os.path.basename(url))
-
-        try:
-            self.urlgrabber.grab(url, fname, url.user, url.passwd, no_cache)
-        except PageNotFound:
-            return
-
-        return fname
+        if url not in self._fetched:
+            fname = self._local_name(url)
+            try:
+                self.urlgrabber.grab(url, fname, url.user, url.passwd,
+                                     no_cache)
+            except PageNotFound:
+                fname = None
+            self._fetched[url] = fname
+
+        result = self._fetched[url]
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    def get_repomd(self, repo):
+        """
+        Fetch and parse repodata/repomd.xml of repo.
+        Returns: RepoMD object, None if repo is not a standard repo.
+        """
+        repomd_url = repo.pathjoin('repodata/repomd.xml')
+        if repomd_url not in self._repomds:
+            fname = self.fetch(repomd_url, no_cache=True)
+            self._repomds[repomd_url] = RepoMD(fname) if fname else None
+            if self.mirrors:
+                # repos are rewritten to the mirror failed over to, find
+                # their repomd.xml by that url too
+                self._repomds.setdefault(self.mirrors.best(repomd_url),
+                                         self._repomds[repomd_url])
+        return self._repomds[repomd_url]
 
     def is_standard_repo(self, repo):
         """Check if repo is standard repo with repodata/repomd.xml exist."""
-
-        repomd_url = repo.pathjoin('repodata/repomd.xml')
-        return not not self.fetch(repomd_url, no_cache=True)
+        return self.get_repomd(repo) is not None
 
     def _fetch_build_meta(self, latest_repo_url):
         """Fetch and parse build.xml."""
         buildxml_url = latest_repo_url.pathjoin('builddata/build.xml')
-        build_xml = self.fetch(buildxml_url)
-        if build_xml:
-            return self._parse_build_xml(build_xml)
+        if buildxml_url not in self._metas:
+            self._metas[buildxml_url] = self._parse_build_xml(
+                self.fetch(buildxml_url))
+        return self._metas[buildxml_url]
 
     def _fetch_build_conf(self, latest_repo_url, meta):
         """Get build.conf file name from build.xml and fetch it."""
@@ -396,49 +1208,23 @@ class RepoParser(object):
                                                  meta['buildconf'])
         fname = self.fetch(buildconf_url)
         if fname:
-            release, _buildid = meta['id'].split('_')
-            release = release.replace('-', '')
-            target_conf = os.path.join(os.path.dirname(fname),
-                                       '%s.conf' % release)
-            os.rename(fname, target_conf)
-            self.buildconf = target_conf
+            self.buildconf = self.confstore.add(fname)
 
     def _fetch_build_conf_new(self, baseurl):
         """ fetch build conf from standard repo"""
-        repomd_url = baseurl.pathjoin('repodata/repomd.xml')
-        repomd_file = self.fetch(repomd_url)
-        if not repomd_file:
+        repomd = self.get_repomd(baseurl)
+        if not repomd or not repomd.location('build'):
             return
 
-        try:
-            etree = ET.parse(repomd_file)
-        except ET.ParseError:
-            log.warning('Not well formed xml: %s' % repomd_file)
+        checksum = repomd.data['build'].get('checksum')
+        if checksum and self.confstore.lookup(checksum):
+            self.buildconf = self.confstore.lookup(checksum)
             return
-        root = etree.getroot()
 
-        # get namespace of repomd element
-        xmlns = re.sub('repomd$', '', root.tag)
-        location_elem = None
-        for elem in root.findall('%sdata' % xmlns):
-            if elem.attrib['type'] == 'build':
-                location_elem = elem.find('%slocation' % xmlns)
-                break
-        if location_elem is not None and 'href' in location_elem.attrib:
-            buildconf_url = baseurl.pathjoin(location_elem.attrib['href'])
-            fname = self.fetch(buildconf_url)
-            if fname:
-                if fname[-3:] == '.gz':
-                    fh_gz = gzip.open(fname, 'r')
-                else:
-                    fh_gz = open(fname, 'r')
-                buildconf_file = os.path.join(os.path.dirname(fname),
-                                              'build.conf')
-                buildconf_fh = open(buildconf_file, 'w')
-                buildconf_fh.write(fh_gz.read())
-                fh_gz.close()
-                buildconf_fh.close()
-                self.buildconf = buildconf_file
+        buildconf_url = baseurl.pathjoin(repomd.location('build'))
+        fname = self.fetch(buildconf_url)
+        if fname:
+            self.buildconf = self.confstore.add(fname, checksum)
 
     def parse(self, remotes):
         """Parse each remote repo, try to fetch build.xml and build.conf"""
@@ -472,6 +1258,14 @@ class RepoParser(object):
                                    'and please specify real RPM repo with '\
                                    'repodata under it.')
 
+        # Probe all remote repos concurrently first, the sequential pass
+        # below picks up the results in the original order of repos.
+        repomds = [repo.pathjoin('repodata/repomd.xml') for repo in remotes]
+        self.prefetch(repomds, no_cache=True)
+        self.prefetch([repo.pathjoin('builddata/build.xml')
+                       for repo, repomd in zip(remotes, repomds)
+                       if not isinstance(self._fetched[repomd], str)])
+
         for repo in remotes:
             deal_with_one_repo(repo)
 
@@ -513,7 +1307,368 @@ class RepoParser(object):
                     rets.append(url)
             return rets
 
-        return filter_valid_repo(repos)
+        repos = filter_valid_repo(repos)
+        if self.mirrors:
+            # mirrors may have failed over while parsing
+            repos = [self.mirrors.best(url) for url in repos]
+        return repos
+
+    def update_index(self, repos, index, revisions=None):
+        """
+        Index primary metadata of repos whose revision is different from
+        the indexed one. revisions are known revisions keyed by url, repos
+        without known revisions get their repomd.xml fetched.
+        """
+        for repo in repos:
+            revision = (revisions or {}).get(str(repo))
+            if revision and revision == index.revision(repo):
+                continue
+            if repo.is_local():
+                repomd_file = os.path.join(repo, 'repodata', 'repomd.xml')
+                repomd = RepoMD(repomd_file) \
+                         if os.path.exists(repomd_file) else None
+            else:
+                repomd = self.get_repomd(repo)
+            if not repomd or not repomd.location('primary'):
+                log.debug('no primary metadata found in %s' % repo)
+                continue
+            # repos without revision are keyed by checksum of primary
+            revision = repomd.revision or \
+                       repomd.data['primary'].get('checksum', (None, ''))[1]
+            if revision and revision == index.revision(repo):
+                continue
+
+            log.info('indexing %s ...' % repo)
+            if repo.is_local():
+                primary = os.path.join(repo, repomd.location('primary'))
+            else:
+                primary = self.fetch(repo.pathjoin(repomd.location('primary')))
+            if not primary:
+                log.warning('failed to fetch primary metadata of %s' % repo)
+                continue
+            index.update(repo, revision, primary)
+
+    def get_revisions(self, repos):
+        """Get repomd revisions of standard remote repos, keyed by url."""
+        revisions = {}
+        for repo in repos:
+            repomd = self._repomds.get(repo.pathjoin('repodata/repomd.xml'))
+            if repomd and repomd.revision:
+                revisions[str(repo)] = repomd.revision
+        return revisions
+
+
+def file_checksum(fname, algorithm='sha256'):
+    """Calculate hexdigest of file with given algorithm."""
+    with open(fname, 'rb') as fobj:
+        return hexdigest(fobj, algorithm=algorithm)
+
+
+def format_size(size):
+    """Format bytes for humans."""
+    size = float(size)
+    for unit in ('B', 'K', 'M', 'G'):
+        if size < 1024:
+            return '%.1f%s' % (size, unit)
+        size /= 1024
+    return '%.1fT' % size
+
+
+class RepoLock(object):
+    """
+    Manifest of repos resolved by RepoParser for each arch and the build
+    conf fetched from them, so following builds can skip resolving.
+    A manifest is only valid for the same list of configured repos.
+    Repos are locked by urls of their primary mirrors, and served by the
+    best mirrors of mirror ranking when loaded.
+    """
+
+    def __init__(self, path, repos, mirrors=None):
+        self.path = path
+        self.conf_path = path + '.conf'
+        self.repos = repos
+        self.mirrors = mirrors
+        self.inputs = hashlib.sha1('\n'.join(
+            [repo.full for repo in repos])).hexdigest()
+
+    def _read(self):
+        """Read manifest, None if it's missing or made for other repos."""
+        try:
+            with open(self.path) as fobj:
+                manifest = json.load(fobj)
+        except (IOError, ValueError):
+            return None
+        if manifest.get('inputs') != self.inputs:
+            return None
+        return manifest
+
+    def _with_auth(self, url):
+        """Restore user/passwd of url from repo it is resolved from."""
+        origins = [repo for repo in self.repos if url.startswith(repo)]
+        if not origins:
+            return SafeURL(url)
+        origin = max(origins, key=len)
+        return SafeURL(url, origin.user, origin.passwd)
+
+    def canonical(self, url):
+        """Url of repo served by its primary mirror."""
+        return self.mirrors.primary(url) if self.mirrors else url
+
+    def _current(self, url):
+        """Locked url served by the best mirror, with auth of its repo."""
+        url = self._with_auth(url)
+        return self.mirrors.best(url) if self.mirrors else url
+
+    def load(self, arch, ttl=0):
+        """
+        Load locked repos of arch, ttl is max age in seconds, 0 means
+        no expiration.
+        Returns: (repourls, buildconf) or None if no valid lock.
+        """
+        manifest = self._read()
+        if not manifest or arch not in manifest['archs']:
+            return None
+
+        locked = manifest['archs'][arch]
+        if ttl and time.time() - locked['time'] > ttl:
+            log.debug('repo lock of %s is expired' % arch)
+            return None
+
+        buildconf = None
+        if manifest.get('buildconf'):
+            if not os.path.exists(self.conf_path) or \
+                    file_checksum(self.conf_path) != manifest['buildconf']:
+                log.debug('locked build conf %s is changed' % self.conf_path)
+                return None
+            buildconf = self.conf_path
+
+        return [self._current(str(url)) for url in locked['repos']], \
+               buildconf
+
+    def save(self, arch, repourls, revisions, buildconf):
+        """Lock resolved repos of arch and build conf fetched with them."""
+        manifest = self._read() or {'inputs': self.inputs, 'archs': {}}
+        lockdir = os.path.dirname(self.path)
+        if not os.path.exists(lockdir):
+            os.makedirs(lockdir)
+
+        if buildconf:
+            link_or_copy(buildconf, self.conf_path)
+            manifest['buildconf'] = file_checksum(self.conf_path)
+        else:
+            manifest.pop('buildconf', None)
+        manifest['archs'][arch] = {
+            'time': time.time(),
+            'repos': [str(self.canonical(url)) for url in repourls],
+            'revisions': dict((str(self.canonical(url)), revision)
+                              for url, revision in revisions.items())}
+
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'w') as fobj:
+            json.dump(manifest, fobj, indent=2, sort_keys=True)
+        os.rename(tmp, self.path)
+
+    def revisions(self, arch):
+        """Revisions of locked repos of arch, keyed by url loaded."""
+        manifest = self._read()
+        if not manifest or arch not in manifest['archs']:
+            return {}
+        return dict((str(self._current(str(url))), revision) for url, revision
+                    in manifest['archs'][arch].get('revisions', {}).items())
+
+
+class FingerprintDB(object):
+    """
+    Fingerprints of the inputs each package was built from, and the
+    binaries built, so packages with unchanged inputs can be skipped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as fobj:
+                self.packages = json.load(fobj)
+        except (IOError, ValueError):
+            self.packages = {}
+
+    def unchanged(self, package_dir, fingerprint, root):
+        """
+        Check whether package was built from the same inputs before and
+        its binaries under root still exist.
+        """
+        record = self.packages.get(package_dir)
+        if not record or record['fingerprint'] != fingerprint or \
+                not record['rpms']:
+            return False
+        return all(os.path.exists(os.path.join(root, rpm))
+                   for rpm in record['rpms'])
+
+    def update(self, package_dir, fingerprint, rpms):
+        """Record binaries built from inputs of fingerprint."""
+        self.packages[package_dir] = {'fingerprint': fingerprint,
+                                      'rpms': rpms,
+                                      'time': time.time()}
+
+    def remove(self, package_dir):
+        """Forget package, it will be built next time."""
+        self.packages.pop(package_dir, None)
+
+    def save(self):
+        """Write database atomically."""
+        dirn = os.path.dirname(self.path)
+        if not os.path.exists(dirn):
+            os.makedirs(dirn)
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'w') as fobj:
+            json.dump(self.packages, fobj, indent=2, sort_keys=True)
+        os.rename(tmp, self.path)
+
+
+def sudo(cmd, stdout=None):
+    """Run command as root, build roots are owned by root."""
+    if os.getuid() != 0:
+        cmd = ['sudo'] + cmd
+    try:
+        return subprocess.call(cmd, stdout=stdout) == 0
+    except OSError, err:
+        raise GbsError('failed to run %s: %s' % (cmd[0], err))
+
+
+def mount_points(path, mountinfo='/proc/self/mountinfo'):
+    """
+    Mount points at or under path. Bind mounts of the same file system
+    can't be told by --one-file-system of rm or cp, so mountinfo is read.
+    """
+    path = os.path.realpath(path).rstrip('/')
+    try:
+        with open(mountinfo) as fobj:
+            lines = fobj.readlines()
+    except IOError:
+        return []
+    points = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 5:
+            continue
+        # spaces, tabs, newlines and backslashes are escaped in octal
+        point = re.sub(r'\\([0-7]{3})',
+                       lambda match: chr(int(match.group(1), 8)), fields[4])
+        if point == path or point.startswith(path + '/'):
+            points.append(point)
+    return points
+
+
+class BuildRootBases(object):
+    """
+    Copies of initialized build roots keyed by the inputs they were
+    installed from. Clean build roots are made from them by copy-on-write
+    copies, instead of installing all packages again. A base is saved
+    from a build root after its build, so it has packages installed for
+    the last package built, which are removed by the next init of build
+    root if they aren't needed. Build results are removed from it.
+    """
+
+    # build results left in build root after build
+    LEFTOVERS = ('home/abuild/rpmbuild',)
+
+    def __init__(self, path):
+        self.path = path
+
+    def _base(self, arch, key):
+        """Path of base of arch and inputs key."""
+        return os.path.join(self.path, '%s.%s' % (arch, key))
+
+    def get(self, arch, key):
+        """Get path of base, None if there's no such base."""
+        base = self._base(arch, key)
+        return base if os.path.isdir(base) else None
+
+    @staticmethod
+    def _mounted(path):
+        """Check and warn if anything is mounted under path."""
+        points = mount_points(path)
+        if points:
+            log.warning('%s is in use, mounted: %s' % (path, ' '.join(points)))
+        return bool(points)
+
+    @staticmethod
+    def _remove(path):
+        """Remove dir as root, without crossing into mounts."""
+        return sudo(['rm', '-rf', '--one-file-system', path])
+
+    def restore(self, arch, key, root):
+        """Replace build root with a copy of base."""
+        base = self.get(arch, key)
+        if not base or self._mounted(root) or self._mounted(base):
+            return False
+        # reflink copies share blocks with base on btrfs and xfs, and
+        # fall back to plain copies on other file systems
+        return self._remove(root) and \
+               sudo(['cp', '-a', '-x', '--reflink=auto', base, root])
+
+    def save(self, arch, key, root):
+        """Save build root as base of arch, replacing bases of old inputs."""
+        if not os.path.isdir(root) or self._mounted(root) or \
+                os.path.exists(os.path.join(root, 'not-ready')):
+            return False
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        base = self._base(arch, key)
+        tmp = '%s.%d.tmp' % (base, os.getpid())
+        if not sudo(['cp', '-a', '-x', '--reflink=auto', root, tmp]) or \
+                not all(self._remove(os.path.join(tmp, leftover))
+                        for leftover in self.LEFTOVERS) or \
+                not sudo(['mv', '-T', tmp, base]):
+            self._remove(tmp)
+            return False
+        for old in glob.glob(self._base(arch, '*')):
+            if old != base and not old.endswith('.tmp') and \
+                    not self._mounted(old):
+                self._remove(old)
+        return True
+
+    def archive(self, arch, key, archive):
+        """Export base as a compressed tar archive."""
+        base = self.get(arch, key)
+        if not base:
+            return False
+        tmp = '%s.%d.tmp' % (archive, os.getpid())
+        with open(tmp, 'wb') as fobj:
+            if self._mounted(base) or \
+                    not sudo(['tar', '-C', base, '--numeric-owner',
+                              '--one-file-system', '-czpf', '-', '.'],
+                             stdout=fobj):
+                os.unlink(tmp)
+                return False
+        os.rename(tmp, archive)
+        return True
+
+    def extract(self, arch, key, archive):
+        """Import base from an archive exported before."""
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        base = self._base(arch, key)
+        tmp = '%s.%d.tmp' % (base, os.getpid())
+        if not sudo(['mkdir', '-p', tmp]) or \
+                not sudo(['tar', '-C', tmp, '--numeric-owner', '-xzpf',
+                          archive]) or \
+                not sudo(['mv', '-T', tmp, base]):
+            self._remove(tmp)
+            return False
+        return True
+
+
+def read_meminfo():
+    """Read /proc/meminfo, values are in KB."""
+    meminfo = {}
+    try:
+        with open('/proc/meminfo') as fobj:
+            for line in fobj:
+                key, value = line.split(':', 1)
+                meminfo[key] = int(value.split()[0])
+    except (IOError, ValueError, IndexError):
+        pass
+    return meminfo
 
 
 def read_localconf(workdir):
@@ -545,6 +1700,78 @@ class SearchConfAction(argparse.Action):
         read_localconf(workdir)
         setattr(namespace, self.dest, value)
 
+def _parse_status(output, version):
+    """
+    Parse `git status --porcelain[=v2] -z` output.
+    Returns: dict of status code in porcelain v1 format to file names.
+    """
+    status = defaultdict(list)
+    fields = output.split('\0')
+    while fields:
+        line = fields.pop(0)
+        if not line:
+            continue
+        if version == 1:
+            code, path = line[:2], line[3:]
+            if code[0] in 'RC':
+                # original path of renamed and copied file follows
+                fields.pop(0)
+        elif line[0] in '?!':
+            code, path = line[0] * 2, line[2:]
+        elif line[0] in '12u':
+            # ordinary, renamed or copied, and unmerged entries have
+            # 8, 9 and 10 fields before path respectively
+            parts = line.split(' ', {'1': 8, '2': 9, 'u': 10}[line[0]])
+            code, path = parts[1].replace('.', ' '), parts[-1]
+            if line[0] == '2':
+                fields.pop(0)
+        else:
+            # headers
+            continue
+        status[code].append(path)
+    return status
+
+def git_status(git_path):
+    """
+    Status of working tree in a single `git status` pass. Untracked
+    cache is enabled, and fsmonitor is used if it's configured in repo.
+    Porcelain v1 is used if git doesn't support v2.
+    Returns: dict of status code in porcelain v1 format to file names,
+    empty if working tree is clean.
+    """
+    for version in (2, 1):
+        cmd = ['git', '-c', 'core.untrackedCache=true', 'status', '-z',
+               '--porcelain=v2' if version == 2 else '--porcelain']
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, cwd=git_path)
+        except OSError, err:
+            raise GbsError('failed to run git status in %s: %s' % \
+                           (git_path, err))
+        output, error = proc.communicate()
+        if proc.returncode == 0:
+            return _parse_status(output, version)
+        if version == 1 or 'porcelain' not in error:
+            raise GbsError('git status failed in %s: %s' % \
+                           (git_path, error.strip()))
+        log.debug('git status --porcelain=v2 unsupported, use v1')
+
+def git_dir(git_path):
+    """Path of .git dir of repo, it isn't under work tree of worktrees."""
+    try:
+        proc = subprocess.Popen(['git', 'rev-parse', '--git-common-dir'],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, cwd=git_path)
+    except OSError, err:
+        raise GbsError('failed to run git rev-parse in %s: %s' % \
+                       (git_path, err))
+    output, error = proc.communicate()
+    # git before 2.5 prints the option itself
+    if proc.returncode != 0 or output.startswith('--'):
+        log.debug('git rev-parse --git-common-dir failed: %s' % error.strip())
+        return os.path.join(git_path, '.git')
+    return os.path.join(git_path, output.strip())
+
 def git_status_checker(git, opts):
     """
     Perform git repository status check.
@@ -553,10 +1780,10 @@ def git_status_checker(git, opts):
     try:
         if opts.commit:
             git.rev_parse(opts.commit)
-        is_clean = git.is_clean()[0]
-        status = git.status()
     except (GbpError, GitRepositoryError), err:
         raise GbsError(str(err))
+    status = git_status(git.path)
+    is_clean = not status
 
     untracked_files = status['??']
     uncommitted_files = []
@@ -582,64 +1809,171 @@ def git_status_checker(git, opts):
             log.info('the following uncommitted changes would be included'
                        ':\n   %s' % '\n   '.join(uncommitted_files))
 
-def hexdigest(fhandle, block_size=4096):
+# files are hashed in blocks of this size
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def hexdigest(fhandle, block_size=HASH_BLOCK_SIZE, algorithm='md5'):
     """Calculate hexdigest of file content."""
-    md5obj = hashlib.new('md5')
+    hashobj = hashlib.new(algorithm)
     while True:
         data = fhandle.read(block_size)
         if not data:
             break
-        md5obj.update(data)
-    return md5obj.hexdigest()
+        hashobj.update(data)
+    return hashobj.hexdigest()
+
+
+class GitObjectReader(object):
+    """
+    Read objects of a git repository through long running
+    `git cat-file --batch` and `--batch-check` processes, so lookups
+    don't start a git process each. Object names are given the same way
+    as to git cat-file, paths like <rev>:./<path> are relative to git_path.
+    """
 
+    def __init__(self, git_path):
+        self.git_path = git_path
+        self._procs = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _proc(self, option):
+        """Process of option, processes of parent process are not used."""
+        if self._pid != os.getpid():
+            self._procs = {}
+            self._pid = os.getpid()
+        proc = self._procs.get(option)
+        if proc is None or proc.poll() is not None:
+            try:
+                proc = subprocess.Popen(['git', 'cat-file', option],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        cwd=self.git_path, close_fds=True)
+            except OSError, err:
+                raise GbsError('failed to run git cat-file in %s: %s' % \
+                               (self.git_path, err))
+            self._procs[option] = proc
+        return proc
+
+    def _query(self, option, name):
+        """
+        Send object name to process of option.
+        Returns: (sha1, type, content) or None if object is missing,
+        content is None for --batch-check.
+        """
+        with self._lock:
+            proc = self._proc(option)
+            try:
+                proc.stdin.write(name + '\n')
+                proc.stdin.flush()
+                header = proc.stdout.readline().split()
+                # "<name> missing", name may have spaces
+                if header and header[-1] in ('missing', 'ambiguous'):
+                    return None
+                if len(header) == 3:
+                    content = None
+                    if option == '--batch':
+                        content = proc.stdout.read(int(header[2]))
+                        proc.stdout.read(1)
+                    return header[0], header[1], content
+            except (IOError, ValueError), err:
+                self._procs.pop(option, None)
+                raise GbsError('failed to read %s in %s: %s' % \
+                               (name, self.git_path, err))
+        if not header:
+            self._procs.pop(option, None)
+            raise GbsError('git cat-file exited unexpectedly in %s' % \
+                           self.git_path)
+        return None
+
+    def info(self, name):
+        """Returns: (sha1, type) of object, None if it's missing."""
+        result = self._query('--batch-check', name)
+        return result[:2] if result else None
+
+    def read(self, name):
+        """Returns: (type, content) of object, None if it's missing."""
+        result = self._query('--batch', name)
+        return result[1:] if result else None
+
+    def list_tree(self, name):
+        """Returns: list of (mode, file name) of tree, None if no tree."""
+        result = self.read(name)
+        if not result or result[0] != 'tree':
+            return None
+        data = result[1]
+        entries = []
+        pos = 0
+        while pos < len(data):
+            space = data.index(' ', pos)
+            nul = data.index('\0', space)
+            entries.append((data[pos:space], data[space + 1:nul]))
+            # entry ends with 20 bytes binary sha1
+            pos = nul + 21
+        return entries
+
+    def close(self):
+        """Stop git processes, they are started again if needed."""
+        with self._lock:
+            if self._pid == os.getpid():
+                for proc in self._procs.values():
+                    proc.stdin.close()
+                    proc.wait()
+            self._procs = {}
+
+
+# readers of recently used repos, each one keeps two git processes
+MAX_OBJECT_READERS = 16
+_OBJECT_READERS = OrderedDict()
+_OBJECT_READERS_LOCK = threading.Lock()
+
+def get_object_reader(git_path):
+    """GitObjectReader of repository at git_path, shared by callers."""
+    git_path = os.path.abspath(git_path)
+    with _OBJECT_READERS_LOCK:
+        reader = _OBJECT_READERS.pop(git_path, None)
+        if reader is None:
+            reader = GitObjectReader(git_path)
+        _OBJECT_READERS[git_path] = reader
+        while len(_OBJECT_READERS) > MAX_OBJECT_READERS:
+            _OBJECT_READERS.popitem(last=False)[1].close()
+    return reader
+
+def rev_path(commit_id, relative_path):
+    """Object name of path relative to current directory of git."""
+    return '%s:./%s' % (commit_id, relative_path.rstrip('/'))
 
 def show_file_from_rev(git_path, relative_path, commit_id):
-    """Get a single file content from given git revision."""
-    args = ['git', 'show', '%s:%s' % (commit_id, relative_path)]
-    try:
-        with Workdir(git_path):
-            return  subprocess.Popen(args,
-                                     stdout=subprocess.PIPE).communicate()[0]
-    except (subprocess.CalledProcessError, OSError), err:
-        log.debug('failed to checkout %s from %s:%s' % (relative_path,
-                                                        commit_id, str(err)))
-    return None
+    """
+    Get a single file content from given git revision.
+    Returns: content, None if file doesn't exist.
+    """
+    result = get_object_reader(git_path).read(rev_path(commit_id,
+                                                       relative_path))
+    if result is None or result[0] != 'blob':
+        log.debug('failed to checkout %s from %s' % (relative_path,
+                                                     commit_id))
+        return None
+    return result[1]
 
 
 def file_exists_in_rev(git_path, relative_path, commit_id, dir_only=False):
     """Check if file exists in given given revision."""
-    git_opts = ['--name-only']
-    if dir_only:
-        git_opts += ['-d']
-    args = ['git', 'ls-tree', commit_id, relative_path]
-    args.extend(git_opts)
-
-    try:
-        with Workdir(git_path):
-            output = subprocess.Popen(args,
-                                      stdout=subprocess.PIPE).communicate()[0]
-    except (subprocess.CalledProcessError, OSError), err:
-        raise GbsError('failed to check existence of %s in %s:%s' % (
-            relative_path, commit_id, str(err)))
-
-    return output != ''
+    info = get_object_reader(git_path).info(rev_path(commit_id,
+                                                     relative_path))
+    if info is None:
+        return False
+    return info[1] == 'tree' or not dir_only
 
 
 def glob_in_rev(git_path, pattern, commit_id):
     """Glob pattern in given revision."""
 
     path = os.path.dirname(pattern)
-    args = ['git', 'ls-tree', '--name-only', commit_id, '%s/' % path]
-
-    try:
-        with Workdir(git_path):
-            output = subprocess.Popen(args,
-                                      stdout=subprocess.PIPE).communicate()[0]
-    except (subprocess.CalledProcessError, OSError), err:
-        raise GbsError('failed to glob %s in %s:%s' % (
-            pattern, commit_id, str(err)))
-
-    return fnmatch.filter(output.splitlines(), pattern)
+    entries = get_object_reader(git_path).list_tree(rev_path(commit_id,
+                                                             path))
+    names = [os.path.join(path, name) for _mode, name in entries or []]
+    return fnmatch.filter(names, pattern)
 
 
 def get_editor_cmd():
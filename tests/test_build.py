@@ -0,0 +1,163 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+"""Functionality tests of gbs build helpers"""
+
+import os
+import shutil
+import argparse
+import tempfile
+import unittest
+
+from mock import patch
+
+from gitbuildsys.cmd_build import BuildMonitor, can_skip_unchanged, \
+                                  find_built_rpms, restore_build_roots, \
+                                  get_auto_threads, MIN_WORKER_MEMORY
+from gitbuildsys.speccache import SpecInfo
+from gitbuildsys.utils import FingerprintDB
+
+
+class BuildMonitorTest(unittest.TestCase):
+    """Test tracking package builds from depanneur output"""
+
+    @staticmethod
+    def feed(lines, retcode=0):
+        """feed lines to a new monitor and return its packages"""
+        monitor = BuildMonitor()
+        for line in lines:
+            monitor.feed(line)
+        return monitor.finish(retcode)
+
+    def test_status(self):
+        """test status of finished, failed and interrupted builds"""
+        packages = self.feed([
+            '\x1b[32minfo: \x1b[0m*** [1/3] building dlog-0.4.1-5.1 i586 '
+            'tizen (worker: 0) ***',
+            'info: *** [2/3] building acpid-2.0-1 i586 tizen (worker: 1) ***',
+            '[    4s] finished "build dlog.spec" at Thu Sep 13 2012.',
+            'info: finished building dlog',
+            'info: *** building zlib-1.2-1 i586 tizen (worker: 0) ***',
+            'error: failed to build acpid-2.0-1'], retcode=1)
+
+        self.assertEquals([('dlog', 'succeeded', 0),
+                           ('acpid', 'failed', 1),
+                           ('zlib', 'failed', 0)],
+                          [(pkg['name'], pkg['status'], pkg['worker'])
+                           for pkg in packages])
+
+    def test_incremental(self):
+        """test incremental build"""
+        packages = self.feed([
+            'info: *** building dlog-0.4.1-5.1 i586 tizen (worker: 0) ***',
+            'info: finished incremental building dlog'])
+        self.assertEquals('succeeded', packages[0]['status'])
+        self.assertTrue(packages[0]['duration'] >= 0)
+
+    def test_memory(self):
+        """test memory is accounted to packages being built"""
+        monitor = BuildMonitor()
+        monitor.feed('info: *** building dlog-0.4.1-5.1 i586 tizen '
+                     '(worker: 0) ***')
+        monitor.feed('info: *** building acpid-2.0-1 i586 tizen '
+                     '(worker: 1) ***')
+        self.assertEquals(2, monitor.building())
+        monitor.sample(300)
+        monitor.feed('info: finished building dlog')
+        self.assertEquals(1, monitor.building())
+        monitor.sample(200)
+        monitor.sample(500)
+        self.assertEquals([300, 500], [pkg['peak_memory']
+                                       for pkg in monitor.finish(0)])
+
+
+class AutoThreadsTest(unittest.TestCase):
+    """Test workers of archs fit CPUs and memory"""
+
+    @patch('multiprocessing.cpu_count', lambda: 2)
+    def test_more_archs_than_cpus(self):
+        """test each arch gets at least one CPU"""
+        with patch('gitbuildsys.cmd_build.read_meminfo', lambda: {}):
+            self.assertEquals(1, get_auto_threads([{}, {}, {}]))
+        with patch('gitbuildsys.cmd_build.read_meminfo',
+                   lambda: {'MemAvailable': MIN_WORKER_MEMORY * 30}):
+            self.assertEquals(1, get_auto_threads([{}, {}, {}]))
+            self.assertEquals(2, get_auto_threads([{}]))
+
+
+class FingerprintDBTest(unittest.TestCase):
+    """Test fingerprints of package build inputs"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='test-gbs-fingerprint-')
+        self.path = os.path.join(self.root, 'local', 'gbs', 'fp.json')
+        self.rpm = os.path.join(self.root, 'pkg-1-1.i586.rpm')
+        open(self.rpm, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_unchanged(self):
+        """test packages are unchanged only with same inputs and rpms"""
+        fpdb = FingerprintDB(self.path)
+        fpdb.update('/pkg', 'abc', ['pkg-1-1.i586.rpm'])
+        fpdb.save()
+
+        fpdb = FingerprintDB(self.path)
+        self.assertTrue(fpdb.unchanged('/pkg', 'abc', self.root))
+        self.assertFalse(fpdb.unchanged('/pkg', 'abd', self.root))
+        self.assertFalse(fpdb.unchanged('/other', 'abc', self.root))
+        os.unlink(self.rpm)
+        self.assertFalse(fpdb.unchanged('/pkg', 'abc', self.root))
+
+    def test_can_skip(self):
+        """test builds from working tree are never skipped"""
+        args = argparse.Namespace(noinit=False, overwrite=False,
+                                  include_all=False, incremental=False)
+        self.assertTrue(can_skip_unchanged(args))
+        for option in ('noinit', 'overwrite', 'include_all', 'incremental'):
+            self.assertFalse(can_skip_unchanged(argparse.Namespace(
+                **dict(vars(args), **{option: True}))))
+
+    def test_built_rpms(self):
+        """test only rpms of the release built are found"""
+        repo = os.path.join(self.root, 'local', 'repos', 'tizen', 'i586')
+        for name in ('RPMS/pkg-1.0-2.1.i586.rpm',
+                     'RPMS/pkg-devel-1.0-2.1.i586.rpm',
+                     'RPMS/pkg-1.0-2.1.1.i586.rpm',
+                     'RPMS/pkg-1.0-1.1.i586.rpm',
+                     'RPMS/pkg-extra-1.0-2.1.i586.rpm',
+                     'SRPMS/pkg-1.0-2.1.src.rpm',
+                     'SRPMS/pkg-1.0-1.1.src.rpm'):
+            path = os.path.join(repo, name)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+        info = SpecInfo(name='pkg', upstreamversion='1.0', release='2',
+                        packages=['pkg', 'pkg-devel'])
+        self.assertEquals(
+            ['local/repos/tizen/i586/RPMS/pkg-1.0-2.1.i586.rpm',
+             'local/repos/tizen/i586/RPMS/pkg-devel-1.0-2.1.i586.rpm',
+             'local/repos/tizen/i586/SRPMS/pkg-1.0-2.1.src.rpm'],
+            find_built_rpms(self.root, 'i586', info, 'pkg-1.0-2.1'))
+
+    def test_no_workers(self):
+        """test build roots aren't restored without any worker"""
+        os.makedirs(os.path.join(self.root, 'local', 'bases', 'i586.abc'))
+        self.assertFalse(restore_build_roots(self.root, 'i586', 'abc', 0))
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'local',
+                                                     'scratch.i586.0')))
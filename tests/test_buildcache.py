@@ -0,0 +1,97 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Functionality tests of build cache accounting"""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from gitbuildsys.buildcache import scan_build_root, scan_tmpdir, prune, \
+                                   get_build_lock
+
+
+class BuildCacheTest(unittest.TestCase):
+    """Test entries are found and kept while they are used"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-buildcache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, name, age=0):
+        """Write file under tmpdir, aged by seconds"""
+        path = os.path.join(self.tmpdir, name)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fobj:
+            fobj.write('x' * 4096)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        os.utime(os.path.dirname(path), (mtime, mtime))
+        return path
+
+    def test_tmpdir(self):
+        """test metadata caches are kept, only stale temp files pruned"""
+        old = 2 * 24 * 3600
+        self._write('httpcache/abc')
+        self._write('specs.db')
+        self._write('mirrors.json')
+        self._write('tizen.conf')
+        # pids are never above 2^22
+        stale = os.path.dirname(self._write(
+            'gbscache-4194305-abc/repomd.xml', old))
+        self._write('gbscache-%d-abc/repomd.xml' % os.getpid(), old)
+        self._write('gbscache-4194305-new/repomd.xml')
+        self._write('specs.db.4194305.tmp', old)
+        entries = scan_tmpdir(self.tmpdir)
+        self.assertEquals([('gbscache-4194305-abc', 'tmp', True),
+                           ('httpcache', 'http', False),
+                           ('mirrors.json', 'mirrors', False),
+                           ('specs.db', 'specs', False),
+                           ('specs.db.4194305.tmp', 'tmp', True),
+                           ('tizen.conf', 'buildconf', False)],
+                          [(os.path.basename(entry.path), entry.kind,
+                            entry.prunable) for entry in entries])
+        removed = prune(entries, 0)
+        self.assertEquals(2, len(removed))
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir,
+                                                    'specs.db')))
+
+    def test_build_lock(self):
+        """test entries of build roots used by builds are in use"""
+        self._write('local/sources/tizen/pkg.tar.gz')
+        self._write('i586/local/repos/tizen/i586/RPMS/pkg.rpm')
+        entries = scan_build_root(self.tmpdir)
+        self.assertEquals(['sources', 'repo'],
+                          [entry.kind for entry in entries])
+        self.assertFalse([entry for entry in entries if entry.in_use()])
+
+        lock = get_build_lock(self.tmpdir)
+        lock.acquire()
+        # builds of the same build root don't exclude each other
+        self.assertTrue(get_build_lock(self.tmpdir).acquire(blocking=False))
+        self.assertEquals(2, len([entry for entry in entries
+                                  if entry.in_use()]))
+        self.assertEquals([], prune(entries, 0))
+        lock.release()
+        self.assertEquals(2, len(prune(entries, 0)))
@@ -0,0 +1,116 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Functionality tests of build conf store"""
+
+import os
+import gzip
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+from gitbuildsys.errors import GbsError
+from gitbuildsys.utils import BuildConfStore, link_or_copy
+
+
+class BuildConfStoreTest(unittest.TestCase):
+    """Test build confs are stored by checksum and kept intact"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-buildconf')
+        self.store = BuildConfStore(os.path.join(self.tmpdir, 'store'))
+        self.content = 'Preinstall: bash\n'
+        self.fname = os.path.join(self.tmpdir, 'build.conf')
+        with open(self.fname, 'w') as fobj:
+            fobj.write(self.content)
+        self.sha1 = hashlib.sha1(self.content).hexdigest()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_add(self):
+        """test added conf is found by checksum of repomd.xml"""
+        self.assertEquals(None, self.store.lookup(('sha', self.sha1)))
+        obj = self.store.add(self.fname, ('sha', self.sha1))
+        self.assertEquals(obj, self.store.lookup(('sha', self.sha1)))
+        self.assertEquals(obj, self.store.add(self.fname, ('sha', self.sha1)))
+        self.assertEquals(None, self.store.lookup(('crc', self.sha1)))
+        with open(obj) as fobj:
+            self.assertEquals(self.content, fobj.read())
+        self.assertEquals(0, os.stat(obj).st_mode & 0222)
+
+    def test_mismatch(self):
+        """test conf not matching checksum of repomd.xml isn't stored"""
+        self.assertRaises(GbsError, self.store.add, self.fname,
+                          ('sha', '0' * 40))
+        self.assertEquals([], os.listdir(self.store.path))
+
+    def test_gz(self):
+        """test compressed conf is verified as is and stored decompressed"""
+        gzname = self.fname + '.gz'
+        gzobj = gzip.open(gzname, 'wb')
+        gzobj.write(self.content)
+        gzobj.close()
+        with open(gzname, 'rb') as fobj:
+            checksum = ('sha256', hashlib.sha256(fobj.read()).hexdigest())
+        obj = self.store.add(gzname, checksum)
+        self.assertEquals(obj, self.store.lookup(checksum))
+        with open(obj) as fobj:
+            self.assertEquals(self.content, fobj.read())
+
+
+class LinkOrCopyTest(unittest.TestCase):
+    """Test build confs are put in place without losing originals"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-linkorcopy')
+        self.src = os.path.join(self.tmpdir, 'src.conf')
+        self.dst = os.path.join(self.tmpdir, 'dst.conf')
+        with open(self.src, 'w') as fobj:
+            fobj.write('src')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_link(self):
+        """test existing dst is replaced by a link"""
+        with open(self.dst, 'w') as fobj:
+            fobj.write('dst')
+        link_or_copy(self.src, self.dst)
+        self.assertTrue(os.path.samefile(self.src, self.dst))
+        self.assertEquals(['dst.conf', 'src.conf'],
+                          sorted(os.listdir(self.tmpdir)))
+
+    def test_copy(self):
+        """test dst isn't linked if not wanted"""
+        link_or_copy(self.src, self.dst, link=False)
+        self.assertFalse(os.path.samefile(self.src, self.dst))
+        with open(self.dst, 'a') as fobj:
+            fobj.write('changed')
+        with open(self.src) as fobj:
+            self.assertEquals('src', fobj.read())
+
+    def test_same_file(self):
+        """test dst which is src itself is kept"""
+        link_or_copy(self.src, self.src, link=False)
+        os.link(self.src, self.dst)
+        link_or_copy(self.src, self.dst, link=False)
+        with open(self.src) as fobj:
+            self.assertEquals('src', fobj.read())
+        self.assertTrue(os.path.samefile(self.src, self.dst))
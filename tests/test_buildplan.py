@@ -0,0 +1,72 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Functionality tests of build plan"""
+
+import unittest
+
+from gitbuildsys.buildplan import BuildPlan
+from gitbuildsys.speccache import SpecInfo
+
+
+def spec(name, buildrequires=(), provides=()):
+    """make SpecInfo of a package"""
+    return SpecInfo(name=name, packages=[name],
+                    buildrequires=list(buildrequires),
+                    provides=list(provides))
+
+class BuildPlanTest(unittest.TestCase):
+    """Test dependency graph of packages"""
+
+    def setUp(self):
+        self.plan = BuildPlan([
+            spec('liba', provides=['pkgconfig(a)']),
+            spec('libb', ['pkgconfig(a)', 'glibc']),
+            spec('appc', ['libb']),
+            spec('appd', ['liba']),
+            spec('e')])
+        self.durations = {'liba': 100, 'libb': 50, 'appc': 30,
+                          'appd': 50, 'e': 10}
+
+    def test_levels(self):
+        """test packages are grouped by dependency levels"""
+        self.assertEquals([['liba', 'e'], ['libb', 'appd'], ['appc']],
+                          self.plan.levels)
+        self.assertEquals(2, self.plan.max_parallelism)
+
+    def test_external(self):
+        """test BuildRequires not provided by packages of the tree"""
+        self.assertEquals(['glibc'], self.plan.external)
+
+    def test_critical_path(self):
+        """test longest dependency chain"""
+        self.assertEquals((['liba', 'libb', 'appc'], 180),
+                          self.plan.critical_path(self.durations))
+
+    def test_estimate(self):
+        """test estimated build time with workers"""
+        self.assertEquals(240, self.plan.estimate(self.durations, 1))
+        self.assertEquals(180, self.plan.estimate(self.durations, 2))
+
+    def test_cycle(self):
+        """test packages with cyclic dependencies"""
+        plan = BuildPlan([spec('a', ['b']), spec('b', ['a']),
+                          spec('c', ['a']), spec('d')])
+        self.assertEquals([['d'], ['a', 'b', 'c']], plan.levels)
+        self.assertEquals(['a', 'b'], plan.cycles)
+        self.assertEquals(2, plan.estimate(dict.fromkeys('abcd', 1), 4))
@@ -0,0 +1,92 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Functionality tests of file digest cache"""
+
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+from gitbuildsys import digestcache
+from gitbuildsys.digestcache import DigestCache
+
+
+class DigestCacheTest(unittest.TestCase):
+    """Test digests are reused until files are changed"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-digestcache')
+        self.fname = os.path.join(self.tmpdir, 'file')
+        self._write(self.fname, 'content')
+        self.hashed = []
+        self._checksum = digestcache.file_checksum
+        def checksum(fname, algorithm):
+            '''count files really hashed'''
+            self.hashed.append(fname)
+            return self._checksum(fname, algorithm)
+        digestcache.file_checksum = checksum
+
+    @staticmethod
+    def _write(fname, content):
+        """Write file modified a while ago"""
+        with open(fname, 'w') as fobj:
+            fobj.write(content)
+        os.utime(fname, (time.time() - 10,) * 2)
+
+    def tearDown(self):
+        digestcache.file_checksum = self._checksum
+        shutil.rmtree(self.tmpdir)
+
+    def test_md5(self):
+        """test file is hashed again only after it's changed"""
+        cache = DigestCache(os.path.join(self.tmpdir, 'digests.db'))
+        self.assertEquals(hashlib.md5('content').hexdigest(),
+                          cache.md5(self.fname))
+        cache = DigestCache(cache.path)
+        self.assertEquals(hashlib.md5('content').hexdigest(),
+                          cache.md5(self.fname))
+        self.assertEquals(1, len(self.hashed))
+
+        self._write(self.fname, 'changed content')
+        self.assertEquals(hashlib.md5('changed content').hexdigest(),
+                          cache.md5(self.fname))
+        self.assertEquals(2, len(self.hashed))
+
+    def test_racy(self):
+        """test files modified just now are hashed every time"""
+        cache = DigestCache(os.path.join(self.tmpdir, 'digests.db'))
+        with open(self.fname, 'w') as fobj:
+            fobj.write('racy')
+        cache.md5(self.fname)
+        self.assertEquals(hashlib.md5('racy').hexdigest(),
+                          cache.md5(self.fname))
+        self.assertEquals(2, len(self.hashed))
+
+    def test_volatile(self):
+        """test files of volatile dirs are only cached in memory"""
+        path = os.path.join(self.tmpdir, 'digests.db')
+        cache = DigestCache(path, volatile=[self.tmpdir])
+        cache.md5(self.fname)
+        cache.md5(self.fname)
+        self.assertEquals(1, len(self.hashed))
+        DigestCache(path, volatile=[self.tmpdir]).md5(self.fname)
+        self.assertEquals(2, len(self.hashed))
+        self.assertFalse(os.path.exists(path))
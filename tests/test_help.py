@@ -33,7 +33,7 @@ class TestHelp(unittest.TestCase):
         """Test running gbs help with all possible subcommands."""
         for sub in ["build", "lb", "remotebuild", "rb", "changelog", "ch",
                      "submit", "sr", "export", "ex", "import", "im",
-                     "chroot", "chr"]:
+                     "chroot", "chr", "repo", "cache", "prefetch"]:
 
             try:
                 print '>>>sub', sub
@@ -0,0 +1,225 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Functionality tests of persistent HTTP cache and URL grabbers"""
+
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import unittest
+import threading
+import BaseHTTPServer
+
+from gitbuildsys.errors import UrlError
+from gitbuildsys.safe_url import SafeURL
+from gitbuildsys.utils import HTTPCache, URLGrabber, MultiURLGrabber, \
+                              PageNotFound
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serve files of server with ETag, and answer 304 if it matches"""
+
+    def do_GET(self):
+        """GET file"""
+        self.server.requests.append((self.path,
+                                     self.headers.get('If-None-Match')))
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        etag = '"%s"' % hashlib.md5(content).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *_args):
+        """Keep test output quiet"""
+        pass
+
+
+class Server(object):
+    """HTTP server of files dict in a thread"""
+
+    def __init__(self):
+        self.httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.files = {}
+        self.httpd.requests = []
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def files(self):
+        """Files served, keyed by path"""
+        return self.httpd.files
+
+    @property
+    def requests(self):
+        """(path, If-None-Match) of requests received"""
+        return self.httpd.requests
+
+    def url(self, path=''):
+        """URL of path"""
+        return SafeURL('http://127.0.0.1:%d/%s' % (self.httpd.server_port,
+                                                   path.lstrip('/')))
+
+    def stop(self):
+        """Stop serving"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class HTTPCacheTest(unittest.TestCase):
+    """Test metadata is revalidated, served and evicted by HTTPCache"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-httpcache')
+        self.server = Server()
+        self.server.files['/repomd.xml'] = 'content'
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _grab(self, cache, url, name='out'):
+        """Grab url through cache, return content"""
+        fname = os.path.join(self.tmpdir, name)
+        URLGrabber(cache=cache).grab(url, fname)
+        with open(fname) as fobj:
+            return fobj.read()
+
+    def test_revalidate(self):
+        """test cached copy is used if server answers 304"""
+        cache = HTTPCache(os.path.join(self.tmpdir, 'cache'))
+        url = self.server.url('repomd.xml')
+        self.assertEquals('content', self._grab(cache, url))
+        self.assertEquals('content', self._grab(cache, url, 'out2'))
+        etag = '"%s"' % hashlib.md5('content').hexdigest()
+        self.assertEquals([('/repomd.xml', None), ('/repomd.xml', etag)],
+                          self.server.requests)
+
+        self.server.files['/repomd.xml'] = 'changed'
+        self.assertEquals('changed', self._grab(cache, url))
+
+    def test_ttl(self):
+        """test fresh entries are served without any request"""
+        cache = HTTPCache(os.path.join(self.tmpdir, 'cache'), ttl=3600)
+        url = self.server.url('repomd.xml')
+        self._grab(cache, url)
+        self.server.files['/repomd.xml'] = 'changed'
+        self.assertEquals('content', self._grab(cache, url))
+        self.assertEquals(1, len(self.server.requests))
+        # no_cache asks server again
+        fname = os.path.join(self.tmpdir, 'out')
+        URLGrabber(cache=cache).grab(url, fname, no_cache=True)
+        self.assertEquals(2, len(self.server.requests))
+
+    def test_removed_copy(self):
+        """test 304 of a removed cached copy is an error"""
+        cache = HTTPCache(os.path.join(self.tmpdir, 'cache'))
+        url = self.server.url('repomd.xml')
+        self._grab(cache, url)
+        validators = cache.validators(url)
+        os.unlink(cache._paths(url)[0])
+        self.assertEquals([], cache.validators(url))
+        fname = os.path.join(self.tmpdir, 'out')
+        self.assertRaises(UrlError, cache.update, url, fname, 304, {})
+        self.assertTrue(validators)
+
+    def test_evict(self):
+        """test least recently used entries are evicted beyond max size"""
+        cache = HTTPCache(os.path.join(self.tmpdir, 'cache'), max_size=15)
+        fname = os.path.join(self.tmpdir, 'data')
+        now = time.time()
+        for num, url in enumerate(('a', 'b', 'c')):
+            with open(fname, 'w') as fobj:
+                fobj.write('0123456789')
+            cache.update(url, fname, 200, {'etag': url})
+            # entries written before are less recently used
+            os.utime(cache._paths(url)[0], (now - 100 + num,) * 2)
+        self.assertEquals([None, None, 'c'], [
+            (cache._lookup(url) or {}).get('etag') for url in 'abc'])
+
+    def test_concurrent_write(self):
+        """test threads writing the same entry don't share temp files"""
+        path = os.path.join(self.tmpdir, 'entry')
+        threads = [threading.Thread(target=HTTPCache._write,
+                                    args=(path, 'content %d' % num * 1000))
+                   for num in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with open(path) as fobj:
+            self.assertTrue(fobj.read() in ['content %d' % num * 1000
+                                            for num in range(8)])
+        self.assertEquals(['entry'], os.listdir(self.tmpdir))
+
+
+class MultiURLGrabberTest(unittest.TestCase):
+    """Test urls are grabbed concurrently"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-multigrabber')
+        self.server = Server()
+        for num in range(5):
+            self.server.files['/file%d' % num] = 'content %d' % num
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_grab(self):
+        """test results are in order of jobs, missing urls give 404"""
+        names = ['file%d' % num for num in range(5)] + ['missing']
+        jobs = [(self.server.url(name), os.path.join(self.tmpdir, name),
+                 None, None, False) for name in names]
+        grabber = MultiURLGrabber(max_connections=2)
+        results = grabber.grab(jobs)
+        for num in range(5):
+            self.assertEquals(jobs[num][1], results[num])
+            with open(results[num]) as fobj:
+                self.assertEquals('content %d' % num, fobj.read())
+        self.assertTrue(isinstance(results[5], PageNotFound))
+        self.assertEquals(6, len([timing for timing in grabber.timings
+                                  if timing]))
+        self.assertEquals([], grabber.grab([]))
+
+    def test_cache(self):
+        """test grabbed files are revalidated with cache"""
+        cache = HTTPCache(os.path.join(self.tmpdir, 'cache'))
+        jobs = [(self.server.url('file%d' % num),
+                 os.path.join(self.tmpdir, 'file%d' % num), None, None, False)
+                for num in range(3)]
+        MultiURLGrabber(cache=cache).grab(jobs)
+        for _url, fname, _user, _passwd, _no_cache in jobs:
+            os.unlink(fname)
+        results = MultiURLGrabber(cache=cache).grab(jobs)
+        self.assertEquals([job[1] for job in jobs], results)
+        self.assertEquals(3, len([req for req in self.server.requests
+                                  if req[1]]))
+        with open(results[2]) as fobj:
+            self.assertEquals('content 2', fobj.read())
@@ -0,0 +1,154 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Functionality tests of committing files to OBS"""
+
+import os
+import sys
+import types
+import shutil
+import socket
+import httplib
+import urllib2
+import tempfile
+import unittest
+import importlib
+import threading
+
+from mock import patch
+
+import gitbuildsys
+from gitbuildsys.errors import ObsError
+
+
+def fake_modules():
+    """Minimal osc and M2Crypto modules, keyed by name"""
+    osc = types.ModuleType('osc')
+    osc.conf = types.ModuleType('osc.conf')
+    osc.conf.get_apiurl_usr = lambda apiurl: 'user'
+    osc.core = types.ModuleType('osc.core')
+    osc.core.makeurl = lambda apiurl, path, query=None: \
+        '/'.join([apiurl] + path)
+    osc.core.http_PUT = osc.core.http_POST = None
+
+    m2crypto = types.ModuleType('M2Crypto')
+    m2crypto.m2urllib2 = types.ModuleType('M2Crypto.m2urllib2')
+    m2crypto.m2urllib2.URLError = urllib2.URLError
+    m2crypto.SSL = types.ModuleType('M2Crypto.SSL')
+    m2crypto.SSL.SSLError = type('SSLError', (Exception,), {})
+    m2crypto.SSL.Checker = types.ModuleType('M2Crypto.SSL.Checker')
+    m2crypto.SSL.Checker.SSLVerificationError = \
+        type('SSLVerificationError', (Exception,), {})
+    return dict((module.__name__, module)
+                for module in (osc, osc.conf, osc.core, m2crypto,
+                               m2crypto.m2urllib2, m2crypto.SSL,
+                               m2crypto.SSL.Checker))
+
+
+class CommitFilesTest(unittest.TestCase):
+    """Test files are uploaded between posting file lists"""
+
+    def setUp(self):
+        # oscapi is imported on top of fake modules only for this test
+        self.modules = patch.dict(sys.modules, fake_modules())
+        self.modules.start()
+        self.imported = gitbuildsys.__dict__.get('oscapi')
+        sys.modules.pop('gitbuildsys.oscapi', None)
+        self.oscapi = importlib.import_module('gitbuildsys.oscapi')
+
+        self.tmpdir = tempfile.mkdtemp(prefix='test-oscapi')
+        self.files = []
+        for name in ('a.tar.gz', 'b.patch', 'c.spec'):
+            fpath = os.path.join(self.tmpdir, name)
+            with open(fpath, 'w') as fobj:
+                fobj.write(name)
+            self.files.append(fpath)
+        self.calls = []
+        self.lock = threading.Lock()
+        self.failures = {}
+        self.api = self.oscapi.OSC.__new__(self.oscapi.OSC)
+        self.api.apiurl = 'https://api.example.org'
+        oscapi = self.oscapi
+        self.patches = [patch.object(oscapi.core, 'http_PUT', self._put),
+                        patch.object(oscapi.core, 'http_POST', self._post),
+                        patch.object(oscapi, 'file_md5', lambda fpath: 'md5'),
+                        patch.object(oscapi, 'UPLOAD_RETRY_DELAY', 0)]
+        for patcher in self.patches:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+        self.modules.stop()
+        if self.imported is None:
+            gitbuildsys.__dict__.pop('oscapi', None)
+        else:
+            gitbuildsys.oscapi = self.imported
+        shutil.rmtree(self.tmpdir)
+
+    def _put(self, url, file=None):
+        """Fake http_PUT, raise failures queued for the file"""
+        name = os.path.basename(file)
+        with self.lock:
+            self.calls.append(('PUT', name))
+            failures = self.failures.get(name)
+            if failures:
+                raise failures.pop(0)
+
+    def _post(self, url, data=None, file=None):
+        """Fake http_POST"""
+        with self.lock:
+            self.calls.append(('POST', None))
+
+    def _commit(self):
+        """Commit all files, the spec isn't changed"""
+        self.api.commit_files('prj', 'pkg', [(fpath, not fpath.endswith(
+            '.spec')) for fpath in self.files], 'message')
+
+    def test_order(self):
+        """test changed files are uploaded after the first post only"""
+        self._commit()
+        self.assertEquals(('POST', None), self.calls[0])
+        self.assertEquals(['a.tar.gz', 'b.patch'],
+                          sorted(name for _method, name in self.calls[1:-1]))
+        self.assertEquals(('POST', None), self.calls[-1])
+
+    def test_retry(self):
+        """test network errors are retried"""
+        self.failures['a.tar.gz'] = [socket.error('reset'),
+                                     httplib.BadStatusLine('')]
+        self._commit()
+        self.assertEquals(3, self.calls.count(('PUT', 'a.tar.gz')))
+        self.assertEquals(('POST', None), self.calls[-1])
+
+    def test_attempts(self):
+        """test file failing every attempt fails the commit"""
+        self.failures['b.patch'] = [urllib2.URLError('timeout')] * \
+                                   self.oscapi.UPLOAD_ATTEMPTS
+        self.assertRaises(ObsError, self._commit)
+        self.assertEquals(self.oscapi.UPLOAD_ATTEMPTS,
+                          self.calls.count(('PUT', 'b.patch')))
+        self.assertEquals(1, self.calls.count(('POST', None)))
+
+    def test_client_error(self):
+        """test client errors aren't retried"""
+        self.failures['a.tar.gz'] = [urllib2.HTTPError(
+            'url', 403, 'Forbidden', {}, None)]
+        self.assertRaises(ObsError, self._commit)
+        self.assertEquals(1, self.calls.count(('PUT', 'a.tar.gz')))
+        self.assertEquals(1, self.calls.count(('POST', None)))
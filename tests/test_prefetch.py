@@ -0,0 +1,105 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Functionality tests of package prefetch"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+from gitbuildsys.prefetch import buildroot_packages, get_jobs, verify, \
+                                 prepare_cache_dirs
+from gitbuildsys.repoindex import Package, RepoIndex
+from gitbuildsys.safe_url import SafeURL
+
+from test_repoindex import PRIMARY
+
+
+class PrefetchTest(unittest.TestCase):
+    """Test finding packages to be prefetched"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-prefetch')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_buildroot_packages(self):
+        """test package names are read from build conf"""
+        conf = os.path.join(self.tmpdir, 'build.conf')
+        with open(conf, 'w') as fobj:
+            fobj.write('%define foo 1\n'
+                       'Preinstall: bash zlib\n'
+                       'required: gcc %{foo} bash\n'
+                       'Support: !zlib make\n'
+                       'Substitute: a b\n')
+        self.assertEquals(['bash', 'gcc', 'make'], buildroot_packages(conf))
+
+    def test_conditionals(self):
+        """test packages of all branches of %if are listed"""
+        conf = os.path.join(self.tmpdir, 'build.conf')
+        with open(conf, 'w') as fobj:
+            fobj.write('%if %_repository == arm\n'
+                       'Required: qemu-accel\n'
+                       '%else\n'
+                       'Required: gcc\n'
+                       '%endif\n')
+        self.assertEquals(['qemu-accel', 'gcc'], buildroot_packages(conf))
+
+    def test_prepare_cache_dirs(self):
+        """test missing cache dirs are created"""
+        dest = os.path.join(self.tmpdir, 'cache', 'abc', 'a.rpm')
+        prepare_cache_dirs([('repo', None, dest)])
+        self.assertTrue(os.access(os.path.dirname(dest), os.W_OK))
+
+    def test_get_jobs(self):
+        """test packages are resolved to files missing in cache"""
+        primary = os.path.join(self.tmpdir, 'primary.xml')
+        with open(primary, 'w') as fobj:
+            fobj.write(PRIMARY)
+        index = RepoIndex(os.path.join(self.tmpdir, 'index.db'))
+        repo = SafeURL('http://example.org/repo')
+        index.update(repo, '1', primary)
+
+        cachedir = os.path.join(self.tmpdir, 'cache')
+        cached = os.path.join(cachedir, hashlib.md5(repo).hexdigest())
+        os.makedirs(cached)
+        open(os.path.join(cached, 'bash-3.2.57-2.x86_64.rpm'), 'w').close()
+
+        jobs, num = get_jobs([repo], ['/bin/sh', 'libz.so.1()(64bit)',
+                                      'glibc'], cachedir, index)
+        self.assertEquals(1, num)
+        self.assertEquals([('zlib', os.path.join(cached,
+                                                 'zlib-1.2.7-1.1.x86_64.rpm'))],
+                          [(pkg.name, dest) for _repo, pkg, dest in jobs])
+
+    def test_verify(self):
+        """test downloaded packages are verified by size and checksum"""
+        fname = os.path.join(self.tmpdir, 'a.rpm')
+        with open(fname, 'w') as fobj:
+            fobj.write('content')
+        digest = hashlib.sha256('content').hexdigest()
+        pkg = Package('repo', 'a', 'noarch', '0', '1', '1', 'a.rpm', 7,
+                      'sha256:%s' % digest)
+        self.assertTrue(verify(fname, pkg))
+        pkg.size = 8
+        self.assertFalse(verify(fname, pkg))
+        pkg.size, pkg.checksum = 7, 'sha256:0'
+        self.assertFalse(verify(fname, pkg))
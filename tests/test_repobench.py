@@ -0,0 +1,67 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Functionality tests of gbs repo bench"""
+
+import shutil
+import tempfile
+import unittest
+
+from gitbuildsys.cmd_repo import phase_timings, bench_repo
+
+from test_httpcache import Server
+from test_repomd import REPOMD
+
+
+class BenchTest(unittest.TestCase):
+    """Test timings and failures reported for each repo"""
+
+    def test_phases(self):
+        """test cumulative curl timings are split by phase"""
+        stat = {'namelookup': 0.01, 'connect': 0.03, 'appconnect': 0.07,
+                'starttransfer': 0.12}
+        phases = phase_timings(stat)
+        self.assertEquals(['connect', 'dns', 'tls', 'ttfb'], sorted(phases))
+        for key, value in (('dns', 0.01), ('connect', 0.02), ('tls', 0.04),
+                           ('ttfb', 0.05)):
+            self.assertAlmostEquals(value, phases[key])
+
+        # plain http on a reused connection
+        stat = {'namelookup': 0, 'connect': 0, 'appconnect': 0,
+                'starttransfer': 0.02}
+        self.assertEquals({'dns': 0, 'connect': 0, 'tls': 0, 'ttfb': 0.02},
+                          phase_timings(stat))
+
+    def test_missing(self):
+        """test 404 of layout probes isn't counted as failure"""
+        tmpdir = tempfile.mkdtemp(prefix='test-repobench')
+        server = Server()
+        try:
+            server.files['/repo/repodata/repomd.xml'] = REPOMD
+            result = bench_repo(server.url('repo'), tmpdir)
+            other = bench_repo(server.url('other'), tmpdir)
+        finally:
+            server.stop()
+            shutil.rmtree(tmpdir)
+        # build conf referred by repomd.xml is missing
+        self.assertEquals((None, 2, 0, 1),
+                          (result['error'], result['requests'],
+                           result['missing'], result['failed']))
+        self.assertEquals(None, result['tls'])
+        self.assertEquals((other['requests'], 0),
+                          (other['missing'], other['failed']))
@@ -0,0 +1,90 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Functionality tests of repo index"""
+
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+
+from gitbuildsys.repoindex import RepoIndex
+
+
+PRIMARY = '''<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common"
+          xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="2">
+<package type="rpm">
+  <name>zlib</name><arch>x86_64</arch>
+  <version epoch="0" ver="1.2.7" rel="1.1"/>
+  <location href="x86_64/zlib-1.2.7-1.1.x86_64.rpm"/>
+  <format><rpm:provides>
+    <rpm:entry name="libz.so.1()(64bit)"/>
+    <rpm:entry name="zlib" flags="EQ" epoch="0" ver="1.2.7" rel="1.1"/>
+  </rpm:provides></format>
+</package>
+<package type="rpm">
+  <name>bash</name><arch>x86_64</arch>
+  <version epoch="1" ver="3.2.57" rel="2"/>
+  <location href="x86_64/bash-3.2.57-2.x86_64.rpm"/>
+  <format><file>/bin/sh</file></format>
+</package>
+</metadata>
+'''
+
+class RepoIndexTest(unittest.TestCase):
+    """Test indexing and querying primary metadata"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-repoindex')
+        self.primary = os.path.join(self.tmpdir, 'primary.xml.gz')
+        fobj = gzip.open(self.primary, 'wb')
+        fobj.write(PRIMARY)
+        fobj.close()
+        self.index = RepoIndex(os.path.join(self.tmpdir, 'index.db'))
+        self.index.update('http://example.org/repo', '100', self.primary)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_whatprovides(self):
+        """test packages are found by provides, files and globs"""
+        pkgs = self.index.whatprovides('libz.so.1()(64bit)')
+        self.assertEquals([('zlib', '1.2.7-1.1', 'x86_64/zlib-1.2.7-1.1'
+                            '.x86_64.rpm')],
+                          [(pkg.name, pkg.evr, pkg.location) for pkg in pkgs])
+        self.assertEquals(['bash'], [pkg.name for pkg in
+                                     self.index.whatprovides('/bin/sh')])
+        self.assertEquals('1:3.2.57-2',
+                          self.index.whatprovides('ba*')[0].evr)
+        self.assertEquals([], self.index.whatprovides('zlib', ['other']))
+        self.assertEquals(['glibc'], self.index.missing(
+            ['zlib', 'glibc'], ['http://example.org/repo']))
+
+    def test_update(self):
+        """test repos are indexed again with new revision"""
+        self.assertEquals('100', self.index.revision('http://example.org/repo'))
+        self.index.update('http://example.org/repo', '101', self.primary)
+        self.assertEquals([('http://example.org/repo', '101', 2)],
+                          [(url, rev, count) for url, rev, _time, count
+                           in self.index.repos()])
+        self.assertEquals(1, len(self.index.whatprovides('zlib')))
+        self.index.remove('http://example.org/repo')
+        self.assertEquals(None, self.index.revision('http://example.org/repo'))
+        self.assertEquals([], self.index.whatprovides('zlib'))
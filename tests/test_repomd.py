@@ -0,0 +1,108 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Functionality tests of repomd.xml parsing"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from gitbuildsys.safe_url import SafeURL
+from gitbuildsys.utils import RepoMD, RepoParser, MirrorRanking
+
+from test_httpcache import Server
+
+
+REPOMD = '''<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <revision>1357000001</revision>
+  <data type="primary">
+    <checksum type="sha256">abc</checksum>
+    <location href="repodata/abc-primary.xml.gz"/>
+  </data>
+  <data type="build">
+    <checksum type="sha">def</checksum>
+    <location href="repodata/def-build.conf.gz"/>
+  </data>
+</repomd>
+'''
+
+
+class RepoMDTest(unittest.TestCase):
+    """Test repomd.xml is parsed once per repo"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-repomd')
+        self.server = Server()
+        self.server.files['/repo/repodata/repomd.xml'] = REPOMD
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse(self):
+        """test revision, locations and checksums"""
+        fname = os.path.join(self.tmpdir, 'repomd.xml')
+        with open(fname, 'w') as fobj:
+            fobj.write(REPOMD)
+        repomd = RepoMD(fname)
+        self.assertEquals('1357000001', repomd.revision)
+        self.assertEquals('repodata/abc-primary.xml.gz',
+                          repomd.location('primary'))
+        self.assertEquals(('sha', 'def'), repomd.data['build']['checksum'])
+        self.assertEquals(None, repomd.location('other'))
+
+    def test_bad_xml(self):
+        """test malformed repomd.xml gives no data"""
+        fname = os.path.join(self.tmpdir, 'repomd.xml')
+        with open(fname, 'w') as fobj:
+            fobj.write('<repomd')
+        repomd = RepoMD(fname)
+        self.assertEquals(None, repomd.revision)
+        self.assertEquals({}, repomd.data)
+
+    def test_get_repomd(self):
+        """test repomd.xml of each repo is fetched only once per run"""
+        parser = RepoParser([], self.tmpdir)
+        repo = self.server.url('repo')
+        self.assertEquals('1357000001', parser.get_repomd(repo).revision)
+        self.assertTrue(parser.is_standard_repo(repo))
+        self.assertEquals(parser.get_repomd(repo),
+                          parser.get_repomd(self.server.url('repo/')))
+        self.assertEquals(1, len(self.server.requests))
+
+        missing = self.server.url('missing')
+        self.assertEquals(None, parser.get_repomd(missing))
+        self.assertFalse(parser.is_standard_repo(missing))
+        self.assertEquals(2, len(self.server.requests))
+
+        self.assertEquals({str(repo): '1357000001'},
+                          parser.get_revisions([repo, missing]))
+
+    def test_failover(self):
+        """test revision of repo failed over to another mirror is known"""
+        dead = SafeURL('http://127.0.0.1:1/')
+        mirrors = MirrorRanking(os.path.join(self.tmpdir, 'mirrors.json'))
+        mirrors.add([dead, self.server.url()])
+        parser = RepoParser([], self.tmpdir, mirrors=mirrors)
+        repo = dead.pathjoin('repo')
+        self.assertEquals('1357000001', parser.get_repomd(repo).revision)
+        self.assertEquals(self.server.url('repo'), mirrors.best(repo))
+        self.assertEquals({str(self.server.url('repo')): '1357000001'},
+                          parser.get_revisions([mirrors.best(repo)]))
@@ -0,0 +1,125 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Functionality tests of spec cache"""
+
+import os
+import sys
+import types
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from gitbuildsys.speccache import SpecCache, SpecInfo
+
+
+SPEC = '''Name: test
+Version: 1.0
+Release: 1
+Source0: test-1.0.tar.gz
+Source1: %{name}-macros.inc
+%include %{SOURCE1}
+'''
+
+
+class FakePackage(object):
+    """Package of rpm spec object"""
+
+    def __init__(self, name, provides):
+        self.header = {'name': name, 'providename': provides}
+
+
+def fake_rpm(parsed):
+    """rpm module parsing every spec the same, appending file names"""
+    rpm = types.ModuleType('rpm')
+    rpm.error = type('error', (Exception,), {})
+    rpm.addMacro = rpm.delMacro = lambda *args: None
+    def spec(fname):
+        """parsed spec"""
+        parsed.append(fname)
+        result = types.ModuleType('spec')
+        result.sourceHeader = {'name': 'test', 'epoch': 1, 'version': '1.0',
+                               'release': '1', 'requirename': ['zlib', 'gcc',
+                                                               'zlib']}
+        result.packages = [FakePackage('test', ['test', 'libtest.so']),
+                           FakePackage('test-devel', ['test-devel'])]
+        return result
+    rpm.spec = spec
+    return rpm
+
+
+class SpecCacheTest(unittest.TestCase):
+    """Test parsed specs are keyed by all files they are parsed from"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-speccache')
+        self.cache = SpecCache(os.path.join(self.tmpdir, 'specs.db'))
+        self.spec = os.path.join(self.tmpdir, 'test.spec')
+        with open(self.spec, 'w') as fobj:
+            fobj.write(SPEC)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, name, content):
+        """Write file in spec dir"""
+        with open(os.path.join(self.tmpdir, name), 'w') as fobj:
+            fobj.write(content)
+
+    def _entries(self):
+        """Number of cached entries"""
+        return self.cache._connect().execute(
+            'SELECT COUNT(*) FROM specs').fetchone()[0]
+
+    def test_includes(self):
+        """test included files are part of the key, recursively"""
+        self._write('test-macros.inc', '%include common.inc\n')
+        self._write('common.inc', 'BuildRequires: zlib\n')
+        ids = self.cache.includes(self.spec, SPEC)
+        self.assertEquals(2, len(ids))
+        self.assertEquals('test', self.cache.parse(self.spec).name)
+        self.cache.parse(self.spec)
+        self.assertEquals(1, self._entries())
+
+        self._write('common.inc', 'BuildRequires: bzip2\n')
+        self.assertNotEquals(ids, self.cache.includes(self.spec, SPEC))
+        self.cache.parse(self.spec)
+        self.assertEquals(2, self._entries())
+
+    def test_missing_include(self):
+        """test specs including unknown files are never cached"""
+        self.assertEquals(None, self.cache.includes(self.spec, SPEC))
+        self.assertEquals(None, self.cache.includes(
+            self.spec, '%include %{_datadir}/macros.inc\n'))
+        self.assertEquals('test', self.cache.parse(self.spec).name)
+        self.assertEquals(0, self._entries())
+
+    def test_from_file(self):
+        """test spec is parsed once by rpm for all fields"""
+        parsed = []
+        with patch.dict(sys.modules, {'rpm': fake_rpm(parsed)}):
+            info = SpecInfo.from_file(self.spec)
+        self.assertEquals([self.spec], parsed)
+        self.assertEquals(('test', '1', '1.0', '1'),
+                          (info.name, info.epoch, info.upstreamversion,
+                           info.release))
+        self.assertEquals(['test', 'test-devel'], info.packages)
+        self.assertEquals(['gcc', 'zlib'], info.buildrequires)
+        self.assertEquals(['libtest.so', 'test', 'test-devel'], info.provides)
@@ -0,0 +1,200 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Functionality tests of git helpers, file locks and mounts in utils"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from gitbuildsys.utils import GitObjectReader, guess_spec, \
+                              show_file_from_rev, file_exists_in_rev, \
+                              glob_in_rev, git_status, _parse_status, \
+                              git_dir, FileLock, mount_points, call_in_dir
+from gitbuildsys.errors import GbsError
+
+
+class GitObjectReaderTest(unittest.TestCase):
+    """Test reading objects of git repository"""
+
+    def setUp(self):
+        self.repo = tempfile.mkdtemp(prefix='test-gitobjects')
+        os.makedirs(os.path.join(self.repo, 'sub', 'packaging'))
+        for name in ('a.spec', 'b.spec', 'a.changes'):
+            with open(os.path.join(self.repo, 'sub', 'packaging', name),
+                      'w') as fobj:
+                fobj.write('content of %s\n' % name)
+        os.symlink('sub/packaging', os.path.join(self.repo, 'packaging'))
+        for cmd in (['init', '-q'], ['add', '.'],
+                    ['-c', 'user.name=test', '-c', 'user.email=t@example.org',
+                     'commit', '-q', '-m', 'init']):
+            subprocess.check_call(['git'] + cmd, cwd=self.repo)
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+
+    def test_reader(self):
+        """test blobs, trees and missing objects"""
+        reader = GitObjectReader(self.repo)
+        self.assertEquals(('blob', 'content of a.spec\n'),
+                          reader.read('HEAD:sub/packaging/a.spec'))
+        self.assertEquals('tree', reader.info('HEAD:sub')[1])
+        self.assertEquals(None, reader.read('HEAD:missing'))
+        self.assertEquals(None, reader.info('HEAD:missing file'))
+        self.assertEquals(None, reader.read('HEAD:sub/missing file.spec'))
+        self.assertEquals(('blob', 'content of b.spec\n'),
+                          reader.read('HEAD:sub/packaging/b.spec'))
+        self.assertEquals([('100644', 'a.changes'), ('100644', 'a.spec'),
+                           ('100644', 'b.spec')],
+                          reader.list_tree('HEAD:sub/packaging'))
+        reader.close()
+        self.assertEquals(None, reader.list_tree('HEAD:sub/packaging/a.spec'))
+
+    def test_helpers(self):
+        """test helpers looking up files in revision"""
+        self.assertEquals('content of b.spec\n', show_file_from_rev(
+            self.repo, 'sub/packaging/b.spec', 'HEAD'))
+        self.assertEquals(None, show_file_from_rev(self.repo, 'sub', 'HEAD'))
+        self.assertTrue(file_exists_in_rev(self.repo, 'sub', 'HEAD', True))
+        self.assertFalse(file_exists_in_rev(self.repo, 'sub/packaging/a.spec',
+                                            'HEAD', True))
+        self.assertEquals(['sub/packaging/a.spec', 'sub/packaging/b.spec'],
+                          sorted(glob_in_rev(self.repo, 'sub/packaging/*.spec',
+                                             'HEAD')))
+        self.assertEquals(['sub/packaging/a.spec', ['sub/packaging/b.spec']],
+                          guess_spec(self.repo, 'packaging', 'a.spec', 'HEAD'))
+
+    def test_guess_spec_untracked(self):
+        """test guess_spec of working copy doesn't depend on current dir"""
+        main_spec, rest_specs = guess_spec(self.repo, 'packaging', 'b.spec')
+        self.assertEquals('sub/packaging/b.spec', main_spec)
+        self.assertEquals(['sub/packaging/a.spec'], rest_specs)
+
+    def test_git_status(self):
+        """test status of working tree in porcelain v2 and v1"""
+        self.assertEquals({}, git_status(self.repo))
+        with open(os.path.join(self.repo, 'sub', 'packaging', 'a.spec'),
+                  'a') as fobj:
+            fobj.write('changed\n')
+        with open(os.path.join(self.repo, 'new file'), 'w') as fobj:
+            fobj.write('new\n')
+        subprocess.check_call(['git', 'mv', 'sub/packaging/b.spec', 'c.spec'],
+                              cwd=self.repo)
+        expected = {' M': ['sub/packaging/a.spec'], 'R ': ['c.spec'],
+                    '??': ['new file']}
+        self.assertEquals(expected, git_status(self.repo))
+        self.assertEquals(expected, _parse_status(
+            ' M sub/packaging/a.spec\0R  c.spec\0sub/packaging/b.spec\0'
+            '?? new file\0', 1))
+
+    def test_git_dir(self):
+        """test .git dir is found from sub dirs"""
+        self.assertEquals(os.path.realpath(os.path.join(self.repo, '.git')),
+                          os.path.realpath(git_dir(os.path.join(self.repo,
+                                                                'sub'))))
+
+
+class FileLockTest(unittest.TestCase):
+    """Test file locks exclude other processes"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-filelock')
+        self.path = os.path.join(self.tmpdir, 'sub', 'test.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_lock(self):
+        """test lock is held until released"""
+        lock = FileLock(self.path)
+        self.assertTrue(lock.acquire(blocking=False))
+        # flock of another open file description conflicts
+        self.assertFalse(FileLock(self.path).acquire(blocking=False))
+        lock.release()
+        with FileLock(self.path):
+            self.assertFalse(lock.acquire(blocking=False))
+        self.assertTrue(lock.acquire(blocking=False))
+        lock.release()
+
+
+def _exit(code):
+    """Exit like main() of a command"""
+    raise SystemExit(code)
+
+def _cwd(arg):
+    """Current directory with arg"""
+    return os.getcwd(), arg
+
+
+class CallInDirTest(unittest.TestCase):
+    """Test functions are called in a child working in other dir"""
+
+    def setUp(self):
+        self.tmpdir = os.path.realpath(tempfile.mkdtemp(prefix='test-indir'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_call(self):
+        """test result and exceptions are passed back, cwd isn't changed"""
+        cwd = os.getcwd()
+        self.assertEquals((self.tmpdir, 'a'),
+                          call_in_dir(self.tmpdir, _cwd, 'a'))
+        self.assertEquals(cwd, os.getcwd())
+        self.assertRaises(ValueError, call_in_dir, self.tmpdir, int, 'a')
+        self.assertRaises(SystemExit, call_in_dir, self.tmpdir, _exit, 2)
+        self.assertRaises(GbsError, call_in_dir,
+                          os.path.join(self.tmpdir, 'missing'), os.getcwd)
+
+    def test_killed(self):
+        """test child killed before returning is an error"""
+        self.assertRaises(GbsError, call_in_dir, self.tmpdir, os.abort)
+
+
+MOUNTINFO = r"""22 1 8:1 / / rw,relatime - ext4 /dev/sda1 rw
+40 22 0:5 / /gbs/local/scratch.i586.0/proc rw - proc proc rw
+41 22 8:1 /src /gbs/local/scratch.i586.0/home/abuild/my\040pkg rw - ext4 /dev/sda1 rw
+42 22 8:1 / /gbs/local/scratch.i586.10 rw - ext4 /dev/sda1 rw
+"""
+
+
+class MountPointsTest(unittest.TestCase):
+    """Test mounts under build roots are found"""
+
+    def test_mount_points(self):
+        """test mounts at or under path, with escaped names"""
+        tmpdir = tempfile.mkdtemp(prefix='test-mounts')
+        try:
+            mountinfo = os.path.join(tmpdir, 'mountinfo')
+            with open(mountinfo, 'w') as fobj:
+                fobj.write(MOUNTINFO)
+            self.assertEquals(['/gbs/local/scratch.i586.0/proc',
+                               '/gbs/local/scratch.i586.0/home/abuild/my pkg'],
+                              mount_points('/gbs/local/scratch.i586.0/',
+                                           mountinfo))
+            self.assertEquals(['/gbs/local/scratch.i586.10'],
+                              mount_points('/gbs/local/scratch.i586.10',
+                                           mountinfo))
+            self.assertEquals([], mount_points('/gbs/local/bases', mountinfo))
+            self.assertEquals([], mount_points('/gbs', os.path.join(
+                tmpdir, 'missing')))
+            self.assertEquals([], mount_points(tmpdir))
+        finally:
+            shutil.rmtree(tmpdir)